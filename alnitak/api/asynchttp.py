@@ -0,0 +1,386 @@
+
+import ssl
+import json
+import asyncio
+import threading
+from urllib.parse import urlsplit, urlencode
+
+
+class HTTPError(Exception):
+    """Base class for exceptions raised by the client."""
+    def __init__(self, message=None):
+        self.message = message
+
+    def __str__(self):
+        return "{}".format(self.message)
+
+class Timeout(HTTPError):
+    """Raised if a connection or response is not made in time."""
+
+class ConnectionError(HTTPError):
+    """Raised if a connection cannot be made, or is lost."""
+
+
+class Headers(dict):
+    """HTTP headers, with case-insensitive names."""
+
+    def __init__(self, items=()):
+        super().__init__()
+        for k, v in items:
+            self[k] = v
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key.lower(), value)
+
+    def __getitem__(self, key):
+        return super().__getitem__(key.lower())
+
+    def __contains__(self, key):
+        return super().__contains__(key.lower())
+
+    def get(self, key, default=None):
+        return super().get(key.lower(), default)
+
+class Response:
+    """An HTTP response.
+
+    The attributes used by the Cloudflare calls are named as in
+    'requests.Response', so that either can be used.
+
+    Attributes:
+        status_code (int): the HTTP status code.
+        headers (Headers): the HTTP headers.
+        content (bytes): the body of the response.
+    """
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        """Return the decoded JSON body (raises ValueError if not JSON)."""
+        return json.loads(self.content.decode())
+
+
+class Outcome:
+    """The outcome of a request made by 'Client.request_all'.
+
+    Attributes:
+        response (Response): the response, or else 'None' if the request
+            failed.
+        error (HTTPError): the reason the request failed, or else 'None'.
+    """
+
+    def __init__(self, result):
+        if isinstance(result, HTTPError):
+            self.response = None
+            self.error = result
+        elif isinstance(result, BaseException):
+            # not raised by the client itself: let it propagate
+            raise result
+        else:
+            self.response = result
+            self.error = None
+
+    def result(self):
+        """Return the response, or raise the reason the request failed."""
+        if self.error:
+            raise self.error
+        return self.response
+
+
+class Client:
+    """An asyncio HTTP/1.1 client for one server.
+
+    The client runs an event loop in its own (daemon) thread, and requests
+    can be made from any number of threads: they are all multiplexed by
+    the one event loop over a pool of (at most) 'connections' kept-alive
+    connections to the server. A request waits for a free connection if
+    they are all in use. Many requests can also be made together, from one
+    thread (see 'request_all'). The client must be closed once it is no
+    longer needed (see 'close').
+
+    Attributes:
+        scheme (str): either 'http' or 'https'.
+        host (str): the host of the server.
+        port (int): the port of the server.
+        headers (dict): headers sent with every request.
+        connections (int): the maximum number of connections.
+        opened (int): the number of connections opened so far.
+        closed (bool): whether the client was closed.
+        loop (asyncio.AbstractEventLoop): the event loop of the client.
+    """
+
+    def __init__(self, url, headers={}, connections=1):
+        parts = urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.headers = dict(headers)
+        self.connections = max(1, connections)
+        self.opened = 0
+
+        self.idle = []
+        self.ssl = ssl.create_default_context() if self.scheme == 'https' \
+                                                                    else None
+
+        self.closed = False
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       daemon=True)
+        self.thread.start()
+
+        # the semaphore must be made in the event loop's thread
+        self.slots = self.call(self.make_slots())
+
+    async def make_slots(self):
+        return asyncio.Semaphore(self.connections)
+
+    def call(self, coroutine):
+        """Run a coroutine in the event loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def request(self, method, url, params=None, data=None, timeout=None):
+        """Make an HTTP request.
+
+        Args:
+            method (str): the HTTP method (e.g. 'GET').
+            url (str): the url of the request. Only the path and query of
+                the url are used: the request is always made to the server
+                of the client.
+            params (dict): query parameters to add to the url.
+            data (str): the body of the request.
+            timeout ((float, float)): the connect and read timeouts, in
+                seconds.
+
+        Returns:
+            Response: the response.
+
+        Raises:
+            Timeout: if a connection or response is not made in time.
+            ConnectionError: if a connection cannot be made, or is lost.
+        """
+        return self.request_all([ (method, url,
+                                   { 'params': params, 'data': data,
+                                     'timeout': timeout }) ])[0].result()
+
+    def request_all(self, requests):
+        """Make HTTP requests together.
+
+        The requests are all sent at once (as far as the pool of
+        connections allows), and their responses read as they arrive.
+
+        Args:
+            requests (list((str, str, dict))): the method, url and keyword
+                arguments (see 'request') of every request.
+
+        Returns:
+            list(Outcome): the outcome of every request, in order.
+        """
+        if self.closed:
+            raise ConnectionError("client closed")
+
+        async def send_all():
+            return await asyncio.gather(
+                        *[ self.send(*self.prepare(method, url, **kwargs))
+                                            for method, url, kwargs in requests ],
+                        return_exceptions=True)
+
+        return [ Outcome(r) for r in self.call(send_all()) ]
+
+    def prepare(self, method, url, params=None, data=None, timeout=None):
+        """Return the arguments of 'send' for a request (see 'request')."""
+        parts = urlsplit(url)
+        target = parts.path or '/'
+        query = parts.query
+        if params:
+            query = "&".join([ q for q in [ query, urlencode(params) ] if q ])
+        if query:
+            target += "?" + query
+
+        if isinstance(data, str):
+            data = data.encode()
+
+        if timeout is None:
+            timeout = (None, None)
+
+        return (method, target, data or b'', timeout)
+
+    def close(self):
+        """Close all the connections and stop the event loop."""
+        async def close_all():
+            for reader, writer in self.idle:
+                writer.close()
+            self.idle = []
+
+        if self.closed:
+            return
+        self.closed = True
+        self.call(close_all())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def connect(self, timeout):
+        try:
+            conn = await asyncio.wait_for(
+                        asyncio.open_connection(self.host, self.port,
+                            ssl=self.ssl,
+                            server_hostname=self.host if self.ssl else None),
+                        timeout)
+        except asyncio.TimeoutError:
+            raise Timeout("connect timed out")
+        except OSError as ex:
+            raise ConnectionError("{}".format(ex))
+        self.opened += 1
+        return conn
+
+    async def send(self, method, target, data, timeout):
+        async with self.slots:
+            while self.idle:
+                reader, writer = self.idle.pop()
+                if reader.at_eof():
+                    writer.close()
+                    continue
+                try:
+                    return await self.exchange(reader, writer, method,
+                                               target, data, timeout)
+                except EOFError:
+                    # the server closed the (idle) connection before the
+                    # request was read: retry with another one
+                    writer.close()
+
+            reader, writer = await self.connect(timeout[0])
+            try:
+                return await self.exchange(reader, writer, method, target,
+                                           data, timeout)
+            except EOFError:
+                writer.close()
+                raise ConnectionError("connection closed by server")
+
+    async def exchange(self, reader, writer, method, target, data, timeout):
+        """Send a request over a connection and read its response.
+
+        The connection is returned to the pool of idle connections if it
+        can be reused, and closed otherwise.
+
+        Raises:
+            EOFError: if the connection was closed before any of the
+                response was read.
+        """
+        head = [ "{} {} HTTP/1.1".format(method, target),
+                 "Host: {}".format(self.host),
+                 "Content-Length: {}".format(len(data)) ]
+        head += [ "{}: {}".format(k, v) for k, v in self.headers.items() ]
+
+        try:
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + data)
+            await writer.drain()
+        except OSError:
+            # e.g. the server reset the (idle) connection
+            raise EOFError()
+
+        try:
+            status, headers, content, close = await asyncio.wait_for(
+                                self.read_response(reader, method), timeout[1])
+        except EOFError:
+            raise
+        except asyncio.TimeoutError:
+            writer.close()
+            raise Timeout("request timed out")
+        except ConnectionError:
+            writer.close()
+            raise
+        except OSError as ex:
+            writer.close()
+            raise ConnectionError("{}".format(ex))
+
+        if close or reader.at_eof():
+            writer.close()
+        else:
+            self.idle += [ (reader, writer) ]
+
+        return Response(status, headers, content)
+
+    async def read_response(self, reader, method):
+        """Read a response, skipping any interim (1xx) responses.
+
+        The body of a response is read by its 'Content-Length' or chunked
+        encoding. Responses to 'HEAD' requests, and those with status 204
+        or 304, have no body. Only if the server is closing the connection
+        is the body read until the connection closes: otherwise a response
+        without a length would leave the read waiting for the timeout.
+
+        Returns:
+            (int, Headers, bytes, bool): the status, headers and body of
+                the response, and whether the connection must be closed.
+
+        Raises:
+            EOFError: if the connection was closed before any of the
+                response was read.
+        """
+        interim = False
+        while True:
+            line = await reader.readline()
+            if not line and interim:
+                raise ConnectionError("connection closed by server")
+            if not line:
+                raise EOFError()
+
+            try:
+                version = line.split()[0]
+                status = int(line.split()[1])
+            except (IndexError, ValueError):
+                raise ConnectionError("malformed HTTP status line")
+
+            headers = Headers()
+            while True:
+                line = await reader.readline()
+                if not line:
+                    raise ConnectionError("connection closed by server")
+                line = line.decode('latin-1').rstrip('\r\n')
+                if not line:
+                    break
+                name, sep, value = line.partition(':')
+                headers[name.strip()] = value.strip()
+
+            # an interim response (e.g. '100 Continue') has no body, and is
+            # followed by the final response
+            if status >= 200:
+                break
+            interim = True
+
+        connection = headers.get('Connection', '').lower()
+        close = (connection == 'close'
+                 or (version == b'HTTP/1.0' and connection != 'keep-alive'))
+
+        try:
+            if method.upper() == 'HEAD' or status in [ 204, 304 ]:
+                content = b''
+            elif headers.get('Transfer-Encoding', '').lower() == 'chunked':
+                chunks = []
+                while True:
+                    size = int((await reader.readline()).split(b';')[0], 16)
+                    if size == 0:
+                        # trailers, up to the blank line
+                        while (await reader.readline()).strip():
+                            pass
+                        break
+                    chunks += [ await reader.readexactly(size) ]
+                    await reader.readline()
+                content = b''.join(chunks)
+            elif 'Content-Length' in headers:
+                content = await reader.readexactly(
+                                            int(headers['Content-Length']))
+            elif close:
+                # the body ends when the connection is closed
+                content = await reader.read()
+            else:
+                raise ConnectionError("HTTP response without a length")
+        except ValueError:
+            raise ConnectionError("malformed HTTP response")
+        except asyncio.IncompleteReadError:
+            raise ConnectionError("connection closed by server")
+
+        return (status, headers, content, close)
@@ -1,11 +1,216 @@
 
+import os
 import re
+import json
+import time
 import shlex
+import random
+import tempfile
+import threading
 
 from alnitak import exceptions as Except
 from alnitak import prog as Prog
 
 
+# Cloudflare error codes for an unrecognized zone (identifier)
+zone_error_codes = [ 1001, 1003, 7000, 7003 ]
+
+# number of records to request per page when listing the TLSA records
+records_per_page = 100
+
+# Cloudflare's rate limit: requests allowed per period (seconds), per account
+rate_limit_requests = 1200
+rate_limit_period = 300
+
+# retries of throttled (or failed) calls: the first delay and the maximum
+# delay (seconds) of the exponential backoff, and the maximum number of
+# attempts of a call
+retry_backoff = 1.0
+retry_backoff_max = 60.0
+retry_attempts = 6
+
+# HTTP methods that may be retried after a server error, since repeating
+# them does not make any further changes
+idempotent_methods = [ "GET", "HEAD", "PUT", "DELETE" ]
+
+# error codes of a native call rejected for exceeding the rate limit: the
+# HTTP status, or Cloudflare's own error code
+rate_limit_error_codes = [ 429, 971 ]
+
+
+class RequestScheduler:
+    """Token bucket scheduler for the calls made with a Cloudflare account.
+
+    Every call takes a token from the bucket, which is refilled at the
+    rate of Cloudflare's rate limit; if the bucket is empty, the call waits
+    for the next token. The rate limit headers of the responses are
+    followed: if Cloudflare says fewer requests remain than there are
+    tokens, the tokens are reduced, and if it says to wait (or no requests
+    remain), no calls are made until then.
+
+    Attributes:
+        capacity (float): the maximum number of tokens.
+        rate (float): the number of tokens added per second.
+        tokens (float): the number of tokens in the bucket. This is
+            negative if calls are waiting for tokens.
+        updated (float): the (monotonic) time the tokens were last updated.
+        blocked (float): the (monotonic) time before which no calls should
+            be made.
+        throttled (int): the number of calls that had to wait, either for a
+            token or because Cloudflare rejected them (HTTP 429).
+        retried (int): the number of calls that were retried.
+        waited (float): the total number of seconds spent waiting to retry
+            calls.
+        lock (threading.Lock): lock that must be held to change the
+            attributes above.
+    """
+
+    def __init__(self, requests=None, period=None):
+        if requests is None:
+            requests = rate_limit_requests
+        if period is None:
+            period = rate_limit_period
+        self.capacity = float(requests)
+        self.rate = requests / period
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked = 0.0
+        self.throttled = 0
+        self.retried = 0
+        self.waited = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, waiting for one if needed.
+
+        Returns:
+            float: the number of seconds waited.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            wait = max(0.0, self.blocked - now)
+            if self.tokens < 1:
+                wait = max(wait, (1 - self.tokens) / self.rate)
+            # the token is taken now, even if we need to wait for it, so
+            # that calls waiting concurrently queue up behind each other
+            self.tokens -= 1
+            if wait > 0:
+                self.throttled += 1
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def update(self, headers, status):
+        """Follow the rate limit headers of a response.
+
+        Both the 'Retry-After' header (in seconds) and the 'Ratelimit'
+        header (e.g. '"default";r=50;t=30': 'r' requests remain for the
+        next 't' seconds) are recognized.
+
+        Args:
+            headers (dict): the HTTP headers of the response.
+            status (int): the HTTP status code of the response.
+
+        Returns:
+            float: the number of seconds to wait before retrying, if
+                Cloudflare says so, otherwise 'None'.
+        """
+        retry_after = None
+        try:
+            retry_after = float(headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            pass
+
+        remaining = None
+        reset = None
+        m = re.search(r'\br=(\d+)', headers.get('Ratelimit') or '')
+        if m:
+            remaining = int(m.group(1))
+            m = re.search(r'\bt=(\d+)', headers.get('Ratelimit'))
+            if m:
+                reset = int(m.group(1))
+
+        with self.lock:
+            now = time.monotonic()
+            if status == 429:
+                self.throttled += 1
+            if remaining is not None:
+                self.tokens = min(self.tokens, float(remaining))
+                if remaining == 0 and reset:
+                    self.blocked = max(self.blocked, now + reset)
+            if retry_after is not None:
+                self.blocked = max(self.blocked, now + retry_after)
+
+        return retry_after
+
+    def retry_delay(self, api, attempt, retry_after=None):
+        """Return the delay before retrying a call, if it may be retried.
+
+        The delay is a random ('full jitter') exponential backoff, but no
+        less than what Cloudflare asked for. A call may be retried if the
+        time spent waiting to retry calls (in this run) stays within the
+        retry budget of the api object.
+
+        Args:
+            api (ApiCloudflare): contains the retry budget.
+            attempt (int): the number of attempts of the call so far.
+            retry_after (float): the delay asked for by Cloudflare.
+
+        Returns:
+            float: the number of seconds to wait, or 'None' if the call may
+                not be retried.
+        """
+        if attempt >= retry_attempts:
+            return None
+
+        delay = random.uniform(0, min(retry_backoff_max,
+                                      retry_backoff * 2 ** (attempt - 1)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+
+        with self.lock:
+            if self.waited + delay > api.retry:
+                return None
+            self.waited += delay
+            self.retried += 1
+        return delay
+
+def api_close(prog):
+    """Close the HTTP sessions, and log the calls that were throttled or
+    retried in this run.
+
+    The counts of the request scheduler of every account are logged at the
+    'normal' level if any calls were throttled or retried, and otherwise at
+    the 'verbose' level.
+
+    Args:
+        prog (State): 'prog.sessions' is emptied.
+    """
+    with prog.sessions_lock:
+        sessions = list(prog.sessions.values())
+        prog.sessions = { }
+        schedulers = list(prog.schedulers.values())
+
+    for session in sessions:
+        session.close()
+
+    for scheduler in schedulers:
+        with scheduler.lock:
+            throttled = scheduler.throttled
+            retried = scheduler.retried
+            waited = scheduler.waited
+
+        message = "+++ Cloudflare calls: {} throttled, {} retried ({:.1f} seconds spent waiting to retry)".format(throttled, retried, waited)
+        if throttled or retried:
+            prog.log.info1(message)
+        else:
+            prog.log.info2(message)
+
 def get_errors(response):
     """Extract error messages from the JSON response.
 
@@ -54,17 +259,283 @@ def get_errors(response):
 
     return errors
 
+def get_session(prog, api):
+    """Return the HTTP session of the api object, creating it if needed.
+
+    The session is kept in the api object and reused for every fallback
+    call made with it, so that the connection to the Cloudflare API is
+    kept open (and pooled) rather than remade for every request. One
+    session is made per account (and is shared by all the api objects of
+    that account). The login details are set as headers of the session.
+
+    If the api object uses the 'async' client, the session is an
+    asynchttp.Client instead: this multiplexes the calls made by all the
+    threads processing data groups over one event loop and a pool of
+    connections.
+
+    Args:
+        prog (State): a session may be added to 'prog.sessions'.
+        api (ApiCloudflare): contains Cloudflare login details: its
+            'session' is set.
+
+    Returns:
+        requests.Session: the session object (or asynchttp.Client).
+    """
+    # a client is closed (by 'api_close') at the end of the run
+    if api.session and not getattr(api.session, 'closed', False):
+        return api.session
+
+    import requests
+
+    headers = { "X-Auth-Email": api.email,
+                "X-Auth-Key": api.key,
+                "Content-Type": "application/json" }
+
+    with prog.sessions_lock:
+        if api.client == "async":
+            # the client is bound to the server
+            key = (api.email, api.key, api.url)
+        else:
+            key = (api.email, api.key)
+
+        session = prog.sessions.get(key)
+        if not session and api.client == "async":
+            # imported only here: it needs a later Python than the rest of
+            # the module
+            from alnitak.api import asynchttp
+            session = asynchttp.Client(api.url, headers, prog.jobs)
+            prog.sessions[key] = session
+        elif not session:
+            session = requests.Session()
+            session.headers.update(headers)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                    pool_maxsize=prog.jobs)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            prog.sessions[key] = session
+
+    api.session = session
+    return session
+
+def get_scheduler(prog, api):
+    """Return the request scheduler of the api object, creating it if needed.
+
+    One scheduler is made per account (and is shared by all the api objects
+    of that account), since Cloudflare's rate limits apply to the account.
+
+    Args:
+        prog (State): a scheduler may be added to 'prog.schedulers'.
+        api (ApiCloudflare): contains Cloudflare login details: its
+            'scheduler' is set.
+
+    Returns:
+        RequestScheduler: the scheduler object.
+    """
+    if api.scheduler:
+        return api.scheduler
+
+    with prog.sessions_lock:
+        scheduler = prog.schedulers.get((api.email, api.key))
+        if not scheduler:
+            scheduler = RequestScheduler()
+            prog.schedulers[(api.email, api.key)] = scheduler
+
+    api.scheduler = scheduler
+    return scheduler
+
+def fallback_request(prog, api, method, path, **kwargs):
+    """Make a request to Cloudflare's RESTful API.
+
+    The request is scheduled by the request scheduler of the account (see
+    'RequestScheduler'). If Cloudflare rejects it for exceeding the rate
+    limit (HTTP 429), or it is an idempotent request and a server error
+    (HTTP 5xx) occurs, it is retried after a backoff delay, as long as
+    the retry budget of the api object allows.
+
+    Args:
+        prog (State): a session may be added to 'prog.sessions' (see
+            'get_session').
+        api (ApiCloudflare): contains Cloudflare login details.
+        method (str): the HTTP method (e.g. 'GET').
+        path (str): the path of the request, relative to the API url.
+        kwargs: passed on to 'requests.Session.request'.
+
+    Returns:
+        (requests.Response, dict): the response object and its decoded
+            JSON data.
+
+    Raises:
+        DNSProcessingError: if the request failed or the response is not
+            JSON data.
+    """
+    result = fallback_requests(prog, api, [ (method, path, kwargs) ])[0]
+    if isinstance(result, Except.DNSExcept):
+        raise result
+    return result
+
+def fallback_requests(prog, api, calls):
+    """Make requests to Cloudflare's RESTful API (see 'fallback_request').
+
+    With the 'async' client, the requests are made together (and any to
+    retry are then retried together), otherwise one at a time.
+
+    Args:
+        prog (State): a session may be added to 'prog.sessions' (see
+            'get_session').
+        api (ApiCloudflare): contains Cloudflare login details.
+        calls (list((str, str, dict))): the method, path and keyword
+            arguments (see 'fallback_request') of every request.
+
+    Returns:
+        list: for every request, in order, either the response object and
+            its decoded JSON data, or else the DNSProcessingError of the
+            request.
+    """
+    session = get_session(prog, api)
+    scheduler = get_scheduler(prog, api)
+
+    results = [ None ] * len(calls)
+    todo = list(range(len(calls)))
+    attempt = 0
+    while todo:
+        attempt += 1
+
+        for i in todo:
+            wait = scheduler.acquire()
+            if wait > 0:
+                prog.log.info3(
+                        "  + rate limited: waited {:.1f} seconds".format(wait))
+
+        retry = []
+        delays = []
+        for i, r in zip(todo, send_requests(api, session,
+                                            [ calls[i] for i in todo ])):
+            if isinstance(r, Except.DNSExcept):
+                results[i] = r
+                continue
+
+            prog.log.info3("  + HTTP response: {}".format(r.status_code))
+
+            results[i] = r
+            method = calls[i][0]
+            retry_after = scheduler.update(r.headers, r.status_code)
+
+            if not (r.status_code == 429 or (r.status_code >= 500
+                                        and method in idempotent_methods)):
+                continue
+
+            delay = scheduler.retry_delay(api, attempt, retry_after)
+            if delay is None:
+                prog.log.info2(
+                        "  + HTTP response was {}: not retrying".format(
+                                                            r.status_code))
+                continue
+
+            prog.log.info2(
+                "  + HTTP response was {}: retrying in {:.1f} seconds".format(
+                                                        r.status_code, delay))
+            retry += [ i ]
+            delays += [ delay ]
+
+        if retry:
+            time.sleep(max(delays))
+        todo = retry
+
+    for i, r in enumerate(results):
+        if isinstance(r, Except.DNSExcept):
+            continue
+        try:
+            response = r.json()
+        except ValueError:
+            results[i] = Except.DNSProcessingError(
+                    "Cloudflare4 HTTP response was {}: no JSON data".format(
+                                                            r.status_code))
+            continue
+
+        prog.log.info3("  + JSON response: {}".format(
+                                str(response).replace(api.key, '<redacted>')) )
+        results[i] = (r, response)
+
+    return results
+
+def send_requests(api, session, calls):
+    """Send requests to Cloudflare's RESTful API (see 'fallback_requests').
+
+    Args:
+        api (ApiCloudflare): contains the API url and timeouts.
+        session (requests.Session): the session (or asynchttp.Client) to
+            send the requests with.
+        calls (list((str, str, dict))): the requests.
+
+    Returns:
+        list: for every request, in order, either the response object or
+            else the DNSProcessingError of the request.
+    """
+    import requests
+
+    requests_list = [ (method, "{}/{}".format(api.url, path),
+                       dict(kwargs, timeout=api.timeout))
+                                        for method, path, kwargs in calls ]
+
+    if not isinstance(session, requests.Session):
+        from alnitak.api import asynchttp
+        try:
+            outcomes = session.request_all(requests_list)
+        except asynchttp.HTTPError as ex:
+            return [ request_error(ex) ] * len(calls)
+        return [ o.response if o.response else request_error(o.error)
+                                                        for o in outcomes ]
+
+    results = []
+    for method, url, kwargs in requests_list:
+        try:
+            results += [ session.request(method, url, **kwargs) ]
+        except requests.exceptions.RequestException as ex:
+            results += [ request_error(ex) ]
+    return results
+
+def request_error(ex):
+    """Return the DNSProcessingError for an exception raised by a request.
+
+    Args:
+        ex (Exception): raised by 'requests' or the asynchttp client.
+
+    Returns:
+        DNSProcessingError: the error.
+    """
+    import requests
+
+    if isinstance(ex, requests.exceptions.RequestException):
+        timeout = requests.exceptions.Timeout
+        connection = requests.exceptions.ConnectionError
+    else:
+        # only the asynchttp client raises other exceptions
+        from alnitak.api import asynchttp
+        timeout = asynchttp.Timeout
+        connection = asynchttp.ConnectionError
+
+    if isinstance(ex, timeout):
+        return Except.DNSProcessingError("request timed out")
+    if isinstance(ex, connection):
+        return Except.DNSProcessingError("connection error encountered")
+    if isinstance(ex, requests.exceptions.TooManyRedirects):
+        return Except.DNSProcessingError("too many redirects")
+    return Except.DNSProcessingError("{}".format(ex))
+
 def get_zone(prog, api):
     """Get the zone ID for the domain.
 
     This function will get a zone ID for the domain. It will also initialize
     the CloudFlare.CloudFlare object if the Cloudflare python package is
     present, which future read/publish/delete functions will use. Otherwise,
-    we'll just use raw HTTP calls directly.
+    we'll just use raw HTTP calls directly. The zone ID is read from the
+    zone cache if it is there, and added to it if it had to be looked up.
 
     Args:
-        prog (State): not changed.
-        api (ApiCloudflare): contains Cloudflare login details.
+        prog (State): the zone cache 'prog.zone_cache' may be loaded, and
+            the zone ID added to it.
+        api (ApiCloudflare): contains Cloudflare login details: its 'zone'
+            is set.
 
     Raises:
         DNSProcessingError: raised for all errors encountered.
@@ -74,12 +545,33 @@ def get_zone(prog, api):
     if api.zone:
         return
 
+    with api.lock:
+        # another thread may have got the zone ID whilst we waited
+        if not api.zone:
+            find_zone(prog, api)
+
+def find_zone(prog, api):
+    """Get the zone ID for the domain (see 'get_zone').
+
+    Args:
+        prog (State): the zone cache 'prog.zone_cache' may be loaded, and
+            the zone ID added to it.
+        api (ApiCloudflare): contains Cloudflare login details.
+
+    Raises:
+        DNSProcessingError: raised for all errors encountered.
+    """
+
     prog.log.info2("  + need a zone ID for {}".format(api.domain))
 
     params = {'name': api.domain}
 
     # try native method
     try:
+        if api.client == "async":
+            # the async client is only used by the fallback calls
+            raise ModuleNotFoundError("native calls not used")
+
         from CloudFlare import CloudFlare
         from CloudFlare.exceptions import CloudFlareAPIError
 
@@ -87,7 +579,11 @@ def get_zone(prog, api):
 
         api.cloudflare = CloudFlare(email=api.email, token=api.key)
 
-        zones = api.cloudflare.zones.get(params=params)
+        if get_cached_zone(prog, api):
+            return
+
+        zones = native_call(prog, api, "GET", api.cloudflare.zones.get,
+                            params=params)
         for z in zones:
             if z['name'] == api.domain:
                 api.zone = z['id']
@@ -98,6 +594,8 @@ def get_zone(prog, api):
                     "Cloudflare: no zone with domain '{}' found".format(
                                                                 api.domain))
 
+        cache_zone(prog, api)
+
         # all done; return explicitly to avoid running the fallback code
         return
 
@@ -121,27 +619,10 @@ def get_zone(prog, api):
     # the fallback method:
     prog.log.info2("  + using fallback call(s)...")
 
-    import requests
+    if get_cached_zone(prog, api):
+        return
 
-    headers = { "X-Auth-Email": api.email,
-                "X-Auth-Key": api.key,
-                "Content-Type": "application/json" }
-    try:
-        r = requests.get("https://api.cloudflare.com/client/v4/zones",
-                                                params=params, headers=headers)
-    except ConnectionError:
-        raise Except.DNSProcessingError("connection error encountered")
-    except requests.exceptions.Timeout:
-        raise Except.DNSProcessingError("request timed out")
-    except requests.exceptions.TooManyRedirects:
-        raise Except.DNSProcessingError("too many redirects")
-    except requests.exceptions.RequestException as ex:
-        raise Except.DNSProcessingError("{}".format(ex))
-
-    prog.log.info3("  + HTTP response: {}".format(r.status_code))
-
-    response = r.json()
-    prog.log.info3("  + JSON response: {}".format(response))
+    r, response = fallback_request(prog, api, "GET", "zones", params=params)
 
     errors = get_errors(response)
     if errors:
@@ -170,6 +651,328 @@ def get_zone(prog, api):
 
     prog.log.info2("  + zone ID retrieved: '...({})'".format(len(api.zone)))
 
+    cache_zone(prog, api)
+
+def zone_cache_file(prog):
+    """Return the path of the zone cache file (next to the datafile)."""
+    return prog.datafile.parent / "{}.zones".format(prog.name)
+
+def load_zone_cache(prog):
+    """Read the zone cache file, if not already read.
+
+    Each line of the file is of the form:
+        EMAIL ZONE_NAME ZONE_ID TIME
+    where 'TIME' is when the zone ID was looked up. Malformed lines are
+    ignored. The zone cache lock must be held when calling this function.
+
+    Args:
+        prog (State): the zone cache is set.
+    """
+    cache = prog.zone_cache
+    if cache.loaded:
+        return
+    cache.loaded = True
+
+    try:
+        with open(str(zone_cache_file(prog)), "r") as file:
+            raw = file.read().splitlines()
+    except FileNotFoundError:
+        return
+    except OSError as ex:
+        prog.log.info2("  + reading zone cache '{}' failed: {}".format(
+                                            ex.filename, ex.strerror.lower()))
+        return
+
+    for l in raw:
+        fields = l.split()
+        if len(fields) != 4:
+            continue
+        try:
+            cache.entries[(fields[0], fields[1])] = (fields[2],
+                                                     int(fields[3]))
+        except ValueError:
+            continue
+
+def write_zone_cache(prog):
+    """Write the zone cache file.
+
+    As for the datafile (see 'datafile.replace_atomic'), the new file is
+    written to a temporary file (mode 0600) in the same directory, synced
+    to disk and then renamed to the zone cache file, so that the file is
+    never left truncated by a crash or by another run reading it.
+
+    Errors are not fatal (the zone IDs will just be looked up again), so
+    they are only logged. The zone cache lock must be held when calling
+    this function.
+
+    Args:
+        prog (State): not changed.
+    """
+    file = zone_cache_file(prog)
+    data = ''.join([ "{} {} {} {}\n".format(k[0], k[1], v[0], v[1])
+                            for k, v in prog.zone_cache.entries.items() ])
+    temp = None
+    try:
+        fd, temp = tempfile.mkstemp(prefix=".{}.".format(file.name),
+                                    dir=str(file.parent))
+        with open(fd, "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, str(file))
+    except OSError as ex:
+        prog.log.info2("  + writing zone cache '{}' failed: {}".format(
+                                            file, ex.strerror.lower()))
+        if temp:
+            try:
+                os.unlink(temp)
+            except OSError:
+                pass
+
+def get_cached_zone(prog, api):
+    """Set the zone ID of the api object from the zone cache.
+
+    Args:
+        prog (State): the zone cache may be read.
+        api (ApiCloudflare): the zone ID is set if found in the cache.
+
+    Returns:
+        bool: 'True' if the zone ID was found (and has not expired),
+            'False' otherwise.
+    """
+    if not api.zone_ttl:
+        return False
+
+    with prog.zone_cache.lock:
+        load_zone_cache(prog)
+        entry = prog.zone_cache.entries.get((api.email, api.domain))
+
+    if not entry:
+        return False
+
+    if int("{:%s}".format(prog.timenow)) - entry[1] >= api.zone_ttl:
+        prog.log.info3("  + cached zone ID has expired")
+        return False
+
+    api.zone = entry[0]
+    api.zone_cached = True
+    prog.log.info2("  + zone ID read from cache: '...({})'".format(
+                                                            len(api.zone)))
+    return True
+
+def cache_zone(prog, api):
+    """Add the zone ID of the api object to the zone cache.
+
+    Args:
+        prog (State): the zone cache is changed.
+        api (ApiCloudflare): contains the zone ID.
+    """
+    if not api.zone_ttl:
+        return
+
+    with prog.zone_cache.lock:
+        load_zone_cache(prog)
+        prog.zone_cache.entries[(api.email, api.domain)] = (
+                                api.zone, int("{:%s}".format(prog.timenow)))
+        write_zone_cache(prog)
+
+def uncache_zone(prog, api):
+    """Remove the zone ID of the api object from the zone cache.
+
+    The zone ID of the api object is also unset, so that the next call to
+    'get_zone' will look it up.
+
+    Args:
+        prog (State): the zone cache is changed.
+        api (ApiCloudflare): the zone ID is unset.
+    """
+    prog.log.info2(
+            "  + cached zone ID for {} not recognized: removing it".format(
+                                                                api.domain))
+    with prog.zone_cache.lock:
+        load_zone_cache(prog)
+        prog.zone_cache.entries.pop((api.email, api.domain), None)
+        write_zone_cache(prog)
+
+    api.zone = None
+    api.zone_cached = False
+    api.records = None
+
+def raise_errors(errors):
+    """Raise an exception for Cloudflare error messages.
+
+    Args:
+        errors (list(list(int, str))): the output of 'get_errors'.
+
+    Raises:
+        DNSZoneError: if any of the errors is that the zone is not
+            recognized.
+        DNSProcessingError: otherwise, if 'errors' is not empty.
+    """
+    if not errors:
+        return
+    for e in errors:
+        if e[0] in zone_error_codes:
+            raise Except.DNSZoneError(errors)
+    raise Except.DNSProcessingError(errors)
+
+def native_error(exc):
+    """Return an exception for a CloudFlare.exceptions.CloudFlareAPIError.
+
+    Args:
+        exc (CloudFlareAPIError): the exception raised by a native call.
+
+    Returns:
+        DNSProcessingError: the exception to raise (a DNSZoneError if the
+            zone was not recognized).
+    """
+    if len(exc) > 0:
+        codes = [ int(e) for e in exc ]
+        errs = [ "Cloudflare error {}: {}".format(int(e), str(e))
+                                                                for e in exc ]
+    else:
+        codes = [ int(exc) ]
+        errs = "Cloudflare error {}: {}".format(int(exc), str(exc))
+
+    for c in codes:
+        if c in zone_error_codes:
+            return Except.DNSZoneError(errs)
+    return Except.DNSProcessingError(errs)
+
+def native_call(prog, api, method, func, *args, **kwargs):
+    """Make a call with the Cloudflare python package.
+
+    The call is scheduled by the request scheduler of the account, and
+    retried, as for the fallback calls (see 'fallback_requests'). The
+    package does not give the response of a failed call, so the rate
+    limit headers cannot be followed: the call is taken to have been
+    rejected for exceeding the rate limit if it fails with HTTP status
+    429 (or Cloudflare's error code for it), and to have had a server
+    error if it fails with an HTTP 5xx status.
+
+    Args:
+        prog (State): a scheduler may be added to 'prog.schedulers' (see
+            'get_scheduler').
+        api (ApiCloudflare): contains Cloudflare login details.
+        method (str): the HTTP method of the call (e.g. 'GET').
+        func (function): the function of the package to call.
+        args, kwargs: passed on to 'func'.
+
+    Returns:
+        the return value of 'func'.
+
+    Raises:
+        CloudFlareAPIError: if the call failed (and was not retried).
+    """
+    from CloudFlare.exceptions import CloudFlareAPIError
+
+    scheduler = get_scheduler(prog, api)
+
+    attempt = 0
+    while True:
+        attempt += 1
+
+        wait = scheduler.acquire()
+        if wait > 0:
+            prog.log.info3(
+                    "  + rate limited: waited {:.1f} seconds".format(wait))
+
+        try:
+            return func(*args, **kwargs)
+        except CloudFlareAPIError as exc:
+            code = int(exc)
+            if code in rate_limit_error_codes:
+                scheduler.update({}, 429)
+            elif not (code >= 500 and code < 600
+                                        and method in idempotent_methods):
+                raise
+
+            delay = scheduler.retry_delay(api, attempt)
+            if delay is None:
+                prog.log.info2(
+                        "  + Cloudflare error {}: not retrying".format(code))
+                raise
+
+            prog.log.info2(
+                "  + Cloudflare error {}: retrying in {:.1f} seconds".format(
+                                                                code, delay))
+            time.sleep(delay)
+
+def zone_call(prog, api, native, fallback, *args):
+    """Call the native or fallback function for an operation on the zone.
+
+    The zone ID is obtained first. If it was read from the zone cache, but
+    Cloudflare does not recognize it, then it is removed from the cache
+    and the call is made again with a freshly looked up zone ID.
+
+    Args:
+        prog (State): not changed.
+        api (ApiCloudflare): contains Cloudflare login details.
+        native (function): the function to call for native calls.
+        fallback (function): the function to call for fallback calls.
+        args: passed to the function called, after 'prog' and 'api'.
+
+    Returns:
+        the return value of the function called.
+
+    Raises:
+        DNSProcessingError: if an error ocurred at any point that should
+            cause the Alnitak to exit with an error exit code.
+    """
+    get_zone(prog, api)
+
+    try:
+        if api.cloudflare:
+            return native(prog, api, *args)
+        return fallback(prog, api, *args)
+    except Except.DNSZoneError:
+        if not api.zone_cached:
+            raise
+
+    uncache_zone(prog, api)
+    get_zone(prog, api)
+
+    if api.cloudflare:
+        return native(prog, api, *args)
+    return fallback(prog, api, *args)
+
+def zone_calls(prog, api, fallback, items):
+    """Call a fallback function that makes requests together for items.
+
+    As 'zone_call', but for the items whose requests failed because
+    Cloudflare did not recognize a zone ID read from the zone cache, the
+    requests are made again with a freshly looked up zone ID.
+
+    Args:
+        prog (State): not changed (except for logging).
+        api (ApiCloudflare): contains Cloudflare login details.
+        fallback (function): called as 'fallback(prog, api, items)': it
+            returns, for every item, the reason its request failed, or
+            else 'None'.
+        items (list): the items.
+
+    Returns:
+        list(DNSExcept): for every item, in order, the reason its request
+            failed, or else 'None'.
+    """
+    try:
+        get_zone(prog, api)
+        errors = fallback(prog, api, items)
+
+        redo = [ i for i, ex in enumerate(errors)
+                                    if isinstance(ex, Except.DNSZoneError) ]
+        if not redo or not api.zone_cached:
+            return errors
+
+        uncache_zone(prog, api)
+        get_zone(prog, api)
+    except Except.DNSExcept as ex:
+        return [ ex ] * len(items)
+
+    for i, ex in zip(redo, fallback(prog, api, [ items[i] for i in redo ])):
+        errors[i] = ex
+    return errors
+
 
 
 def api_delete(prog, api, tlsa, id):
@@ -181,22 +984,26 @@ def api_delete(prog, api, tlsa, id):
         tlsa (Tlsa): details of the DANE TLSA record to delete.
         id (str): The Cloudflare ID of the record to delete.
 
+    Returns:
+        ApiOp: the queued delete if batching is enabled, otherwise 'None'.
+
     Raises:
         DNSProcessingError: if an error ocurred at any point that should
             cause the Alnitak to exit with an error exit code.
     """
-    get_zone(prog, api)
+    if api.batch:
+        return queue_op(prog, api, Prog.ApiOp('delete', tlsa, None, id))
 
-    if api.cloudflare:
-        cloudflare_native_delete(prog, api, tlsa, id)
-    else:
-        cloudflare_fallback_delete(prog, api, tlsa, id)
+    zone_call(prog, api, cloudflare_native_delete,
+              cloudflare_fallback_delete, tlsa, id)
+    unindex_record(api, tlsa, id)
 
 def cloudflare_native_delete(prog, api, tlsa, id):
     """Delete a DANE TLSA record using Cloudflare's python API.
 
     Args:
-        prog (State): not changed.
+        prog (State): a scheduler may be added to 'prog.schedulers' (see
+            'native_call').
         api (ApiCloudflare): contains Cloudflare login details.
         tlsa (Tlsa): details of the DANE TLSA record to delete.
         id (str): The Cloudflare ID of the record to delete.
@@ -211,17 +1018,11 @@ def cloudflare_native_delete(prog, api, tlsa, id):
     from CloudFlare.exceptions import CloudFlareAPIError
 
     try:
-        api.cloudflare.zones.dns_records.delete(api.zone, id)
+        native_call(prog, api, "DELETE",
+                    api.cloudflare.zones.dns_records.delete, api.zone, id)
         prog.log.info2("  + deleting record: success")
     except CloudFlareAPIError as exc:
-        if len(exc) > 0:
-            errs = []
-            for e in exc:
-                errs += [ "Cloudflare error {}: {}".format(int(e), str(e)) ]
-            raise Except.DNSProcessingError(errs)
-        else:
-            raise Except.DNSProcessingError(
-                    "Cloudflare error {}: {}".format(int(exc), str(exc)) )
+        raise native_error(exc)
 
 def cloudflare_fallback_delete(prog, api, tlsa, id):
     """Delete a DANE TLSA record using Cloudflare's RESTful API.
@@ -239,33 +1040,28 @@ def cloudflare_fallback_delete(prog, api, tlsa, id):
     prog.log.info2(
             "  + deleting TLSA record for {} (fallback)".format(tlsa.pstr()))
 
-    import requests
+    method, path, kwargs = delete_request(api, id)
+    check_delete(*fallback_request(prog, api, method, path, **kwargs))
 
-    headers = { "X-Auth-Email": api.email,
-                "X-Auth-Key": api.key,
-                "Content-Type": "application/json" }
+def delete_request(api, id):
+    """Return the request (see 'fallback_requests') to delete a record."""
+    return ("DELETE", "zones/{}/dns_records/{}".format(api.zone, id), {})
 
-    try:
-        r = requests.delete("https://api.cloudflare.com/client/v4/zones/{}/dns_records/{}".format(api.zone, id), headers=headers)
-    except ConnectionError:
-        raise Except.DNSProcessingError("connection error encountered")
-    except requests.exceptions.Timeout:
-        raise Except.DNSProcessingError("request timed out")
-    except requests.exceptions.TooManyRedirects:
-        raise Except.DNSProcessingError("too many redirects")
-    except requests.exceptions.RequestException as ex:
-        raise Except.DNSProcessingError("{}".format(ex))
-
-    prog.log.info3("  + HTTP response: {}".format(r.status_code))
-
-    response = r.json()
-    prog.log.info3("  + JSON response: {}".format(
-                        str(response).replace(api.key, '<redacted>')) )
+def check_delete(r, response):
+    """Check the response to a delete (see 'cloudflare_fallback_delete').
 
-    errors = get_errors(response)
-    if errors:
-        raise Except.DNSProcessingError(errors)
+    Args:
+        r (requests.Response): the response object.
+        response (dict): the decoded JSON data of the response.
 
+    Raises:
+        DNSProcessingError: if the delete failed.
+    """
+    raise_errors(get_errors(response))
+    check_response(r, response)
+
+def check_response(r, response):
+    """Raise DNSProcessingError if a response is not successful."""
     if r.status_code >= 400 and r.status_code < 600:
         raise Except.DNSProcessingError(
                 "Cloudflare4 HTTP response was {}".format(r.status_code))
@@ -284,124 +1080,433 @@ def api_publish(prog, api, tlsa, hash):
         tlsa (Tlsa): details of the DANE TLSA record to delete.
         hash (str): DANE TLSA 'certificate data' (hash) to publish.
 
+    Returns:
+        ApiOp: the queued publish if batching is enabled, otherwise 'None'.
+
     Raises:
         DNSProcessingError: if an error ocurred at any point that should
             cause the Alnitak to exit with an error exit code.
         DNSSkipProcessing: if the record is already up.
     """
-    get_zone(prog, api)
+    if api.batch:
+        return queue_op(prog, api, Prog.ApiOp('post', tlsa, hash))
 
-    if api.cloudflare:
-        cloudflare_native_publish(prog, api, tlsa, hash)
-    else:
-        cloudflare_fallback_publish(prog, api, tlsa, hash)
+    id = zone_call(prog, api, cloudflare_native_publish,
+                   cloudflare_fallback_publish, tlsa, hash)
+    index_record(api, tlsa, hash, id)
+
+def cloudflare_native_publish(prog, api, tlsa, hash):
+    """Create (publish) a DANE TLSA record using Cloudflare's python API.
+
+    Args:
+        prog (State): a scheduler may be added to 'prog.schedulers' (see
+            'native_call').
+        api (ApiCloudflare): contains Cloudflare login details.
+        tlsa (Tlsa): details of the DANE TLSA record to delete.
+        hash (str): DANE TLSA 'certificate data' (hash) to publish.
+
+    Returns:
+        str: the Cloudflare ID of the new record ('None' if not given).
+
+    Raises:
+        DNSProcessingError: if an error ocurred at any point that should
+            cause the Alnitak to exit with an error exit code.
+        DNSSkipProcessing: if the record is already up.
+    """
+    prog.log.info2(
+            "  + publishing TLSA record for {} (native)".format(tlsa.pstr()))
+
+    from CloudFlare.exceptions import CloudFlareAPIError
+
+    try:
+        record = native_call(prog, api, "POST",
+                api.cloudflare.zones.dns_records.post, api.zone,
+                data={
+                    "type": "TLSA",
+                    "name": "_{}._{}.{}".format(tlsa.port, tlsa.protocol,
+                                                tlsa.domain),
+                    "data": {
+                        "usage": int(tlsa.usage),
+                        "selector": int(tlsa.selector),
+                        "matching_type": int(tlsa.matching),
+                        "certificate": hash
+                        }
+                    })
+        prog.log.info2("  + publishing record: success")
+    except CloudFlareAPIError as exc:
+        if len(exc) == 0 and int(exc) == 81057:
+            raise Except.DNSSkipProcessing(str(exc))
+        raise native_error(exc)
+
+    try:
+        return record['id']
+    except (KeyError, TypeError):
+        return None
+
+def cloudflare_fallback_publish(prog, api, tlsa, hash):
+    """Create (publish) a DANE TLSA record using Cloudflare's RESTful API.
+
+    Args:
+        prog (State): not changed.
+        api (ApiCloudflare4): contains Cloudflare4 login details.
+        tlsa (Tlsa): details of the DANE TLSA record to delete.
+        hash (str): DANE TLSA 'certificate data' (hash) to publish.
+
+    Returns:
+        str: the Cloudflare ID of the new record ('None' if not given).
+
+    Raises:
+        DNSProcessingError: if an error ocurred at any point that should
+            cause the Alnitak to exit with an error exit code.
+        DNSSkipProcessing: if the record is already up.
+    """
+    prog.log.info2(
+            "  + publishing TLSA record for {} (fallback)".format(tlsa.pstr()))
+
+    method, path, kwargs = publish_request(api, tlsa, hash)
+    return check_publish(*fallback_request(prog, api, method, path, **kwargs))
+
+def publish_request(api, tlsa, hash):
+    """Return the request (see 'fallback_requests') to publish a record."""
+    data = '{{ "type": "TLSA", "name": "_{}._{}.{}", "data": {{ "usage": {}, "selector": {}, "matching_type": {}, "certificate": "{}" }} }}'.format(
+                    tlsa.port, tlsa.protocol, tlsa.domain, tlsa.usage,
+                    tlsa.selector, tlsa.matching, hash)
+
+    return ("POST", "zones/{}/dns_records".format(api.zone), { 'data': data })
+
+def check_publish(r, response):
+    """Check the response to a publish (see 'cloudflare_fallback_publish').
+
+    Args:
+        r (requests.Response): the response object.
+        response (dict): the decoded JSON data of the response.
+
+    Returns:
+        str: the Cloudflare ID of the new record ('None' if not given).
+
+    Raises:
+        DNSProcessingError: if the publish failed.
+        DNSSkipProcessing: if the record is already up.
+    """
+    errors = get_errors(response)
+
+    # record is already up
+    if len(errors) == 1 and errors[0][0] == 81057:
+        # we will only accept this code if it is the only error
+        # encountered
+        raise Except.DNSSkipProcessing(errors[0][1])
+
+    raise_errors(errors)
+    check_response(r, response)
+
+    try:
+        return response['result']['id']
+    except (KeyError, TypeError):
+        return None
+
+
+
+def queue_op(prog, api, op):
+    """Queue a publish or delete, to be made by 'api_finish'.
+
+    A publish is not queued if the record is already up (which is checked
+    against the TLSA records index).
+
+    Args:
+        prog (State): not changed.
+        api (ApiCloudflare): the operation is added to its queue.
+        op (ApiOp): the operation to queue.
+
+    Returns:
+        ApiOp: the operation queued.
+
+    Raises:
+        DNSProcessingError: if listing the TLSA records failed.
+        DNSSkipProcessing: if the record to publish is already up.
+    """
+    if op.method == 'post':
+        load_records(prog, api)
+        with api.lock:
+            if op.hash.lower() in api.records.get(record_key(op.tlsa), {}):
+                raise Except.DNSSkipProcessing("TLSA record is already up")
+
+    with api.lock:
+        api.queue += [ op ]
+
+    prog.log.info2("  + {} TLSA record for {}: queued".format(
+                "publishing" if op.method == 'post' else "deleting",
+                op.tlsa.pstr()))
+    return op
+
+def api_finish(prog, api):
+    """Make the publishes and deletes queued for the zone.
+
+    The operations are submitted in batches of 'api.batch' changes to
+    Cloudflare's DNS batch API. A batch is applied as a whole, so if a
+    batch fails, its operations are then made one at a time so that the
+    operations that failed (and why) are known. The 'error' of each
+    operation is set if it failed.
+
+    With the 'async' client, the batches are all submitted together, and
+    then the operations of any that failed are all made together.
+
+    Args:
+        prog (State): not changed.
+        api (ApiCloudflare): the queue of the api object is emptied.
+
+    Returns:
+        list(ApiOp): the operations made.
+    """
+    with api.lock:
+        ops = api.queue
+        api.queue = []
+
+    if not ops:
+        return ops
+
+    prog.log.info1("+++ making {} queued change(s) to TLSA records of zone {}".format(len(ops), api.domain))
+
+    chunks = [ ops[i:i+api.batch] for i in range(0, len(ops), api.batch) ]
+    if api.client == "async":
+        finish_together(prog, api, chunks)
+        chunks = []
+
+    for chunk in chunks:
+        try:
+            zone_call(prog, api, cloudflare_native_batch,
+                      cloudflare_fallback_batch, chunk)
+            continue
+        except Except.DNSProcessingError as ex:
+            prog.log.info2("  + batch of {} change(s) failed: {}".format(
+                                                        len(chunk), ex.message))
+            prog.log.info2("  + making the changes one at a time")
+
+        for op in chunk:
+            try:
+                if op.method == 'post':
+                    op.id = zone_call(prog, api, cloudflare_native_publish,
+                                      cloudflare_fallback_publish, op.tlsa,
+                                      op.hash)
+                else:
+                    zone_call(prog, api, cloudflare_native_delete,
+                              cloudflare_fallback_delete, op.tlsa, op.id)
+            except Except.DNSExcept as ex:
+                op.error = ex
+
+    for op in ops:
+        if op.error:
+            continue
+        if op.method == 'post':
+            index_record(api, op.tlsa, op.hash, op.id)
+        else:
+            unindex_record(api, op.tlsa, op.id)
+
+    return ops
+
+def finish_together(prog, api, chunks):
+    """Make batches of operations together (see 'api_finish').
+
+    Args:
+        prog (State): not changed (except for logging).
+        api (ApiCloudflare): contains Cloudflare login details.
+        chunks (list(list(ApiOp))): the operations of every batch: the
+            'error' of each operation is set if it failed.
+    """
+    failed = []
+    for chunk, ex in zip(chunks,
+                         zone_calls(prog, api, fallback_batches, chunks)):
+        if ex:
+            prog.log.info2("  + batch of {} change(s) failed: {}".format(
+                                                        len(chunk), ex.message))
+            failed += chunk
+
+    if not failed:
+        return
+
+    prog.log.info2("  + making the changes one at a time")
+    for op, ex in zip(failed, zone_calls(prog, api, fallback_ops, failed)):
+        op.error = ex
+
+def batch_data(ops):
+    """Return the request data for a batch of operations.
+
+    Args:
+        ops (list(ApiOp)): the operations to make.
+
+    Returns:
+        dict: the data to send to Cloudflare's DNS batch API.
+    """
+    return {
+        "deletes": [ { "id": op.id } for op in ops if op.method == 'delete' ],
+        "posts": [ {
+                "type": "TLSA",
+                "name": "_{}._{}.{}".format(op.tlsa.port, op.tlsa.protocol,
+                                            op.tlsa.domain),
+                "data": {
+                    "usage": int(op.tlsa.usage),
+                    "selector": int(op.tlsa.selector),
+                    "matching_type": int(op.tlsa.matching),
+                    "certificate": op.hash
+                    }
+                } for op in ops if op.method == 'post' ]
+        }
+
+def set_batch_ids(ops, result):
+    """Set the IDs of the records published by a batch.
+
+    Args:
+        ops (list(ApiOp)): the operations made.
+        result (dict): the result of the batch, as returned by Cloudflare.
+    """
+    try:
+        posts = result['posts'] or []
+    except (KeyError, TypeError):
+        return
 
-def cloudflare_native_publish(prog, api, tlsa, hash):
-    """Create (publish) a DANE TLSA record using Cloudflare's python API.
+    for op, r in zip([ op for op in ops if op.method == 'post' ], posts):
+        try:
+            op.id = r['id']
+        except (KeyError, TypeError):
+            pass
+
+def cloudflare_native_batch(prog, api, ops):
+    """Make a batch of publishes and deletes using Cloudflare's python API.
 
     Args:
-        prog (State): not changed.
+        prog (State): a scheduler may be added to 'prog.schedulers' (see
+            'native_call').
         api (ApiCloudflare): contains Cloudflare login details.
-        tlsa (Tlsa): details of the DANE TLSA record to delete.
-        hash (str): DANE TLSA 'certificate data' (hash) to publish.
+        ops (list(ApiOp)): the operations to make.
 
     Raises:
-        DNSProcessingError: if an error ocurred at any point that should
-            cause the Alnitak to exit with an error exit code.
-        DNSSkipProcessing: if the record is already up.
+        DNSProcessingError: if the batch failed (no changes were made).
     """
-    prog.log.info2(
-            "  + publishing TLSA record for {} (native)".format(tlsa.pstr()))
+    prog.log.info2("  + submitting batch of {} change(s) (native)".format(
+                                                                    len(ops)))
 
     from CloudFlare.exceptions import CloudFlareAPIError
 
     try:
-        api.cloudflare.zones.dns_records.post(api.zone,
-                data={
-                    "type": "TLSA",
-                    "name": "_{}._{}.{}".format(tlsa.port, tlsa.protocol,
-                                                tlsa.domain),
-                    "data": {
-                        "usage": int(tlsa.usage),
-                        "selector": int(tlsa.selector),
-                        "matching_type": int(tlsa.matching),
-                        "certificate": hash
-                        }
-                    })
-        prog.log.info2("  + publishing record: success")
+        result = native_call(prog, api, "POST",
+                                api.cloudflare.zones.dns_records.batch.post,
+                                api.zone, data=batch_data(ops))
+        prog.log.info2("  + submitting batch: success")
+    except AttributeError:
+        raise Except.DNSProcessingError(
+                    "batch calls not supported by the Cloudflare package")
     except CloudFlareAPIError as exc:
-        if len(exc) > 0:
-            errs = []
-            for e in exc:
-                errs += [ "Cloudflare error {}: {}".format(int(e), str(e)) ]
-            raise Except.DNSProcessingError(errs)
-        elif int(exc) == 81057:
-            raise Except.DNSSkipProcessing(str(exc))
-        else:
-            raise Except.DNSProcessingError(
-                    "Cloudflare error {}: {}".format(int(exc), str(exc)) )
+        raise native_error(exc)
 
-def cloudflare_fallback_publish(prog, api, tlsa, hash):
-    """Create (publish) a DANE TLSA record using Cloudflare's RESTful API.
+    set_batch_ids(ops, result)
+
+def cloudflare_fallback_batch(prog, api, ops):
+    """Make a batch of publishes and deletes using Cloudflare's RESTful API.
 
     Args:
         prog (State): not changed.
         api (ApiCloudflare4): contains Cloudflare4 login details.
-        tlsa (Tlsa): details of the DANE TLSA record to delete.
-        hash (str): DANE TLSA 'certificate data' (hash) to publish.
+        ops (list(ApiOp)): the operations to make.
 
     Raises:
-        DNSProcessingError: if an error ocurred at any point that should
-            cause the Alnitak to exit with an error exit code.
-        DNSSkipProcessing: if the record is already up.
+        DNSProcessingError: if the batch failed (no changes were made).
+    """
+    prog.log.info2("  + submitting batch of {} change(s) (fallback)".format(
+                                                                    len(ops)))
+
+    method, path, kwargs = batch_request(api, ops)
+    check_batch(ops, *fallback_request(prog, api, method, path, **kwargs))
+
+def batch_request(api, ops):
+    """Return the request (see 'fallback_requests') to make a batch."""
+    return ("POST", "zones/{}/dns_records/batch".format(api.zone),
+            { 'data': json.dumps(batch_data(ops)) })
+
+def check_batch(ops, r, response):
+    """Check the response to a batch (see 'cloudflare_fallback_batch').
+
+    Args:
+        ops (list(ApiOp)): the operations made: the IDs of the records
+            published are set.
+        r (requests.Response): the response object.
+        response (dict): the decoded JSON data of the response.
+
+    Raises:
+        DNSProcessingError: if the batch failed (no changes were made).
+    """
+    raise_errors(get_errors(response))
+    check_response(r, response)
+    set_batch_ids(ops, response['result'])
+
+def fallback_batches(prog, api, chunks):
+    """Make batches of publishes and deletes together, using Cloudflare's
+    RESTful API (see 'fallback_requests').
+
+    Args:
+        prog (State): not changed (except for logging).
+        api (ApiCloudflare): contains Cloudflare login details.
+        chunks (list(list(ApiOp))): the operations of every batch.
+
+    Returns:
+        list(DNSExcept): for every batch, in order, the reason it failed,
+            or else 'None' if it was made.
     """
     prog.log.info2(
-            "  + publishing TLSA record for {} (fallback)".format(tlsa.pstr()))
+            "  + submitting {} batch(es) of changes together (fallback)".format(
+                                                                len(chunks)))
 
-    import requests
+    results = fallback_requests(prog, api, [ batch_request(api, chunk)
+                                                    for chunk in chunks ])
+    return [ call_error(check_batch, chunk, result)
+                            for chunk, result in zip(chunks, results) ]
 
-    headers = { "X-Auth-Email": api.email,
-                "X-Auth-Key": api.key,
-                "Content-Type": "application/json" }
+def fallback_ops(prog, api, ops):
+    """Make publishes and deletes together, one request each, using
+    Cloudflare's RESTful API (see 'fallback_requests').
 
-    data = '{{ "type": "TLSA", "name": "_{}._{}.{}", "data": {{ "usage": {}, "selector": {}, "matching_type": {}, "certificate": "{}" }} }}'.format(
-                    tlsa.port, tlsa.protocol, tlsa.domain, tlsa.usage,
-                    tlsa.selector, tlsa.matching, hash)
+    Args:
+        prog (State): not changed (except for logging).
+        api (ApiCloudflare): contains Cloudflare login details.
+        ops (list(ApiOp)): the operations to make: the IDs of the records
+            published are set.
 
-    try:
-        r = requests.post("https://api.cloudflare.com/client/v4/zones/{}/dns_records".format(api.zone), data=data, headers=headers)
-    except ConnectionError:
-        raise Except.DNSProcessingError("connection error encountered")
-    except requests.exceptions.Timeout:
-        raise Except.DNSProcessingError("request timed out")
-    except requests.exceptions.TooManyRedirects:
-        raise Except.DNSProcessingError("too many redirects")
-    except requests.exceptions.RequestException as ex:
-        raise Except.DNSProcessingError("{}".format(ex))
-
-    prog.log.info3("  + HTTP response: {}".format(r.status_code))
-
-    response = r.json()
-    prog.log.info3("  + JSON response: {}".format(
-                                str(response).replace(api.key, '<redacted>')) )
+    Returns:
+        list(DNSExcept): for every operation, in order, the reason it
+            failed, or else 'None' if it was made.
+    """
+    prog.log.info2("  + making {} change(s) together (fallback)".format(
+                                                                    len(ops)))
 
-    errors = get_errors(response)
+    def check_op(op, r, response):
+        if op.method == 'post':
+            op.id = check_publish(r, response)
+        else:
+            check_delete(r, response)
 
-    # record is already up
-    if len(errors) == 1 and errors[0][0] == 81057:
-        # we will only accept this code if it is the only error
-        # encountered
-        raise Except.DNSSkipProcessing(errors[0][1])
+    results = fallback_requests(prog, api,
+            [ publish_request(api, op.tlsa, op.hash) if op.method == 'post'
+                            else delete_request(api, op.id) for op in ops ])
+    return [ call_error(check_op, op, result)
+                                    for op, result in zip(ops, results) ]
 
-    if errors:
-        raise Except.DNSProcessingError(errors)
+def call_error(check, item, result):
+    """Check the result of a request made by 'fallback_requests'.
 
-    if r.status_code >= 400 and r.status_code < 600:
-        raise Except.DNSProcessingError(
-                "Cloudflare4 HTTP response was {}".format(r.status_code))
+    Args:
+        check (function): called as 'check(item, r, response)' to check
+            the response: raises DNSExcept if it failed.
+        item: the item the request was made for.
+        result: the result of the request.
 
-    if not response['success']:
-        raise Except.DNSProcessingError("Cloudflare4 JSON response failure")
+    Returns:
+        DNSExcept: the reason the request failed, or else 'None'.
+    """
+    try:
+        if isinstance(result, Except.DNSExcept):
+            raise result
+        check(item, *result)
+    except Except.DNSExcept as ex:
+        return ex
+    return None
 
 
 
@@ -417,6 +1522,10 @@ def api_read(prog, api, tlsa):
     where "id..." will be some unique ID Cloudflare has assigned to that
     record.
 
+    The records are not requested individually: all the TLSA records of
+    the zone are listed once per run (see 'load_records'), and the
+    reads answered from that listing.
+
     Args:
         prog (State): not changed.
         api (ApiCloudflare): contains Cloudflare login details.
@@ -431,149 +1540,200 @@ def api_read(prog, api, tlsa):
             cause the Alnitak to exit with an error exit code.
         DNSNotLive: if no matching records are up.
     """
-    get_zone(prog, api)
+    load_records(prog, api)
 
-    if api.cloudflare:
-        return cloudflare_native_read(prog, api, tlsa)
-    else:
-        return cloudflare_fallback_read(prog, api, tlsa)
+    prog.log.info2("  + getting TLSA records for _{}._{}.{}".format(
+                                        tlsa.port, tlsa.protocol, tlsa.domain))
 
-def cloudflare_native_read(prog, api, tlsa):
-    """Get a dict of DANE TLSA records that are up.
+    with api.lock:
+        # a copy, since the records may be deleted whilst iterating over it
+        ret = dict(api.records.get(record_key(tlsa), {}))
+
+    if ret:
+        return ret
+
+    raise Except.DNSNotLive("no TLSA records found")
+
+def record_key(tlsa):
+    """Return the key of the TLSA records index for 'tlsa'.
+
+    Args:
+        tlsa (Tlsa): details of the DANE TLSA record.
+
+    Returns:
+        tuple(str, str, str, str): the (lower case) record name, usage,
+            selector and matching type.
+    """
+    return ("_{}._{}.{}".format(tlsa.port, tlsa.protocol,
+                                tlsa.domain).lower(),
+            str(tlsa.usage), str(tlsa.selector), str(tlsa.matching))
+
+def load_records(prog, api):
+    """List all the TLSA records of the zone, if not already listed.
+
+    The records are indexed in the api object as:
+        { (name, usage, selector, matching): { hash: id, ... }, ... }
+    (see 'record_key'). The index is then kept up to date by our own
+    publishes and deletes, so the zone is only listed once per run.
 
-    For example, if the following TLSA records are up:
-        TLSA 3 1 1 _25._tcp.example.com  abcABC
-        TLSA 3 1 1 _25._tcp.example.come defDEF
-    and 'tlsa' has param '311', port '25', protocol 'tcp' and domain
-    'example.com', then this function will return:
-        { "abcABC": "id...", "defDEF": "id..." }
-    where "id..." will be some unique ID Cloudflare has assigned to that
-    record.
- 
     Args:
         prog (State): not changed.
+        api (ApiCloudflare): the records index is set.
+
+    Raises:
+        DNSProcessingError: if an error ocurred at any point that should
+            cause the Alnitak to exit with an error exit code.
+    """
+    if api.records is not None:
+        return
+
+    with api.lock:
+        # another thread may have listed the records whilst we waited
+        if api.records is not None:
+            return
+
+        records = zone_call(prog, api, cloudflare_native_list,
+                            cloudflare_fallback_list)
+
+        index = {}
+        try:
+            for r in records:
+                key = (r['name'].lower(), str(r['data']['usage']),
+                       str(r['data']['selector']),
+                       str(r['data']['matching_type']))
+                index.setdefault(key, {})[
+                                    r['data']['certificate'].lower()] = r['id']
+        except (KeyError, TypeError):
+            raise Except.DNSProcessingError(
+                                "Cloudflare: unrecognized TLSA record data")
+
+        prog.log.info2("  + {} TLSA record(s) listed for zone {}".format(
+                                                    len(records), api.domain))
+        api.records = index
+
+def index_record(api, tlsa, hash, id):
+    """Add a published record to the TLSA records index (if listed).
+
+    Args:
+        api (ApiCloudflare): the records index is changed.
+        tlsa (Tlsa): details of the DANE TLSA record.
+        hash (str): DANE TLSA 'certificate data' (hash) published.
+        id (str): the Cloudflare ID of the record.
+    """
+    with api.lock:
+        if api.records is not None and id:
+            api.records.setdefault(record_key(tlsa), {})[hash.lower()] = id
+
+def unindex_record(api, tlsa, id):
+    """Remove a deleted record from the TLSA records index (if listed).
+
+    Args:
+        api (ApiCloudflare): the records index is changed.
+        tlsa (Tlsa): details of the DANE TLSA record.
+        id (str): the Cloudflare ID of the record.
+    """
+    with api.lock:
+        if api.records is None:
+            return
+        key = record_key(tlsa)
+        records = api.records.get(key, {})
+        for h in [ h for h in records if records[h] == id ]:
+            del records[h]
+        if not records:
+            api.records.pop(key, None)
+
+def cloudflare_native_list(prog, api):
+    """List all the DANE TLSA records of the zone using Cloudflare's python
+    API.
+
+    Args:
+        prog (State): a scheduler may be added to 'prog.schedulers' (see
+            'native_call').
         api (ApiCloudflare): contains Cloudflare login details.
-        tlsa (Tlsa): details of the DANE TLSA record to retrieve.
 
     Returns:
-        dict: keys are the certificate hashes and values are the ID numbers
-            assigned to it by Cloudflare.
+        list(dict): the records, as returned by Cloudflare.
 
     Raises:
         DNSProcessingError: if an error ocurred at any point that should
             cause the Alnitak to exit with an error exit code.
-        DNSNotLive: if no matching records are up.
     """
-    prog.log.info2("  + getting TLSA records for _{}._{}.{} (native)".format(
-                                        tlsa.port, tlsa.protocol, tlsa.domain))
+    prog.log.info2("  + listing TLSA records for zone {} (native)".format(
+                                                                api.domain))
 
     from CloudFlare.exceptions import CloudFlareAPIError
 
+    records = []
+    page = 1
     try:
-        records = api.cloudflare.zones.dns_records.get(api.zone,
-                params={
-                    "type": "TLSA",
-                    "name": "_{}._{}.{}".format(tlsa.port, tlsa.protocol,
-                                                tlsa.domain)
-                    })
-        prog.log.info3("  + JSON response: {}".format(
-                                str(records).replace(api.key, '<redacted>')) )
+        while True:
+            result = native_call(prog, api, "GET",
+                    api.cloudflare.zones.dns_records.get, api.zone,
+                    params={
+                        "type": "TLSA",
+                        "page": page,
+                        "per_page": records_per_page
+                        })
+            prog.log.info3("  + JSON response: {}".format(
+                                str(result).replace(api.key, '<redacted>')) )
+            records += result
+            if len(result) < records_per_page:
+                break
+            page += 1
         prog.log.info2("  + retrieving records: success")
     except CloudFlareAPIError as exc:
-        if len(exc) > 0:
-            errs = []
-            for e in exc:
-                errs += [ "Cloudflare error {}: {}".format(int(e), str(e)) ]
-            raise Except.DNSProcessingError(errs)
-        else:
-            raise Except.DNSProcessingError(
-                    "Cloudflare error {}: {}".format(int(exc), str(exc)) )
-
-    ret = { r['data']['certificate'].lower(): r['id'] for r in records
-                if str(r['data']['usage']) == str(tlsa.usage)
-                    and str(r['data']['selector']) == str(tlsa.selector)
-                    and str(r['data']['matching_type']) == str(tlsa.matching) }
-    if ret:
-        return ret
+        raise native_error(exc)
 
-    raise Except.DNSNotLive("no TLSA records found")
+    return records
 
-def cloudflare_fallback_read(prog, api, tlsa):
-    """Get a dict of DANE TLSA records that are up.
+def cloudflare_fallback_list(prog, api):
+    """List all the DANE TLSA records of the zone using Cloudflare's RESTful
+    API.
 
-    For example, if the following TLSA records are up:
-        TLSA 3 1 1 _25._tcp.example.com  abcABC
-        TLSA 3 1 1 _25._tcp.example.come defDEF
-    and 'tlsa' has param '311', port '25', protocol 'tcp' and domain
-    'example.com', then this function will return:
-        { "id...": "abcABC", "id...": "defDEF" }
-    where "id..." will be some unique ID Cloudflare has assigned to that
-    record.
- 
     Args:
         prog (State): not changed.
         api (ApiCloudflare4): contains Cloudflare4 login details.
-        tlsa (Tlsa): details of the DANE TLSA record to retrieve.
 
     Returns:
-        dict: keys are the certificate hashes and values are the ID numbers
-            assigned to it by Cloudflare.
+        list(dict): the records, as returned by Cloudflare.
 
     Raises:
         DNSProcessingError: if an error ocurred at any point that should
             cause the Alnitak to exit with an error exit code.
-        DNSNotLive: if no matching records are up.
     """
-    prog.log.info2("  + getting TLSA records for _{}._{}.{} (fallback)".format(
-                                        tlsa.port, tlsa.protocol, tlsa.domain))
-
-    import requests
+    prog.log.info2("  + listing TLSA records for zone {} (fallback)".format(
+                                                                api.domain))
 
-    headers = { "X-Auth-Email": api.email,
-                "X-Auth-Key": api.key,
-                "Content-Type": "application/json" }
+    records = []
+    page = 1
+    while True:
+        params = { "type": "TLSA", "page": page,
+                   "per_page": records_per_page }
 
-    params = { "type": "TLSA",
-               "name":"_{}._{}.{}".format(
-                                      tlsa.port, tlsa.protocol, tlsa.domain) }
+        r, response = fallback_request(prog, api, "GET",
+                        "zones/{}/dns_records".format(api.zone), params=params)
 
-    try:
-        r = requests.get("https://api.cloudflare.com/client/v4/zones/{}/dns_records".format(api.zone), params=params, headers=headers)
-    except ConnectionError:
-        raise Except.DNSProcessingError("connection error encountered")
-    except requests.exceptions.Timeout:
-        raise Except.DNSProcessingError("request timed out")
-    except requests.exceptions.TooManyRedirects:
-        raise Except.DNSProcessingError("too many redirects")
-    except requests.exceptions.RequestException as ex:
-        raise Except.DNSProcessingError("{}".format(ex))
-
-    prog.log.info3("  + HTTP response: {}".format(r.status_code))
-
-    response = r.json()
-    prog.log.info3("  + JSON response: {}".format(
-                                str(response).replace(api.key, '<redacted>')) )
+        raise_errors(get_errors(response))
 
-    errors = get_errors(response)
-    if errors:
-        raise Except.DNSProcessingError(errors)
+        if r.status_code >= 400 and r.status_code < 600:
+            raise Except.DNSProcessingError(
+                    "Cloudflare4 HTTP response was {}".format(r.status_code))
 
-    if r.status_code >= 400 and r.status_code < 600:
-        raise Except.DNSProcessingError(
-                "Cloudflare4 HTTP response was {}".format(r.status_code))
+        if not response['success']:
+            raise Except.DNSProcessingError(
+                                        "Cloudflare4 JSON response failure")
 
-    if not response['success']:
-        raise Except.DNSProcessingError("Cloudflare4 JSON response failure")
+        records += response['result']
 
-    ret = { r['data']['certificate'].lower(): r['id']
-            for r in response['result']
-                if str(r['data']['usage']) == str(tlsa.usage)
-                    and str(r['data']['selector']) == str(tlsa.selector)
-                    and str(r['data']['matching_type']) == str(tlsa.matching) }
-    if ret:
-        return ret
+        try:
+            if page >= int(response['result_info']['total_pages']):
+                break
+        except (KeyError, TypeError, ValueError):
+            # no pagination info: this was the only page
+            break
+        page += 1
 
-    raise Except.DNSNotLive("no TLSA records found")
+    return records
 
 
 
@@ -598,22 +1758,37 @@ def get_api(prog, domain, input_list, state):
         ApiCloudflare: creates an ApiCloudflare object from the arguments.
         None: if an error is encountered.
     """
-    if len(input_list) == 0:
+    api = Prog.ApiCloudflare()
+    if domain:
+        api.set_domain(domain)
+
+    # options can be given along with either form of the login details
+    avail_options = [ is_api_cloudflare_input_zone_ttl,
+                      is_api_cloudflare_input_batch,
+                      is_api_cloudflare_input_retry,
+                      is_api_cloudflare_input_client ]
+    login = []
+    for inp in input_list:
+        for check in avail_options:
+            if check(prog, inp, api):
+                avail_options.remove(check)
+                break
+        else:
+            login += [ inp ]
+
+    if len(login) == 0:
         state.add_error(prog, "'cloudflare' api scheme not given any data")
         return None
-    elif len(input_list) > 2:
+    elif len(login) > 2:
         state.add_error(prog, "'cloudflare' api scheme given superfluous data")
         return None
-    elif len(input_list) == 1:
-        inputs = read_cloudflare_api_file(prog, input_list[0], state)
+    elif len(login) == 1:
+        inputs = read_cloudflare_api_file(prog, login[0], state)
         if not inputs:
             return None
     else:
-        inputs = input_list
+        inputs = login
 
-    api = Prog.ApiCloudflare()
-    if domain:
-        api.set_domain(domain)
     avail_inputs = [ is_api_cloudflare_input_email,
                      is_api_cloudflare_input_key ]
 
@@ -741,4 +1916,82 @@ def is_api_cloudflare_input_key(prog, inp, api):
         return True
     return False
 
+def is_api_cloudflare_input_zone_ttl(prog, inp, api):
+    """Test input for the zone cache expiry and set in the api object if so.
+
+    If the input is a zone cache expiry input ('zone_ttl:...') then set the
+    zone TTL in the 'api' object to it.
+
+    Args:
+        prog (State): not changed.
+        inp (str): input to check.
+        api (ApiCloudflare): the api object to set.
+
+    Returns:
+        bool: 'True' if the zone TTL in 'api' was set to 'inp', 'False' if
+            not.
+    """
+    if re.match(r'zone_ttl:\d+$', inp):
+        api.zone_ttl = int(inp[9:])
+        return True
+    return False
+
+def is_api_cloudflare_input_batch(prog, inp, api):
+    """Test input for the batch size and set in the api object if so.
+
+    If the input is a batch size input ('batch:...') then set the batch
+    size in the 'api' object to it.
+
+    Args:
+        prog (State): not changed.
+        inp (str): input to check.
+        api (ApiCloudflare): the api object to set.
+
+    Returns:
+        bool: 'True' if the batch size in 'api' was set to 'inp', 'False'
+            if not.
+    """
+    if re.match(r'batch:\d+$', inp):
+        api.batch = int(inp[6:])
+        return True
+    return False
+
+def is_api_cloudflare_input_retry(prog, inp, api):
+    """Test input for the retry budget and set in the api object if so.
+
+    If the input is a retry budget input ('retry:...') then set the retry
+    budget in the 'api' object to it.
+
+    Args:
+        prog (State): not changed.
+        inp (str): input to check.
+        api (ApiCloudflare): the api object to set.
+
+    Returns:
+        bool: 'True' if the retry budget in 'api' was set to 'inp', 'False'
+            if not.
+    """
+    if re.match(r'retry:\d+$', inp):
+        api.retry = int(inp[6:])
+        return True
+    return False
+
+def is_api_cloudflare_input_client(prog, inp, api):
+    """Test input for the HTTP client and set in the api object if so.
+
+    If the input is a client input ('client:requests' or 'client:async')
+    then set the client in the 'api' object to it.
+
+    Args:
+        prog (State): not changed.
+        inp (str): input to check.
+        api (ApiCloudflare): the api object to set.
 
+    Returns:
+        bool: 'True' if the client in 'api' was set to 'inp', 'False' if
+            not.
+    """
+    if re.match(r'client:(requests|async)$', inp):
+        api.client = inp[7:]
+        return True
+    return False
@@ -1,30 +1,21 @@
 
 import os
+import re
+import sys
+import time
+import json
 import pwd
+import grp
+import signal
+import select
+import threading
 import subprocess
+import concurrent.futures
 
 from alnitak import exceptions as Except
 from alnitak import prog as Prog
 
 
-def formalize_string(inp, prepend=""):
-    r"""Transform a byte string to a standard form.
-
-    If the input is b'X\nY\nZ' and 'prepend' is set to 'A', then
-    transform to 'AX\nAY\nAZ'.
-
-    Args:
-        inp (bytes): input byte string.
-        prepend (str): string to prepend to lines in 'inp'. Default value
-            is the empty string.
-
-    Returns:
-        str: explained above.
-    """
-    return "\n".join( [ "{}{}".format(prepend,i)
-                                        for i in inp.decode().splitlines() ] )
-
-
 def get_gid(api):
     """Return a GID value.
 
@@ -53,7 +44,7 @@ def get_gid(api):
         except KeyError:
             pass
 
-        raise Except.PrivError("getting GID value failed: no GID value for user '{}' found".found(api.uid))
+        raise Except.PrivError("getting GID value failed: no GID value for user '{}' found".format(api.uid))
 
     try:
         return int(api.gid)
@@ -71,59 +62,65 @@ def get_gid(api):
     except KeyError:
         pass
 
-    raise Except.PrivError("getting GID value failed: no group or user GID value for '{}' found".found(api.gid))
+    raise Except.PrivError("getting GID value failed: no group or user GID value for '{}' found".format(api.gid))
+
+def popen_privs(api):
+    """Return the program to start and the 'subprocess.Popen' arguments
+    that drop privileges to the UID of the api object.
 
-def drop_privs(api):
-    """Drop privileges of the running process.
+    On Python 3.9 and later, the 'user', 'group', 'extra_groups' and
+    'umask' arguments of 'subprocess.Popen' are used: the privileges are
+    then dropped in the child process without running any Python code.
+    This matters because the programs are started from several threads
+    at once (with 'jobs:N' and '--jobs'), and a 'preexec_fn' function is
+    not safe to run in the child of a process with other threads: it may
+    deadlock on a lock that another thread held when the process forked.
+    On earlier versions, the program is instead started through the
+    'privs.py' script, which drops the privileges and then executes the
+    program.
 
-    Will first set the umask to 0027, then set the groups to those of the
-    user number 'api.uid', then finally set the new GID and UID.
+    The GID and group values are looked up here, before the program is
+    started.
 
     Args:
         api (ApiExec): object containing the UID and GID values to drop
             to.
 
     Returns:
-        NoneType: always returns 'None'.
+        list(str), dict: the program and arguments to start, and the
+            keyword arguments to give 'subprocess.Popen' (empty if
+            'api.uid' is 'None': no privileges to drop).
 
     Raises:
-        PrivError: raised for any errors encountered.
+        PrivError: if the GID or group values could not be obtained.
     """
     if api.uid == None:
-        return None
+        return api.command, {}
 
     gid = get_gid(api)
 
     try:
-        os.umask(0o027)
-    except OSError as ex:
-        raise Except.PrivError(
-                "setting umask failed: {}".format(ex.strerror.lower()))
-
-    try:
-        os.setgroups( os.getgrouplist(pwd.getpwuid(api.uid).pw_name, gid) )
+        groups = os.getgrouplist(pwd.getpwuid(api.uid).pw_name, gid)
     except KeyError:
         raise Except.PrivError("dropping privileges failed: could not set new group permissions")
 
-    try:
-        os.setgid(gid)
-    except OSError as ex:
-        raise Except.PrivError("droping GID privileges to group '{}' failed: {}".format(gid, ex.strerror.lower()))
+    if sys.version_info >= (3, 9):
+        return api.command, { "user": api.uid, "group": gid,
+                              "extra_groups": groups, "umask": 0o027 }
 
-    try:
-        os.setuid(api.uid)
-    except OSError as ex:
-        raise Except.PrivError("droping UID privileges to user '{}' failed: {}".format(api.uid, ex.strerror.lower()))
-
-def drop_privs_lambda(api):
-    """Return a lambda function of the drop_privs(api) function."""
-    return lambda : drop_privs(api)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "privs.py")
+    return [ sys.executable, "-I", script, str(api.uid), str(gid),
+             ",".join([ str(g) for g in groups ]) ] + api.command, {}
 
 
 
 def api_publish(prog, api, tlsa, hash):
     """Create (publish) a DANE TLSA record.
 
+    If the api object allows more than one job, or uses the 'batch'
+    protocol, the publish is queued instead, to be made by 'api_finish'.
+
     Args:
         prog (State): not changed.
         api (ApiExec): details of the program to run.
@@ -131,7 +128,7 @@ def api_publish(prog, api, tlsa, hash):
         hash (str): DANE TLSA 'certificate data' (hash) to publish.
 
     Returns:
-        NoneType: always returns 'None'.
+        ApiOp: the queued publish if queued, otherwise 'None'.
 
     Raises:
         DNSSkipProcessing: if the process to run returned '1', meaning
@@ -142,6 +139,32 @@ def api_publish(prog, api, tlsa, hash):
             indicated that Alnitak should not exit with an error exit
             code.
     """
+    if is_queued(api):
+        return queue_op(prog, api, Prog.ApiOp('post', tlsa, hash))
+
+    publish(prog, api, tlsa, hash)
+
+def publish(prog, api, tlsa, hash):
+    """Create (publish) a DANE TLSA record by running the program.
+
+    Args:
+        prog (State): not changed.
+        api (ApiExec): details of the program to run.
+        tlsa (Tlsa): details of the DANE TLSA record to publish.
+        hash (str): DANE TLSA 'certificate data' (hash) to publish.
+
+    Raises:
+        DNSSkipProcessing: if the process to run returned '1', meaning
+            that the DANE TLSA record was already up.
+        DNSProcessingError: if an error ocurred at any point that should
+            cause the Alnitak to exit with an error exit code.
+        DNSNoReturnError: if an error occurred, but the program called
+            indicated that Alnitak should not exit with an error exit
+            code, or if the program did not run in time.
+    """
+    if api.protocol == 'worker':
+        return worker_call(prog, api, Prog.ApiOp('post', tlsa, hash))
+
     prog.log.info2(
         "  + calling external program to publish TLSA DNS record: {}".format(
                                                                 tlsa.pstr()))
@@ -163,37 +186,34 @@ def api_publish(prog, api, tlsa, hash):
                 "TLSA_HASH": hash,
                 "TLSA_OPERATION": "publish" }
 
+    timeout = get_timeout(prog, api)
+    start = time.monotonic()
+
     try:
-        proc = subprocess.Popen(api.command, env=environ,
-                                preexec_fn=drop_privs_lambda(api),
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        command, privs = popen_privs(api)
+        proc = subprocess.Popen(command, env=environ,
+                                start_new_session=True,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                **privs)
+    except Except.PrivError as ex:
+        raise Except.DNSProcessingError("command '{}' failed: {}".format(
+                                            api.command[0], ex.message))
     except FileNotFoundError as ex:
         raise Except.DNSProcessingError(
                 "command '{}': file not found".format(ex.filename))
     except OSError as ex:
         raise Except.DNSProcessingError(
-                "command '{}': {}".format(ex.filename, ex.strerror.lower()))
+                "command '{}': {}".format(ex.filename or api.command[0],
+                                          ex.strerror.lower()))
     except subprocess.SubprocessError as ex:
         raise Except.DNSProcessingError("command '{}' failed: {}".format(
                                             api.command[0], str(ex).lower()))
 
-    try:
-        stdout, stderr = proc.communicate(timeout=300)
-    except subprocess.TimeoutExpired:
-        raise Except.DNSProcessingError(
-                "command '{}': process timed out (300s)".format(api.command[0]))
+    wait_for(prog, api, proc, timeout, start)
 
     prog.log.info3(
             "    - command returned (exit code): {}".format(proc.returncode))
 
-    if stdout:
-        prog.log.info2("    - command returned:\n{}".format(
-                                formalize_string(stdout, "(stdout) ")))
-
-    if stderr:
-        prog.log.info2("    - command returned:\n{}".format(
-                                formalize_string(stderr, "(stderr) ")))
-
     if proc.returncode == 0:
         return
     if proc.returncode == 1:
@@ -209,6 +229,9 @@ def api_publish(prog, api, tlsa, hash):
 def api_delete(prog, api, tlsa, hash1, hash2):
     """Delete a DANE TLSA record.
 
+    If the api object allows more than one job, or uses the 'batch'
+    protocol, the delete is queued instead, to be made by 'api_finish'.
+
     Args:
         prog (State): not changed.
         api (ApiExec): details of the program to run.
@@ -219,7 +242,7 @@ def api_delete(prog, api, tlsa, hash1, hash2):
             'None', then 'hash1' is unconditionally deleted.
 
     Returns:
-        NoneType: always returns 'None'.
+        ApiOp: the queued delete if queued, otherwise 'None'.
 
     Raises:
         DNSNotLive: if the process to run returned '1', meaning that the
@@ -230,6 +253,37 @@ def api_delete(prog, api, tlsa, hash1, hash2):
             indicated that Alnitak should not exit with an error exit
             code.
     """
+    if is_queued(api):
+        return queue_op(prog, api,
+                        Prog.ApiOp('delete', tlsa, hash1, live_hash=hash2))
+
+    delete(prog, api, tlsa, hash1, hash2)
+
+def delete(prog, api, tlsa, hash1, hash2):
+    """Delete a DANE TLSA record by running the program.
+
+    Args:
+        prog (State): not changed.
+        api (ApiExec): details of the program to run.
+        tlsa (Tlsa): details of the DANE TLSA record to delete.
+        hash1 (str): DANE TLSA 'certificate data' (hash) to delete.
+        hash2 (str): DANE TLSA 'certificate data' (hash) to check if up
+            'live' before which 'hash1' can be deleted. If has the value
+            'None', then 'hash1' is unconditionally deleted.
+
+    Raises:
+        DNSNotLive: if the process to run returned '1', meaning that the
+            DANE TLSA hash 'hash2' was not yet up.
+        DNSProcessingError: if an error ocurred at any point that should
+            cause the Alnitak to exit with an error exit code.
+        DNSNoReturnError: if an error occurred, but the program called
+            indicated that Alnitak should not exit with an error exit
+            code, or if the program did not run in time.
+    """
+    if api.protocol == 'worker':
+        return worker_call(prog, api,
+                        Prog.ApiOp('delete', tlsa, hash1, live_hash=hash2))
+
     prog.log.info2("  + calling external program to delete TLSA DNS record: _{}._{}.{}".format(tlsa.port, tlsa.protocol, tlsa.domain))
     prog.log.info3("    - program: {}".format(api.rstr()))
     environ = { "PATH":
@@ -252,37 +306,34 @@ def api_delete(prog, api, tlsa, hash1, hash2):
     if hash2:
         environ["TLSA_LIVE_HASH"] = hash2
 
+    timeout = get_timeout(prog, api)
+    start = time.monotonic()
+
     try:
-        proc = subprocess.Popen(api.command, env=environ,
-                                preexec_fn=drop_privs_lambda(api),
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        command, privs = popen_privs(api)
+        proc = subprocess.Popen(command, env=environ,
+                                start_new_session=True,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                **privs)
+    except Except.PrivError as ex:
+        raise Except.DNSProcessingError("command '{}' failed: {}".format(
+                                            api.command[0], ex.message))
     except FileNotFoundError as ex:
         raise Except.DNSProcessingError(
                 "command '{}': file not found".format(ex.filename))
     except OSError as ex:
         raise Except.DNSProcessingError(
-                "command '{}': {}".format(ex.filename, ex.strerror.lower()))
+                "command '{}': {}".format(ex.filename or api.command[0],
+                                          ex.strerror.lower()))
     except subprocess.SubprocessError as ex:
         raise Except.DNSProcessingError("command '{}' failed: {}".format(
                                             api.command[0], str(ex).lower()))
 
-    try:
-        stdout, stderr = proc.communicate(timeout=300)
-    except subprocess.TimeoutExpired:
-        raise Except.DNSProcessingError(
-                "command '{}': process timed out (300s)".format(api.command[0]))
+    wait_for(prog, api, proc, timeout, start)
 
     prog.log.info3(
             "    - command returned (exit code): {}".format(proc.returncode))
 
-    if stdout:
-        prog.log.info2("    - command returned:\n{}".format(
-                                formalize_string(stdout, "(stdout) ")))
-
-    if stderr:
-        prog.log.info2("    - command returned:\n{}".format(
-                                formalize_string(stderr, "(stderr) ")))
-
     if proc.returncode == 0:
         return
     if proc.returncode == 1:
@@ -295,6 +346,788 @@ def api_delete(prog, api, tlsa, hash1, hash2):
     raise Except.DNSProcessingError(errmsg)
 
 
+def get_timeout(prog, api, adaptive=True):
+    """Return the number of seconds a run of the program may take.
+
+    The run-wide deadline (if any) starts with the first program run.
+
+    Args:
+        prog (State): the deadline in 'prog.hook_times' may be set.
+        api (ApiExec): details of the program to run.
+        adaptive (bool): if 'False', the timeout is not adapted to the run
+            times of the program, even if the api object would allow it.
+
+    Returns:
+        float: the number of seconds.
+
+    Raises:
+        DNSNoReturnError: if the run-wide deadline has passed, so that the
+            program should not be run (and the record left pending).
+    """
+    prog.hook_times.start(prog.hook_deadline)
+
+    timeout = prog.hook_times.timeout(api.command, api.timeout,
+                                      api.adaptive and adaptive)
+    remaining = prog.hook_times.remaining()
+    if remaining != None:
+        if remaining <= 0:
+            raise Except.DNSNoReturnError("command '{}' not run: hook deadline ({}s) passed".format(api.command[0], prog.hook_deadline))
+        timeout = min(timeout, remaining)
+
+    prog.log.info3("    - timeout: {}s".format(seconds_str(timeout)))
+    return timeout
+
+def seconds_str(seconds):
+    """Return a number of seconds as a string, to at most one decimal."""
+    return "{:g}".format(round(seconds, 1))
+
+def wait_for(prog, api, proc, timeout, start, input=None, record=True,
+             handler=None):
+    """Wait for the program to exit, logging its output as it is written.
+
+    The stdout and stderr of the program are read (and logged) line by
+    line as they are written, and not kept (see 'OutputLogger').
+
+    If the program does not exit in time it is killed, along with any
+    processes it started (every program is run in its own session, so
+    that its process group can be killed).
+
+    Args:
+        prog (State): the run time may be added to 'prog.hook_times'.
+        api (ApiExec): details of the program run.
+        proc (subprocess.Popen): the running program.
+        timeout (float): the number of seconds to wait.
+        start (float): when the program was started (as given by
+            'time.monotonic').
+        input (bytes): data to write to the stdin of the program, which is
+            then closed.
+        record (bool): whether to record the run time of the program.
+        handler (function): called as 'handler(line)' for every line of
+            the stdout of the program. The line is not logged if it
+            returns 'True'.
+
+    Raises:
+        DNSNoReturnError: if the program did not exit in time.
+    """
+    output = OutputLogger(prog, api.output_limit)
+    output.read(proc.stdout, "stdout", handler)
+    output.read(proc.stderr, "stderr")
+
+    if input != None:
+        # written by a thread, so that a program that does not read its
+        # stdin cannot block us beyond the timeout
+        threading.Thread(target=write_input, args=(proc.stdin, input),
+                         daemon=True).start()
+
+    try:
+        proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        kill_program(proc)
+        proc.wait()
+        output.finish()
+        if record:
+            prog.hook_times.record(api.command, time.monotonic() - start)
+        raise Except.DNSNoReturnError(
+                "command '{}': process timed out ({}s)".format(
+                                    api.command[0], seconds_str(timeout)))
+
+    output.finish()
+    if record:
+        prog.hook_times.record(api.command, time.monotonic() - start)
+
+def write_input(stdin, input):
+    try:
+        stdin.write(input)
+        stdin.close()
+    except OSError:
+        # the program exited (or closed its stdin) before reading it all
+        pass
+
+class OutputLogger:
+    """Log the output of a program, line by line, as it is written.
+
+    Every stream of the program is read by its own (daemon) thread, and
+    each line logged as soon as it is read, so the output of a program is
+    never held in memory. No more than 'limit' bytes of output are logged
+    for the program: the rest is read, but only counted.
+
+    Attributes:
+        prog (State): the output is sent to 'prog.log'.
+        limit (int): the most bytes of output to log.
+        logged (int): the number of bytes logged.
+        dropped (int): the number of bytes read but not logged.
+        streams (list(str)): the streams (e.g. 'stdout') logged so far.
+        threads (list(threading.Thread)): the threads reading the streams.
+        finished (bool): set when no more output is to be logged.
+        lock (threading.Lock): lock that must be held to log output.
+    """
+    chunk = 8192
+    join_timeout = 5
+
+    def __init__(self, prog, limit):
+        self.prog = prog
+        self.limit = limit
+        self.logged = 0
+        self.dropped = 0
+        self.streams = []
+        self.threads = []
+        self.finished = False
+        self.lock = threading.Lock()
+
+    def read(self, stream, name, handler=None):
+        """Start reading (and logging) a stream of the program.
+
+        Args:
+            stream (file): the stream, opened in binary mode.
+            name (str): the name to log the lines with (e.g. 'stdout').
+            handler (function): called as 'handler(line)' for every line
+                read. The line is not logged if it returns 'True'.
+        """
+        thread = threading.Thread(target=self.read_lines,
+                                  args=(stream, name, handler), daemon=True)
+        thread.start()
+        self.threads += [ thread ]
+
+    def read_lines(self, stream, name, handler):
+        # very long lines are read (and logged) in pieces
+        for line in iter(lambda: stream.readline(self.chunk), b''):
+            if handler and handler(line):
+                continue
+            self.log(name, line)
+
+    def log(self, name, line):
+        """Log a line of output, unless over the limit.
+
+        Args:
+            name (str): the name of the stream the line was read from.
+            line (bytes): the line.
+        """
+        with self.lock:
+            if self.finished or self.logged + len(line) > self.limit:
+                self.dropped += len(line)
+                return
+            self.logged += len(line)
+
+            if name not in self.streams:
+                self.streams += [ name ]
+                self.prog.log.info2("    - command returned:")
+            self.prog.log.info2("({}) {}".format(name,
+                    line.decode(errors='replace').rstrip('\r\n')))
+
+    def finish(self):
+        """Wait for the streams to be read, and log how much was dropped.
+
+        The streams are closed once the program (and any processes that
+        inherited them) exits, so this waits for only a short time: any
+        output read afterwards is not logged.
+        """
+        for thread in self.threads:
+            thread.join(self.join_timeout)
+
+        with self.lock:
+            self.finished = True
+            if self.dropped:
+                self.prog.log.info2("    - {} bytes of output not logged (limit: {} bytes)".format(self.dropped, self.limit))
+
+def kill_program(proc):
+    """Kill a program and the processes in its process group.
+
+    Args:
+        proc (subprocess.Popen): the program, which must have been started
+            in its own session.
+    """
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        proc.kill()
+
+def is_queued(api):
+    """Return whether publishes and deletes are queued for 'api_finish'.
+
+    Args:
+        api (ApiExec): details of the program to run.
+
+    Returns:
+        bool: 'True' if the operations are queued, 'False' otherwise.
+    """
+    return api.jobs > 1 or api.protocol == 'batch'
+
+def queue_op(prog, api, op):
+    """Queue a publish or delete, to be made by 'api_finish'.
+
+    Args:
+        prog (State): not changed.
+        api (ApiExec): the operation is added to its queue.
+        op (ApiOp): the operation to queue.
+
+    Returns:
+        ApiOp: the operation queued.
+    """
+    with api.lock:
+        api.queue.append((api, op))
+
+    prog.log.info2("  + {} TLSA DNS record {}: queued".format(
+                "publishing" if op.method == 'post' else "deleting",
+                op.tlsa.pstr()))
+    return op
+
+def api_finish(prog, api):
+    """Make the publishes and deletes queued for the api object.
+
+    Up to 'api.jobs' programs are run at once: all the publishes are made
+    first, and then all the deletes (so that, as when they are not queued,
+    old records are deleted after new records are published). Every
+    program run is still a separate process, with its own exit code (and
+    privileges dropped), so the 'error' of each operation is set from the
+    exit code of its own process. The log messages of every operation are
+    kept together, in the order the operations were queued.
+
+    If the api object uses the 'batch' protocol, the program is instead
+    run just once, for all the operations (see 'run_batch').
+
+    The queue is shared by all the copies of the api object, so the
+    operations queued with every copy are made here (and none are left
+    for the other copies).
+
+    Args:
+        prog (State): not changed.
+        api (ApiExec): the queue of the api object is emptied.
+
+    Returns:
+        list(ApiOp): the operations made.
+    """
+    with api.lock:
+        queue = api.queue[:]
+        del api.queue[:]
+
+    if not queue:
+        return []
+
+    if api.protocol == 'batch':
+        run_batch(prog, api, queue)
+        return [ op for a, op in queue ]
+
+    prog.log.info1("+++ running external program for {} queued TLSA DNS record(s) ({} at a time)".format(len(queue), api.jobs))
+
+    for method in [ 'post', 'delete' ]:
+        todo = [ (a, op) for a, op in queue if op.method == method ]
+        if not todo:
+            continue
+
+        states = [ Prog.GroupState(prog) for op in todo ]
+        with concurrent.futures.ThreadPoolExecutor(
+                                        min(api.jobs, len(todo))) as pool:
+            futures = [ pool.submit(run_op, st, a, op)
+                                        for st, (a, op) in zip(states, todo) ]
+            for st, future in zip(states, futures):
+                try:
+                    future.result()
+                finally:
+                    st.log.replay(prog.log)
+
+    return [ op for a, op in queue ]
+
+def run_op(prog, api, op):
+    """Make a queued operation, setting its 'error' if it failed.
+
+    Args:
+        prog (State): not changed.
+        api (ApiExec): details of the program to run.
+        op (ApiOp): the operation to make.
+    """
+    try:
+        if op.method == 'post':
+            publish(prog, api, op.tlsa, op.hash)
+        else:
+            delete(prog, api, op.tlsa, op.hash, op.live_hash)
+    except Except.DNSExcept as ex:
+        op.error = ex
+
+def batch_request(api, op, id):
+    """Return the JSON line sent to the program for a queued operation.
+
+    The fields of the line are named as the environment parameters given
+    to the program when it is run for one record.
+
+    Args:
+        api (ApiExec): the api object the operation was queued with.
+        op (ApiOp): the queued operation.
+        id (int): the ID of the operation, returned with its result.
+
+    Returns:
+        str: the line (with no newline).
+    """
+    tlsa = op.tlsa
+    request = { "id": id,
+                "TLSA_OPERATION": "publish" if op.method == 'post'
+                                                            else "delete",
+                "ZONE_DOMAIN": api.domain,
+                "TLSA_PARAM": "{}{}{}".format(
+                                tlsa.usage, tlsa.selector, tlsa.matching),
+                "TLSA_USAGE": tlsa.usage,
+                "TLSA_SELECTOR": tlsa.selector,
+                "TLSA_MATCHING": tlsa.matching,
+                "TLSA_PORT": tlsa.port,
+                "TLSA_PROTOCOL": tlsa.protocol,
+                "TLSA_DOMAIN": tlsa.domain,
+                "TLSA_HASH": op.hash }
+
+    if op.live_hash:
+        request["TLSA_LIVE_HASH"] = op.live_hash
+
+    return json.dumps(request, sort_keys=True)
+
+def batch_error(api, op, status):
+    """Return the exception for the result of a queued operation.
+
+    The status is read as the exit code of the program would be if it had
+    been run for the one record.
+
+    Args:
+        api (ApiExec): details of the program run.
+        op (ApiOp): the queued operation.
+        status (int): the status returned for the operation.
+
+    Returns:
+        DNSExcept: the exception, or else 'None' if the operation succeeded.
+    """
+    if status == 0:
+        return None
+
+    if op.method == 'post':
+        if status == 1:
+            return Except.DNSSkipProcessing("TLSA record is already up")
+        errmsg = "publishing TLSA record: external program '{}' returned status {}".format(api.command[0], status)
+    else:
+        if status == 1:
+            return Except.DNSNotLive("TLSA record not up yet")
+        errmsg = "deleting TLSA record: external program '{}' returned status {}".format(api.command[0], status)
+
+    if status >= 128:
+        return Except.DNSNoReturnError(errmsg)
+    return Except.DNSProcessingError(errmsg)
+
+def run_batch(prog, api, queue):
+    """Make all the queued operations by running the program once.
+
+    Every operation is written to the program's stdin as a line of JSON
+    (see 'batch_request'), publishes before deletes, and stdin is then
+    closed. The program must write a line of JSON to its stdout for every
+    operation, giving the 'id' of the operation and its 'status' (read as
+    the exit code would be: see 'batch_error'). Any other output is
+    logged as it is written. The 'error' of every operation with no result
+    is set from the exit code of the program (or to an error if it exited
+    with '0'), or is a 'DNSNoReturnError' if the program timed out.
+
+    The timeout of the api object is for the one run of the program, and
+    is not adapted (the run times of batches are not comparable).
+
+    Args:
+        prog (State): not changed.
+        api (ApiExec): details of the program to run.
+        queue (list((ApiExec, ApiOp))): the queued operations, and the api
+            object each was queued with.
+    """
+    todo = [ (a, op) for a, op in queue if op.method == 'post' ]
+    todo += [ (a, op) for a, op in queue if op.method == 'delete' ]
+
+    prog.log.info1("+++ running external program once for {} queued TLSA DNS record(s)".format(len(todo)))
+    prog.log.info3("    - program: {}".format(api.rstr()))
+
+    requests = ""
+    for id, (a, op) in enumerate(todo):
+        prog.log.info2("  + {} TLSA DNS record: {}".format(
+                        "publishing" if op.method == 'post' else "deleting",
+                        op.tlsa.pstr()))
+        requests += batch_request(a, op, id) + "\n"
+
+    environ = { "PATH":
+                "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin",
+                "IFS": " \t\n",
+                "RENEWED_DOMAINS": " ".join(prog.renewed_domains),
+                "LETSENCRYPT_DIR": str(prog.letsencrypt_directory),
+                "TLSA_OPERATION": "batch" }
+
+    try:
+        timeout = get_timeout(prog, api, adaptive=False)
+        start = time.monotonic()
+
+        try:
+            command, privs = popen_privs(api)
+            proc = subprocess.Popen(command, env=environ,
+                                start_new_session=True,
+                                stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                **privs)
+        except Except.PrivError as ex:
+            raise Except.DNSProcessingError("command '{}' failed: {}".format(
+                                                api.command[0], ex.message))
+        except FileNotFoundError as ex:
+            raise Except.DNSProcessingError(
+                    "command '{}': file not found".format(ex.filename))
+        except OSError as ex:
+            raise Except.DNSProcessingError(
+                    "command '{}': {}".format(ex.filename or api.command[0],
+                                              ex.strerror.lower()))
+        except subprocess.SubprocessError as ex:
+            raise Except.DNSProcessingError("command '{}' failed: {}".format(
+                                            api.command[0], str(ex).lower()))
+
+    except Except.DNSProcessingError as ex:
+        prog.log.error(ex.message)
+        for a, op in todo:
+            op.error = ex
+        return
+
+    results = {}
+    def result(line):
+        try:
+            result = json.loads(line.decode())
+            id = result["id"]
+            status = int(result["status"])
+        except (ValueError, TypeError, KeyError):
+            return False
+        if id not in range(len(todo)) or id in results:
+            return False
+        results[id] = status
+        return True
+
+    # the results read before a timeout are still used
+    timedout = None
+    try:
+        wait_for(prog, api, proc, timeout, start, requests.encode(),
+                 record=False, handler=result)
+        prog.log.info3(
+            "    - command returned (exit code): {}".format(proc.returncode))
+    except Except.DNSNoReturnError as ex:
+        prog.log.error(ex.message)
+        timedout = ex
+
+    for id, (a, op) in enumerate(todo):
+        if id in results:
+            prog.log.info3("    - status of {} of {}: {}".format(
+                        "publish" if op.method == 'post' else "delete",
+                        op.tlsa.pstr(), results[id]))
+            op.error = batch_error(api, op, results[id])
+            continue
+
+        if timedout:
+            op.error = timedout
+            continue
+
+        errmsg = "{} TLSA record: external program '{}' returned no result (exit code {})".format("publishing" if op.method == 'post' else "deleting", api.command[0], proc.returncode)
+        if proc.returncode >= 128:
+            op.error = Except.DNSNoReturnError(errmsg)
+        else:
+            op.error = Except.DNSProcessingError(errmsg)
+
+
+
+class Worker:
+    """A program kept running to make publishes and deletes.
+
+    The program is started when first needed, and is then sent every
+    operation as a line of JSON on its stdin (see 'batch_request'), to
+    which it must answer with a line of JSON on its stdout giving the 'id'
+    of the operation and its 'status' (see 'batch_error'). Operations are
+    sent one at a time. If the program exits (or closes its stdout) before
+    answering, it is started again and the operation sent once more.
+
+    The privileges to drop to are looked up only once, when the worker is
+    created, and not every time the program is started.
+
+    Attributes:
+        api (ApiExec): details of the program to run.
+        proc (subprocess.Popen): the running program, or else 'None'.
+        command (list(str)): the program and arguments to start.
+        privs (dict): the arguments to give 'subprocess.Popen' to drop
+            privileges (see 'popen_privs').
+        starts (int): the number of times the program was started.
+        next_id (int): the ID to give the next operation.
+        buffer (bytes): output read from the program but not yet used.
+        stderr (list(bytes)): lines the program wrote to its stderr that
+            are not yet logged (at most 'api.output_limit' bytes of them).
+        stderr_dropped (int): the number of bytes the program wrote to its
+            stderr that will not be logged.
+        lock (threading.Lock): lock that must be held to use the program.
+    """
+    restarts = 1
+
+    def __init__(self, api, command, privs):
+        self.api = api
+        self.proc = None
+        self.command = command
+        self.privs = privs
+        self.starts = 0
+        self.next_id = 0
+        self.buffer = b''
+        self.stderr = []
+        self.stderr_dropped = 0
+        self.lock = threading.Lock()
+
+    def start(self, prog):
+        """Start the program.
+
+        Raises:
+            DNSProcessingError: if the program could not be started.
+        """
+        environ = { "PATH":
+                "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin",
+                    "IFS": " \t\n",
+                    "RENEWED_DOMAINS": " ".join(prog.renewed_domains),
+                    "LETSENCRYPT_DIR": str(prog.letsencrypt_directory),
+                    "TLSA_OPERATION": "worker" }
+
+        prog.log.info2("  + {} external program (worker)".format(
+                                "starting" if self.starts == 0 else "restarting"))
+        prog.log.info3("    - program: {}".format(self.api.rstr()))
+
+        try:
+            self.proc = subprocess.Popen(self.command, env=environ,
+                                stdin=subprocess.PIPE,
+                                start_new_session=True,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                **self.privs)
+        except FileNotFoundError as ex:
+            raise Except.DNSProcessingError(
+                    "command '{}': file not found".format(ex.filename))
+        except OSError as ex:
+            raise Except.DNSProcessingError(
+                    "command '{}': {}".format(ex.filename or self.api.command[0],
+                                              ex.strerror.lower()))
+        except subprocess.SubprocessError as ex:
+            raise Except.DNSProcessingError("command '{}' failed: {}".format(
+                                        self.api.command[0], str(ex).lower()))
+
+        self.starts += 1
+        self.buffer = b''
+
+        # the stderr of the program is read as it is written, so that the
+        # program never blocks on it
+        threading.Thread(target=self.read_stderr, args=(self.proc,),
+                         daemon=True).start()
+
+    def read_stderr(self, proc):
+        # the stderr written between operations is kept until the next one
+        for line in iter(lambda: proc.stderr.readline(OutputLogger.chunk),
+                         b''):
+            if sum(len(l) for l in self.stderr) + len(line) \
+                                                    > self.api.output_limit:
+                self.stderr_dropped += len(line)
+            else:
+                self.stderr.append(line)
+
+    def read_line(self, deadline):
+        """Read a line from the stdout of the program.
+
+        Returns:
+            bytes: the line (with no newline), or else 'None' if the program
+                closed its stdout.
+
+        Raises:
+            DNSNoReturnError: if no line is read before the deadline.
+        """
+        fd = self.proc.stdout.fileno()
+        while b'\n' not in self.buffer:
+            wait = deadline - time.monotonic()
+            if wait <= 0 or not select.select([ fd ], [], [], wait)[0]:
+                raise Except.DNSNoReturnError(
+                        "command '{}': worker timed out".format(
+                                                    self.api.command[0]))
+            data = os.read(fd, 65536)
+            if not data:
+                return None
+            self.buffer += data
+
+        line, sep, self.buffer = self.buffer.partition(b'\n')
+        return line
+
+    def exchange(self, prog, api, op, timeout):
+        """Send an operation to the program and read its status.
+
+        Returns:
+            int: the status, or else 'None' if the program exited (or
+                closed its stdout) before answering.
+
+        Raises:
+            DNSNoReturnError: if the program did not answer in time.
+        """
+        id = self.next_id
+        self.next_id += 1
+
+        try:
+            self.proc.stdin.write((batch_request(api, op, id) + "\n").encode())
+            self.proc.stdin.flush()
+        except OSError:
+            return None
+
+        deadline = time.monotonic() + timeout
+        output = OutputLogger(prog, api.output_limit)
+        try:
+            while True:
+                line = self.read_line(deadline)
+                if line == None:
+                    return None
+                try:
+                    result = json.loads(line.decode())
+                    if result["id"] == id:
+                        return int(result["status"])
+                except (ValueError, TypeError, KeyError):
+                    pass
+                output.log("stdout", line)
+        finally:
+            stderr = self.stderr[:]
+            del self.stderr[:len(stderr)]
+            for line in stderr:
+                output.log("stderr", line)
+            output.dropped += self.stderr_dropped
+            self.stderr_dropped = 0
+            output.finish()
+
+    def call(self, prog, api, op):
+        """Make an operation, starting the program if need be.
+
+        Args:
+            prog (State): not changed.
+            api (ApiExec): the api object the operation is made with.
+            op (ApiOp): the operation.
+
+        Returns:
+            int: the status of the operation.
+
+        Raises:
+            DNSProcessingError: if the program could not be started, or
+                exited before answering (after being restarted).
+            DNSNoReturnError: if the program did not answer in time (it is
+                then killed), or the run-wide deadline has passed.
+        """
+        with self.lock:
+            for attempt in range(self.restarts + 1):
+                if not self.proc or self.proc.poll() != None:
+                    self.start(prog)
+
+                timeout = get_timeout(prog, api)
+                start = time.monotonic()
+                try:
+                    status = self.exchange(prog, api, op, timeout)
+                except Except.DNSNoReturnError as ex:
+                    prog.hook_times.record(api.command,
+                                           time.monotonic() - start)
+                    self.stop(kill=True)
+                    raise Except.DNSNoReturnError("{} ({}s)".format(
+                                        ex.message, seconds_str(timeout)))
+
+                if status != None:
+                    prog.hook_times.record(api.command,
+                                           time.monotonic() - start)
+                    return status
+
+                self.stop()
+                prog.log.info2("    - worker exited (exit code {}) without answering".format(self.proc.returncode))
+
+        raise Except.DNSProcessingError("command '{}': worker exited without answering".format(self.api.command[0]))
+
+    def stop(self, kill=False):
+        """Stop the program: close its stdin and wait for it to exit.
+
+        Args:
+            kill (bool): if 'True', kill the program instead of waiting.
+        """
+        if not self.proc:
+            return
+
+        if kill and self.proc.poll() == None:
+            kill_program(self.proc)
+
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+
+        try:
+            self.proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+        self.proc.stdout.close()
+
+
+def get_worker(prog, api):
+    """Return the worker of the api object, creating it if need be.
+
+    The workers are kept in 'prog.workers' for the whole run, and shared
+    by all the api objects with the same command and user: the domain of
+    the api object is not part of the key, since it is sent with every
+    operation.
+
+    Args:
+        prog (State): a worker may be added to 'prog.workers'.
+        api (ApiExec): details of the program to run.
+
+    Returns:
+        Worker: the worker.
+
+    Raises:
+        DNSProcessingError: if the privileges to drop to could not be
+            looked up.
+    """
+    key = (tuple(api.command), api.uid, api.gid)
+    with prog.workers_lock:
+        worker = prog.workers.get(key)
+        if not worker:
+            try:
+                command, privs = popen_privs(api)
+            except Except.PrivError as ex:
+                raise Except.DNSProcessingError(
+                        "command '{}' failed: {}".format(
+                                            api.command[0], ex.message))
+            worker = Worker(api, command, privs)
+            prog.workers[key] = worker
+    return worker
+
+def worker_call(prog, api, op):
+    """Make a publish or delete with the worker of the api object.
+
+    Args:
+        prog (State): not changed.
+        api (ApiExec): details of the program to run.
+        op (ApiOp): the operation to make.
+
+    Raises:
+        DNSSkipProcessing: if the publish returned status '1'.
+        DNSNotLive: if the delete returned status '1'.
+        DNSProcessingError: if an error ocurred at any point that should
+            cause the Alnitak to exit with an error exit code.
+        DNSNoReturnError: if an error occurred, but the program called
+            indicated that Alnitak should not exit with an error exit
+            code, or if the program did not answer in time.
+    """
+    prog.log.info2(
+        "  + sending TLSA DNS record to {} to external program (worker): {}".format("publish" if op.method == 'post' else "delete", op.tlsa.pstr()))
+
+    status = get_worker(prog, api).call(prog, api, op)
+
+    prog.log.info3("    - worker returned (status): {}".format(status))
+
+    ex = batch_error(api, op, status)
+    if ex:
+        raise ex
+
+def api_close(prog):
+    """Stop the workers that were started.
+
+    Args:
+        prog (State): 'prog.workers' is emptied.
+    """
+    with prog.workers_lock:
+        workers = list(prog.workers.values())
+        prog.workers = { }
+
+    for worker in workers:
+        worker.stop()
+
+
 
 def get_api(prog, domain, input_list, state):
     """Create an ApiExec object from a config file line.
@@ -317,20 +1150,64 @@ def get_api(prog, domain, input_list, state):
         ApiExec: creates an ApiExec object from the arguments.
         None: if an error is encountered.
     """
-    if input_list[0][0:4] == "uid:":
-        uid = get_api_uid(prog, input_list[0][4:], state)
-        if uid == None:
-            return None
-        comms = input_list[1:]
-    else:
-        uid = None
-        comms = input_list
+    # the options ('uid:X', 'jobs:N', 'protocol:P', 'timeout:T',
+    # 'output:N') come before the command, in any order
+    uid = None
+    jobs = None
+    protocol = None
+    timeout = None
+    output = None
+    comms = list(input_list)
+    while comms:
+        if comms[0][0:4] == "uid:" and uid == None:
+            uid = get_api_uid(prog, comms[0][4:], state)
+            if uid == None:
+                return None
+        elif re.match(r'jobs:\d+$', comms[0]) and jobs == None:
+            jobs = int(comms[0][5:])
+            if jobs < prog.jobs_min or jobs > prog.jobs_max:
+                state.add_error(prog, "'exec' api scheme: jobs input '{}' must be between {} and {}".format(jobs, prog.jobs_min, prog.jobs_max))
+                return None
+        elif comms[0][0:8] == "timeout:" and timeout == None:
+            timeout = re.match(r'timeout:(auto|auto:(\d+)|(\d+))$', comms[0])
+            if not timeout or int(timeout.group(2) or
+                                  timeout.group(3) or 1) == 0:
+                state.add_error(prog, "'exec' api scheme: timeout input '{}' must be 'N', 'auto' or 'auto:N', with 'N' a positive integer".format(comms[0][8:]))
+                return None
+        elif comms[0][0:7] == "output:" and output == None:
+            if not re.match(r'\d+$', comms[0][7:]):
+                state.add_error(prog, "'exec' api scheme: output input '{}' not an integer".format(comms[0][7:]))
+                return None
+            output = int(comms[0][7:])
+        elif comms[0][0:9] == "protocol:" and protocol == None:
+            protocol = comms[0][9:]
+            if protocol not in [ 'env', 'batch', 'worker' ]:
+                state.add_error(prog, "'exec' api scheme: protocol input '{}' must be 'env', 'batch' or 'worker'".format(protocol))
+                return None
+        else:
+            break
+        comms = comms[1:]
+
+    if jobs and protocol not in [ None, 'env' ]:
+        state.add_error(prog, "'exec' api scheme: jobs input cannot be given with protocol '{}'".format(protocol))
+        return None
 
     if len(comms) == 0:
         state.add_error(prog, "'exec' api scheme given no command to run")
         return None
 
     api = Prog.ApiExec(comms, uid=uid)
+    if jobs:
+        api.jobs = jobs
+    if protocol:
+        api.protocol = protocol
+    if output != None:
+        api.output_limit = output
+    if timeout:
+        api.adaptive = timeout.group(1)[0:4] == 'auto'
+        seconds = timeout.group(2) or timeout.group(3)
+        if seconds:
+            api.timeout = int(seconds)
     if domain:
         api.set_domain(domain)
     return api
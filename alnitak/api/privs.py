@@ -0,0 +1,65 @@
+"""Run a program with dropped privileges.
+
+This file is run as a script (not imported) by the 'exec' api scheme on
+Python versions before 3.9, where 'subprocess.Popen' cannot drop
+privileges itself, as:
+
+    python3 -I privs.py UID GID GROUPS PROG [ARGS...]
+
+where GROUPS is a comma-separated list of supplementary group IDs (which
+may be empty). The umask is set to 0027, then the groups, GID and UID are
+set, and finally 'PROG' is executed in place of this script. Dropping the
+privileges in a new program, and not in a 'preexec_fn' function, means no
+Python code is run in the forked child of a process that may be running
+other threads.
+
+Only the standard library is used, so that the script can be run in
+isolated mode.
+"""
+
+import os
+import sys
+
+
+def main(args):
+    """Drop privileges and execute the program.
+
+    Args:
+        args (list(str)): the UID, GID, groups, program and its arguments.
+
+    Returns:
+        int: 126 if privileges could not be dropped, 127 if the program
+            could not be executed (this function does not return if the
+            program was executed).
+    """
+    try:
+        uid = int(args[0])
+        gid = int(args[1])
+        groups = [ int(g) for g in args[2].split(',') if g ]
+        command = args[3:]
+        if not command:
+            raise ValueError
+    except (IndexError, ValueError):
+        print("usage: privs.py UID GID GROUPS PROG [ARGS...]", file=sys.stderr)
+        return 126
+
+    try:
+        os.umask(0o027)
+        os.setgroups(groups)
+        os.setgid(gid)
+        os.setuid(uid)
+    except OSError as ex:
+        print("dropping privileges to user '{}' failed: {}".format(
+                            uid, ex.strerror.lower()), file=sys.stderr)
+        return 126
+
+    try:
+        os.execvp(command[0], command)
+    except OSError as ex:
+        print("command '{}': {}".format(command[0], ex.strerror.lower()),
+              file=sys.stderr)
+    return 127
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
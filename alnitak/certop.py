@@ -1,7 +1,9 @@
 
+import os
 import re
 from codecs import encode
 from cryptography import x509
+from cryptography.exceptions import UnsupportedAlgorithm
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives import serialization
@@ -126,7 +128,7 @@ def read_cert(cert, tlsa_usage):
             if there is no content of the 'cert' file.
     """
     try:
-        with open(str(cert), "r") as file:
+        with open(str(cert), "rb") as file:
             cert_data = file.read()
     except FileNotFoundError as ex:
         raise Except.DNSProcessingError(
@@ -137,29 +139,80 @@ def read_cert(cert, tlsa_usage):
                 "creating hash: certificate file '{}': {}".format(
                                         ex.filename, ex.strerror.lower()))
 
+    return bytes(extract_cert(cert, cert_data, tlsa_usage)).decode('utf-8')
+
+def pem_blocks(data):
+    """Return the offsets of the PEM certificate blocks in the input.
+
+    The input is scanned once, from the start, for every
+    '-----BEGIN CERTIFICATE-----' line and its matching
+    '-----END CERTIFICATE-----' line. A block without an END line runs to
+    the end of the input.
+
+    For example, for a fullchain file of 3000 bytes holding a 1700 byte
+    certificate followed by a 1300 byte intermediate certificate, return:
+        [ (0, 1700), (1700, 3000) ]
+
+    Args:
+        data (bytes|bytearray|mmap.mmap): the PEM-encoded data.
+
+    Returns:
+        list(tuple(int, int)): the (start, end) offsets of every
+            certificate block, such that 'data[start:end]' is the block,
+            including its BEGIN and END lines.
+    """
+    begin = b"-----BEGIN CERTIFICATE-----"
+    end = b"-----END CERTIFICATE-----"
+
+    blocks = []
+    pos = data.find(begin)
+    while pos >= 0:
+        stop = data.find(end, pos + len(begin))
+        if stop < 0:
+            blocks += [ (pos, len(data)) ]
+            break
+        stop += len(end)
+        if data[stop:stop+2] == b"\r\n":
+            stop += 2
+        elif data[stop:stop+1] == b"\n":
+            stop += 1
+        blocks += [ (pos, stop) ]
+        pos = data.find(begin, stop)
+
+    return blocks
+
+def extract_cert(cert, cert_data, tlsa_usage):
+    """Return the PEM-encoded certificate to use from a file's content.
+
+    Args:
+        cert (pathlib.Path): the file 'cert_data' was read from.
+        cert_data (bytes): the content of 'cert'.
+        tlsa_usage (str): tlsa usage field.
+
+    Returns:
+        bytes|memoryview: PEM-encoded certificate. If 'cert' is a fullchain
+            file, the relevent certificate PEM is extracted as a slice of
+            'cert_data'.
+
+    Raises:
+        DNSProcessingError: if no appropriate PEM section in a fullchain
+            file could be found, or there is no content to return.
+    """
     if re.match(r"fullchain[0-9]*\.pem$", cert.name):
-        pems = []
-        temp = ""
-        for l in cert_data.splitlines():
-            if l == "-----BEGIN CERTIFICATE-----":
-                if temp:
-                    pems += [ temp ]
-                temp = l
-            else:
-                temp += "\n{}".format(l)
-        if temp:
-            pems += [ temp ]
+        pems = pem_blocks(cert_data)
 
         if tlsa_usage == '2':
             if len(pems) < 2:
                 raise Except.DNSProcessingError("creating hash: '{}' file: no intermediate certificate found".format(cert))
-            cert_data = pems[1]
+            start, stop = pems[1]
         else:
             if len(pems) < 1:
                 raise Except.DNSProcessingError(
                     "creating hash: '{}' file: no certificate found".format(
                                                                         cert))
-            cert_data = pems[0]
+            start, stop = pems[0]
+
+        cert_data = memoryview(cert_data)[start:stop]
 
     if len(cert_data) == 0:
         raise Except.DNSProcessingError(
@@ -167,6 +220,137 @@ def read_cert(cert, tlsa_usage):
 
     return cert_data
 
+class Certificate:
+    """A parsed certificate and the encodings the TLSA hashes are made from.
+
+    Attributes:
+        x509 (x509.Certificate): the parsed certificate.
+        der (bytes): DER encoding of the full certificate (selector '0').
+        spki (bytes): DER encoding of the SubjectPublicKeyInfo of the
+            certificate (selector '1').
+        digests (dict): the 'certificate data' (hashes) of the
+            certificate, keyed by the concatenated selector and matching
+            type fields (e.g. '11'). Set to 'None' until a hash is first
+            requested, when all six combinations are created at once.
+    """
+
+    def __init__(self, data):
+        """Parse a PEM-encoded certificate.
+
+        Args:
+            data (str|bytes|memoryview): PEM-encoded certificate data.
+
+        Raises:
+            InternalError: if the data could not be parsed.
+        """
+        if isinstance(data, str):
+            data = bytes(data, 'utf-8')
+        else:
+            data = bytes(data)
+
+        try:
+            self.x509 = x509.load_pem_x509_certificate(data,
+                                                       default_backend())
+        except ValueError as ex:
+            raise Except.InternalError(
+                    "creating hash failed: {}".format(str(ex).lower()))
+
+        self.der = self.x509.public_bytes(
+                                    encoding=serialization.Encoding.DER)
+        self.spki = self.x509.public_key().public_bytes(
+                        encoding=serialization.Encoding.DER,
+                        format=serialization.PublicFormat.SubjectPublicKeyInfo)
+        self.digests = None
+
+    def hash(self, selector, matching):
+        """Return the 'certificate data' (hash) of the certificate.
+
+        Args:
+            selector (str): TLSA selector field (0|1).
+            matching (str): TLSA matching-type field (0|1|2).
+
+        Returns:
+            str: the 'certificate data' (hash).
+
+        Raises:
+            InternalError: if generating the 'certificate data' fails for
+                any reason.
+        """
+        if self.digests is None:
+            digests = {}
+            for sel, der in [ ('0', self.der), ('1', self.spki) ]:
+                for mat in [ '0', '1', '2' ]:
+                    digests[sel + mat] = digest(mat, der)
+            self.digests = digests
+
+        try:
+            return self.digests[selector + matching]
+        except KeyError:
+            raise Except.InternalError(
+                    "unrecognized selector/matching type '{}{}'".format(
+                                                        selector, matching))
+
+def load_cert(prog, cert, tlsa_usage):
+    """Return the parsed certificate to use from a certificate file.
+
+    Every distinct certificate is read and parsed only once per run: the
+    result is kept in 'prog.cert_cache', keyed by the file path, its
+    modification time and inode (so a file that is replaced, e.g. by a
+    certificate renewal, is read again) and the tlsa usage (which decides
+    which certificate of a fullchain file is used).
+
+    Args:
+        prog (State): the certificate cache 'prog.cert_cache' is updated.
+        cert (pathlib.Path): PEM-encoded file to read.
+        tlsa_usage (str): tlsa usage field.
+
+    Returns:
+        Certificate: the parsed certificate.
+
+    Raises:
+        DNSProcessingError: if 'cert' could not be opened or no appropriate
+            PEM section in a fullchain file could be found.
+        InternalError: if the certificate could not be parsed.
+    """
+    try:
+        with open(str(cert), "rb") as file:
+            st = os.fstat(file.fileno())
+            key = (str(cert), st.st_mtime_ns, st.st_ino, tlsa_usage)
+            if key in prog.cert_cache:
+                return prog.cert_cache[key]
+            cert_data = file.read()
+    except FileNotFoundError as ex:
+        raise Except.DNSProcessingError(
+                "creating hash: certificate file '{}' not found".format(
+                                                                ex.filename))
+    except OSError as ex:
+        raise Except.DNSProcessingError(
+                "creating hash: certificate file '{}': {}".format(
+                                        ex.filename, ex.strerror.lower()))
+
+    prog.cert_cache[key] = Certificate(
+                                extract_cert(cert, cert_data, tlsa_usage))
+    return prog.cert_cache[key]
+
+def get_tlsa_hash(prog, cert, tlsa):
+    """Create a DANE record 'certificate data' (hash) from a certificate file.
+
+    Args:
+        prog (State): the certificate cache 'prog.cert_cache' is updated.
+        cert (pathlib.Path): PEM-encoded file to read.
+        tlsa (Tlsa): the usage, selector and matching type fields of the
+            record to create the hash for.
+
+    Returns:
+        str: the 'certificate data' (hash).
+
+    Raises:
+        DNSProcessingError: if 'cert' could not be read.
+        InternalError: if generating the 'certificate data' fails.
+    """
+    return cert_hash(tlsa.selector, tlsa.matching,
+                     load_cert(prog, cert, tlsa.usage))
+
 def get_hash(selector, matching, data):
     """Create a DANE record 'certificate data' (hash) string.
 
@@ -185,43 +369,49 @@ def get_hash(selector, matching, data):
         InternalError: if generating the 'certificate data' fails for any
             reason.
     """
-    try:
-        cert = x509.load_pem_x509_certificate(
-                                    bytes(data, 'utf-8'), default_backend())
-    except ValueError as ex:
-        raise Except.InternalError(
-                "creating hash failed: {}".format(str(ex).lower()))
+    return cert_hash(selector, matching, Certificate(data))
+
+def cert_hash(selector, matching, cert):
+    """Create a DANE record 'certificate data' (hash) string.
+
+    Args:
+        selector (str): TLSA selector field (0|1).
+        matching (str): TLSA matching-type field (0|1|2).
+        cert (Certificate): the parsed certificate.
+
+    Returns:
+        str: the 'certificate data' (hash).
+
+    Raises:
+        InternalError: if generating the 'certificate data' fails for any
+            reason.
+    """
+    return cert.hash(selector, matching)
+
+def digest(matching, der):
+    """Create 'certificate data' (hash) from DER-encoded data.
+
+    Args:
+        matching (str): TLSA matching-type field (0|1|2).
+        der (bytes): DER-encoded certificate or SubjectPublicKeyInfo.
 
+    Returns:
+        str: the 'certificate data' (hash).
+
+    Raises:
+        InternalError: if generating the 'certificate data' fails for any
+            reason.
+    """
     try:
-        if selector == '0':
-            # use the full certificate
-            if matching == '0':
-                return encode(cert.public_bytes(
-                                    encoding=serialization.Encoding.DER),
-                                    'hex').decode('ascii')
-            elif matching == '1':
-                return encode(cert.fingerprint(hashes.SHA256()),
-                              'hex').decode('ascii')
-            else:
-                return encode(cert.fingerprint(hashes.SHA512()),
-                              'hex').decode('ascii')
+        if matching == '0':
+            return encode(der, 'hex').decode('ascii')
+        elif matching == '1':
+            h = hashes.Hash(hashes.SHA256(), backend=default_backend())
         else:
-            # use the public key
-            der = cert.public_key().public_bytes(
-                        encoding=serialization.Encoding.DER,
-                        format=serialization.PublicFormat.SubjectPublicKeyInfo)
-            if matching == '0':
-                return encode(der, 'hex').decode('ascii')
-            elif matching == '1':
-                digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
-                digest.update(der)
-                return encode(digest.finalize(), 'hex').decode('ascii')
-            else:
-                digest = hashes.Hash(hashes.SHA512(), backend=default_backend())
-                digest.update(der)
-                return encode(digest.finalize(), 'hex').decode('ascii')
-    except cryptography.exceptions.UnsupportedAlgorithm:
+            h = hashes.Hash(hashes.SHA512(), backend=default_backend())
+        h.update(der)
+        return encode(h.finalize(), 'hex').decode('ascii')
+    except UnsupportedAlgorithm:
         raise Except.InternalError("unsupported hash algorithm")
     except TypeError:
         raise Except.InternalError("certificate data not a byte string")
-
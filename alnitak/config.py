@@ -72,7 +72,7 @@ def read(prog):
                     # this with the 'copy' method.
                     target.api.set_domain(active_section)
                 for tlsa in default_tlsa_list:
-                    tlsa.domain = active_section
+                    tlsa.domain = Prog.intern(active_section)
                     target.add_tlsa(tlsa)
             continue
 
@@ -194,6 +194,69 @@ def read(prog):
 
                     prog.set_ttl(ttl_value)
 
+            elif param == "jobs":
+                prog.log.info3("  + line {}: parameter: {}, inputs: {}".format(
+                                                    line_pos, param, inputs))
+                if len(inputs) == 0:
+                    state.add_error(
+                        prog, "jobs command given no input")
+                elif len(inputs) > 1:
+                    state.add_error(prog, "jobs command given superfluous input: '{}'".format(' '.join(inputs[1:])))
+                else:
+                    try:
+                        import alnitak.parser
+                        jobs_value = alnitak.parser.jobs_check(prog, 0, 'config', inputs[0])
+                    except Except.Error1013:
+                        state.add_error(prog, "jobs value '{}' not an integer".format(inputs[0]))
+                        continue
+                    except Except.Error1100 as ex:
+                        state.add_error(prog, "jobs value '{}' exceeds maximum value of '{}'".format(inputs[0], ex.max))
+                        continue
+                    except Except.Error1101 as ex:
+                        state.add_error(prog, "jobs value '{}' less than minimum value of '{}'".format(inputs[0], ex.min))
+                        continue
+
+                    prog.set_jobs(jobs_value)
+
+            elif param == "hook_deadline":
+                prog.log.info3("  + line {}: parameter: {}, inputs: {}".format(
+                                                    line_pos, param, inputs))
+                if len(inputs) == 0:
+                    state.add_error(
+                        prog, "hook_deadline command given no input")
+                elif len(inputs) > 1:
+                    state.add_error(prog, "hook_deadline command given superfluous input: '{}'".format(' '.join(inputs[1:])))
+                elif not re.match(r'\d+$', inputs[0]) or int(inputs[0]) == 0:
+                    state.add_error(prog, "hook_deadline value '{}' not a positive integer".format(inputs[0]))
+                else:
+                    prog.hook_deadline = int(inputs[0])
+
+            elif param == "datafile_format":
+                prog.log.info3("  + line {}: parameter: {}, inputs: {}".format(
+                                                    line_pos, param, inputs))
+                if len(inputs) == 0:
+                    state.add_error(
+                        prog, "datafile_format command given no input")
+                elif len(inputs) > 1:
+                    state.add_error(prog, "datafile_format command given superfluous input: '{}'".format(' '.join(inputs[1:])))
+                elif inputs[0] not in [ 'text', 'journal', 'sqlite' ]:
+                    state.add_error(prog, "datafile_format value '{}' not one of 'text', 'journal' or 'sqlite'".format(inputs[0]))
+                else:
+                    prog.datafile_format = inputs[0]
+
+            elif param == "datafile_loading":
+                prog.log.info3("  + line {}: parameter: {}, inputs: {}".format(
+                                                    line_pos, param, inputs))
+                if len(inputs) == 0:
+                    state.add_error(
+                        prog, "datafile_loading command given no input")
+                elif len(inputs) > 1:
+                    state.add_error(prog, "datafile_loading command given superfluous input: '{}'".format(' '.join(inputs[1:])))
+                elif inputs[0] not in [ 'full', 'lazy' ]:
+                    state.add_error(prog, "datafile_loading value '{}' not one of 'full' or 'lazy'".format(inputs[0]))
+                else:
+                    prog.datafile_loading = inputs[0]
+
 
             else:
                 state.add_error(prog,
@@ -214,6 +277,15 @@ def read(prog):
 
 
     state.lineno = None
+
+    # targets with identical api details share the one api object, so that,
+    # e.g., a Cloudflare zone ID is only looked up once for all targets in
+    # the same zone.
+    apis = {}
+    for t in prog.target_list:
+        if t.api:
+            t.api = apis.setdefault(t.api, t.api)
+
     for t in prog.target_list:
         if not t.tlsa:
             state.add_error(
@@ -304,7 +376,7 @@ def is_input_port(prog, inp, tlsa):
             return False
     except ValueError:
         return False
-    tlsa.port = inp
+    tlsa.port = Prog.intern(inp)
     return True
 
 def is_input_protocol(prog, inp, tlsa):
@@ -321,7 +393,7 @@ def is_input_protocol(prog, inp, tlsa):
             'False' if not.
     """
     if re.match(r"{}$".format(prog.tlsa_protocol_regex), inp):
-        tlsa.protocol = inp
+        tlsa.protocol = Prog.intern(inp)
         return True
     return False
 
@@ -339,7 +411,7 @@ def is_input_domain(prog, inp, tlsa):
             'False' if not.
     """
     if re.match(r'{}$'.format(prog.tlsa_domain_regex), inp):
-        tlsa.domain = inp
+        tlsa.domain = Prog.intern(inp)
         return True
     return False
 
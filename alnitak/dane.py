@@ -1,6 +1,7 @@
 
 import os
 import pathlib
+import concurrent.futures
 from importlib import import_module
 
 from alnitak import prog as Prog
@@ -420,7 +421,13 @@ def process_data(prog):
     that share a common domain. First, withing every group, all the
     delete lines are processed. Then we loop over the groups again, and if
     there exist posthook lines, we call 'process_data_posthook', otherwise
-    we call 'process_data_prehook'.
+    we call 'process_data_prehook'. Only the groups with work to do are
+    visited (see 'Data.work_groups'): a group that is only waiting for its
+    time-to-live value to pass is skipped. If more than one job is allowed,
+    the groups are processed concurrently (see 'process_groups'). After each
+    loop, any api operations that were queued are made (see
+    'finish_api_calls'). Finally, any processes kept running by the api
+    schemes are stopped (see 'close_api_calls').
 
     Args:
         prog (State): program internal state.
@@ -431,38 +438,232 @@ def process_data(prog):
     """
     retval = Prog.RetVal.ok
 
-    for group in prog.data.groups:
+    try:
         # if there are any delete lines, we should try to process them now
-        for l in group.special:
+        groups = [ g for g in prog.data.groups if g.special ]
+        if process_groups(prog, process_data_delete, groups):
+            retval = Prog.RetVal.continue_failure
+
+        if finish_api_calls(prog):
+            retval = Prog.RetVal.continue_failure
+
+        groups = prog.data.work_groups(prog)
+        prog.log.info3("  + {} of {} groups have work to do".format(
+                                        len(groups), len(prog.data.groups)))
+        if process_groups(prog, process_data_group, groups):
+            retval = Prog.RetVal.continue_failure
+
+        if finish_api_calls(prog):
+            retval = Prog.RetVal.continue_failure
+    finally:
+        close_api_calls(prog)
+
+    return retval
+
+def process_groups(prog, func, groups=None):
+    """Call a function on every data group.
+
+    If 'prog.jobs' is greater than one, then the groups are processed
+    concurrently by a pool of (at most) that many threads. Since all the
+    state that is changed belongs to a group (its data lines and target),
+    groups do not interfere with each other. Each group is given its own
+    GroupState object so that log messages are not interleaved: they are
+    sent to the program log in the order of the groups, so the output is
+    the same as if the groups had been processed one at a time. The order
+    of the groups themselves, and hence of the datafile lines, is not
+    changed.
+
+    Args:
+        prog (State): program internal state.
+        func (function): function to call as 'func(prog, group)' for every
+            group. It should return 'True' for errors, 'False' otherwise.
+        groups (list(DataGroup)): the groups to call 'func' on, or else
+            all the data groups if 'None'.
+
+    Returns:
+        bool: return 'True' if 'func' returned 'True' for any group,
+            'False' otherwise.
+    """
+    errors = False
+    if groups is None:
+        groups = prog.data.groups
+    workers = min(prog.jobs, len(groups))
+
+    if workers <= 1:
+        for group in groups:
+            if func(prog, group):
+                errors = True
+        return errors
+
+    states = [ Prog.GroupState(prog) for group in groups ]
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        futures = [ pool.submit(func, st, group)
+                                    for st, group in zip(states, groups) ]
+        for st, future in zip(states, futures):
             try:
-                delete_dane_if_up(prog, group.target.api, l.tlsa, l.hash)
-                l.write_state_off()
-            except Except.DNSSkip as ex:
-                prog.log.info2("  + {}".format(ex.message))
-                prog.log.info2(
-                        "  + TLSA record not removed; incrementing the count")
-                l.increment_count()
-            except Except.DNSNoReturnError as ex:
-                prog.log.error(ex.message)
-                prog.log.info2(
-                        "  + TLSA record not removed; incrementing the count")
-                l.increment_count()
-            except (Except.DNSError, Except.InternalError) as ex:
-                prog.log.error(ex.message)
-                prog.log.info2(
-                        "  + TLSA record not removed; incrementing the count")
-                l.increment_count()
-                retval = Prog.RetVal.continue_failure
+                if future.result():
+                    errors = True
+            finally:
+                st.log.replay(prog.log)
+
+    return errors
+
+def finish_api_calls(prog):
+    """Make the api operations that were queued whilst processing groups.
+
+    Api schemes that queue publishes and deletes (e.g. 'cloudflare' with
+    batching enabled) return an ApiOp object for every operation queued,
+    and the line that depends on it is changed as if the operation
+    succeeded. Here the operations are made (by the 'api_finish' function
+    of the api module) and, for every operation that failed, the functions
+    in its 'on_error' list are called to change the line back. Finally,
+    the 'deferred' functions of every group are called: these finish the
+    processing of the group that depends on the result of the operations.
+
+    Args:
+        prog (State): program internal state.
+
+    Returns:
+        bool: return 'True' for errors, 'False' otherwise.
+    """
+    errors = False
 
+    apis = []
     for group in prog.data.groups:
-        if group.post:
-            if process_data_posthook(prog, group):
-                retval = Prog.RetVal.continue_failure
-        else:
-            if process_data_prehook(prog, group):
-                retval = Prog.RetVal.continue_failure
+        if not group.target:
+            continue
+        api = group.target.api
+        if not [ a for a in apis if a is api ]:
+            apis += [ api ]
 
-    return retval
+    for api in apis:
+        apimod = import_module('alnitak.api.' + api.type.value)
+        if not hasattr(apimod, 'api_finish'):
+            continue
+        for op in apimod.api_finish(prog, api):
+            if not op.error:
+                continue
+            for func in op.on_error:
+                if func(prog, op.error):
+                    errors = True
+
+    for group in prog.data.groups:
+        deferred = group.deferred
+        group.deferred = []
+        for func in deferred:
+            if func(prog, group):
+                errors = True
+
+    return errors
+
+def close_api_calls(prog):
+    """Stop any processes kept running by the api schemes.
+
+    Calls the 'api_close' function of every api module (of the targets of
+    the groups) that has one.
+
+    Args:
+        prog (State): program internal state.
+    """
+    types = []
+    for group in prog.data.groups:
+        if group.target and group.target.api.type not in types:
+            types += [ group.target.api.type ]
+
+    for t in types:
+        apimod = import_module('alnitak.api.' + t.value)
+        if hasattr(apimod, 'api_close'):
+            apimod.api_close(prog)
+
+def log_api_error(prog, op, ex):
+    """Log the failure of a queued api operation.
+
+    Args:
+        prog (State): program internal state.
+        op (str): the operation (e.g. 'publish').
+        ex (DNSExcept): the exception raised for the operation.
+
+    Returns:
+        bool: return 'True' if the failure is an error (as it would be if
+            the operation had not been queued), 'False' otherwise.
+    """
+    prog.log.info1("+++ queued {} of TLSA record failed".format(op))
+    if isinstance(ex, Except.DNSSkip):
+        prog.log.info2("  + {}".format(ex.message))
+        return False
+    prog.log.error(ex.message)
+    return not isinstance(ex, Except.DNSNoReturnError)
+
+def process_data_delete(prog, group):
+    """Process delete lines.
+
+    Args:
+        prog (State): program internal state.
+        group (DataGroup): the group of delete lines.
+
+    Returns:
+        bool: return 'True' for errors, 'False' otherwise.
+    """
+    errors = False
+
+    for l in group.special:
+        try:
+            op = delete_dane_if_up(prog, group.target.api, l.tlsa, l.hash)
+            l.write_state_off()
+            if op:
+                op.on_error += [ delete_failed(l) ]
+        except Except.DNSSkip as ex:
+            prog.log.info2("  + {}".format(ex.message))
+            prog.log.info2(
+                    "  + TLSA record not removed; incrementing the count")
+            l.increment_count()
+        except Except.DNSNoReturnError as ex:
+            prog.log.error(ex.message)
+            prog.log.info2(
+                    "  + TLSA record not removed; incrementing the count")
+            l.increment_count()
+        except (Except.DNSError, Except.InternalError) as ex:
+            prog.log.error(ex.message)
+            prog.log.info2(
+                    "  + TLSA record not removed; incrementing the count")
+            l.increment_count()
+            errors = True
+
+    return errors
+
+def delete_failed(line):
+    """Return the function to call if the queued delete of a delete line
+    failed.
+
+    Args:
+        line (DataDelete): the delete line.
+
+    Returns:
+        function: the function to add to the 'on_error' list of the
+            operation.
+    """
+    def on_error(prog, ex):
+        errors = log_api_error(prog, "delete", ex)
+        prog.log.info2(
+                "  + TLSA record not removed; incrementing the count")
+        line.write_state_on()
+        line.increment_count()
+        return errors
+    return on_error
+
+def process_data_group(prog, group):
+    """Process the prehook and posthook lines of a group.
+
+    Args:
+        prog (State): program internal state.
+        group (DataGroup): the group of prehook and/or posthook lines.
+
+    Returns:
+        bool: return 'True' for errors, 'False' otherwise.
+    """
+    if group.post:
+        return process_data_posthook(prog, group)
+    return process_data_prehook(prog, group)
 
 def delete_dane_if_up(prog, api, tlsa, hash1, hash2 = None):
     """Delete a DANE TLSA record.
@@ -493,7 +694,8 @@ def delete_dane_if_up(prog, api, tlsa, hash1, hash2 = None):
         prog (State): program internal state.
 
     Returns:
-        NoneType: always returns 'None'.
+        ApiOp: the delete, if it was queued by the api scheme (see
+            'finish_api_calls'), otherwise 'None'.
 
     Raises:
         DNSNotLive: if DANE record not up yet.
@@ -507,7 +709,7 @@ def delete_dane_if_up(prog, api, tlsa, hash1, hash2 = None):
 
     if api.type == Prog.ApiType.exec:
         from alnitak.api.exec import api_delete
-        api_delete(prog, api, tlsa, hash1, hash2)
+        return api_delete(prog, api, tlsa, hash1, hash2)
     else:
         apimod = import_module('alnitak.api.' + api.type.value)
         
@@ -526,8 +728,7 @@ def delete_dane_if_up(prog, api, tlsa, hash1, hash2 = None):
         # record
         for r in records:
             if r == hash1:
-                apimod.api_delete(prog, api, tlsa, records[r])
-                break
+                return apimod.api_delete(prog, api, tlsa, records[r])
         else:
             raise Except.DNSNotLive("TLSA record not up yet")
 
@@ -601,6 +802,7 @@ def process_data_posthook_not_renewed(prog, group):
         bool: return 'True' for errors, 'False' otherwise.
     """
     errors = False
+    queued = False
 
     for l in group.post:
         if l.pending == '0':
@@ -632,18 +834,21 @@ def process_data_posthook_not_renewed(prog, group):
                 prog.log.info2(
                         "  + old hash: going to use cert '{}'".format(cert))
 
-                cert_data = certop.read_cert(cert, l.tlsa.usage)
-                hash = certop.get_hash( l.tlsa.selector, l.tlsa.matching,
-                                             cert_data)
+                hash = certop.get_tlsa_hash(prog, cert, l.tlsa)
                 prog.log.info2("  + old {}{}{} hash: {}".format(
                     l.tlsa.usage, l.tlsa.selector, l.tlsa.matching, hash))
 
                 # check if the dns record is up
-                delete_dane_if_up(prog, group.target.api, l.tlsa, hash, l.hash)
+                op = delete_dane_if_up(prog, group.target.api, l.tlsa, hash,
+                                       l.hash)
 
                 # change the write state of the line
                 l.write_state_off()
 
+                if op:
+                    op.on_error += [ delete_old_failed(l) ]
+                    queued = True
+
             except Except.DNSSkip as ex:
                 prog.log.info2("  + {}".format(ex.message))
             except (Except.DNSError, Except.InternalError) as ex:
@@ -658,9 +863,14 @@ def process_data_posthook_not_renewed(prog, group):
             try:
                 apimod = import_module('alnitak.api.'
                                                 + group.target.api.type.value)
-                apimod.api_publish(prog, group.target.api, l.tlsa, l.hash)
+                op = apimod.api_publish(prog, group.target.api, l.tlsa,
+                                        l.hash)
 
-                prog.log.info2("  + record published successfully")
+                if op:
+                    op.on_error += [ republish_failed(l, l.time) ]
+                    queued = True
+                else:
+                    prog.log.info2("  + record published successfully")
 
                 # switch the pending state of the line
                 l.pending_off()
@@ -679,18 +889,77 @@ def process_data_posthook_not_renewed(prog, group):
                 prog.log.error(ex.message)
                 errors = True
 
+    # whether any posthook lines are left depends on the queued operations
+    if queued:
+        group.deferred += [ finish_posthook_not_renewed ]
+        return errors
+
+    if finish_posthook_not_renewed(prog, group):
+        errors = True
+
+    return errors
+
+def finish_posthook_not_renewed(prog, group):
+    """Finish processing posthook lines for the non-renewed domain.
+
+    If no posthook lines are left to write, then all the prehook lines are
+    removed too (see 'archive_to_live').
+
+    Args:
+        prog (State): program internal state.
+        group (DataGroup): the group of prehook and/or posthook lines.
+
+    Returns:
+        bool: return 'True' for errors, 'False' otherwise.
+    """
     # let's now see if we have _any_ posthook lines to write
     for l in group.post:
         if l.state == Prog.DataLineState.write:
-            break
-    else:
-        # no posthook lines: remove all the prehook lines:
-        prog.log.info2(
-                "+++ all posthook lines processed (all records up/deleted)")
-        if archive_to_live(prog, group):
-            errors = True
+            return False
 
-    return errors
+    # no posthook lines: remove all the prehook lines:
+    prog.log.info2(
+            "+++ all posthook lines processed (all records up/deleted)")
+    return archive_to_live(prog, group)
+
+def delete_old_failed(line):
+    """Return the function to call if the queued delete of an old TLSA
+    record (of a posthook line) failed.
+
+    Args:
+        line (DataPost): the posthook line.
+
+    Returns:
+        function: the function to add to the 'on_error' list of the
+            operation.
+    """
+    def on_error(prog, ex):
+        errors = log_api_error(prog, "delete", ex)
+        line.write_state_on()
+        return errors
+    return on_error
+
+def republish_failed(line, time):
+    """Return the function to call if the queued (re)publish of a posthook
+    line failed.
+
+    Args:
+        line (DataPost): the posthook line.
+        time (str): the time of the line before the publish was queued.
+
+    Returns:
+        function: the function to add to the 'on_error' list of the
+            operation.
+    """
+    def on_error(prog, ex):
+        errors = log_api_error(prog, "publish", ex)
+        if isinstance(ex, Except.DNSSkip):
+            # the record is already up
+            line.write_state_off()
+        line.pending_on()
+        line.change_time(time)
+        return errors
+    return on_error
 
 def process_data_posthook_renewed(prog, group):
     """Process posthook lines for the renewed domain.
@@ -736,10 +1005,7 @@ def process_data_posthook_renewed(prog, group):
                                             [ l.cert.live for l in group.pre ])
                 prog.log.info2("  + going to use cert '{}'".format(cert))
 
-                cert_data = certop.read_cert(cert, l.tlsa.usage)
-
-                hash = certop.get_hash(l.tlsa.selector, l.tlsa.matching,
-                                       cert_data)
+                hash = certop.get_tlsa_hash(prog, cert, l.tlsa)
 
                 prog.log.info2("  + {}{}{} hash: {}".format(
                         l.tlsa.usage, l.tlsa.selector, l.tlsa.matching, hash))
@@ -807,7 +1073,9 @@ def process_data_posthook_renewed(prog, group):
     for l in group.post:
         if l.mark_delete:
             try:
-                delete_dane_if_up(prog, group.target.api, l.tlsa, l.hash)
+                op = delete_dane_if_up(prog, group.target.api, l.tlsa, l.hash)
+                if op:
+                    op.on_error += [ delete_renewed_failed(group, l) ]
             except Except.DNSSkip as ex:
                 prog.log.info2("  + {}".format(ex.message))
                 prog.log.info3("  + will write a delete line")
@@ -830,6 +1098,27 @@ def process_data_posthook_renewed(prog, group):
 
     return errors
 
+def delete_renewed_failed(group, line):
+    """Return the function to call if the queued delete of a previous 'new'
+    TLSA record (of a posthook line) failed.
+
+    Args:
+        group (DataGroup): the group of the posthook line.
+        line (DataPost): the posthook line.
+
+    Returns:
+        function: the function to add to the 'on_error' list of the
+            operation.
+    """
+    def on_error(prog, ex):
+        errors = log_api_error(prog, "delete", ex)
+        prog.log.info3("  + will write a delete line")
+        group.add_special(
+            Prog.DataDelete(
+                        group.domain, 0, line.tlsa, '1', line.time, line.hash) )
+        return errors
+    return on_error
+
 def publish_dane(prog, group):
     """Publish a DANE record.
 
@@ -844,6 +1133,7 @@ def publish_dane(prog, group):
         bool: return 'True' for errors, 'False' otherwise.
     """
     errors = False
+    ops = []
 
     for tlsa in group.target.tlsa:
         if not tlsa.publish:
@@ -854,6 +1144,7 @@ def publish_dane(prog, group):
                 " ++ will attempt to publish TLSA DNS record: {}".format(
                                                                   tlsa.pstr()))
         pending = '0'
+        op = None
 
         # cert: if set inside the try block, then use it in the
         # except catches.
@@ -863,17 +1154,14 @@ def publish_dane(prog, group):
                                             [ l.cert.live for l in group.pre ])
             prog.log.info2("  + going to use cert '{}'".format(cert))
 
-            cert_input = certop.read_cert(cert, tlsa.usage)
-
-            hash = certop.get_hash(tlsa.selector, tlsa.matching,
-                                        cert_input)
+            hash = certop.get_tlsa_hash(prog, cert, tlsa)
 
             prog.log.info2("  + {}{}{} hash: {}".format(
                             tlsa.usage, tlsa.selector, tlsa.matching, hash))
 
             # now need to use the Api object to publish a TLSA record
             apimod = import_module('alnitak.api.' + group.target.api.type.value)
-            apimod.api_publish(prog, group.target.api, tlsa, hash)
+            op = apimod.api_publish(prog, group.target.api, tlsa, hash)
 
         except Except.DNSSkip as ex:
             # e.g. this is likely to happen for DANE-TA(2) records, whose
@@ -897,18 +1185,67 @@ def publish_dane(prog, group):
 
         prog.log.info3(
                 "  + creating posthook line with pending '{}'".format(pending))
-        group.add_post( Prog.DataPost( group.domain, 0, tlsa, pending,
-                                  "{:%s}".format(prog.timenow), hash) )
+        line = Prog.DataPost( group.domain, 0, tlsa, pending,
+                              "{:%s}".format(prog.timenow), hash)
+        group.add_post(line)
+
+        if op:
+            op.on_error += [ publish_failed(group, line) ]
+            ops += [ op ]
 
     if group.post:
         for l in group.pre:
             l.pending_on()
+        # a posthook line is removed if its queued publish finds the
+        # record already up
+        if ops:
+            group.deferred += [ finish_publish ]
     else:
         errors2 = archive_to_live(prog, group)
         return errors or errors2
 
     return errors
 
+def finish_publish(prog, group):
+    """Finish publishing DANE records once the queued publishes are made.
+
+    If no posthook lines are left, the prehook lines are removed (see
+    'archive_to_live').
+
+    Args:
+        prog (State): program internal state.
+        group (DataGroup): the group of prehook and/or posthook lines.
+
+    Returns:
+        bool: return 'True' for errors, 'False' otherwise.
+    """
+    if group.post:
+        return False
+    return archive_to_live(prog, group)
+
+def publish_failed(group, line):
+    """Return the function to call if the queued publish of a DANE record
+    failed.
+
+    Args:
+        group (DataGroup): the group of the posthook line.
+        line (DataPost): the posthook line made for the publish.
+
+    Returns:
+        function: the function to add to the 'on_error' list of the
+            operation.
+    """
+    def on_error(prog, ex):
+        errors = log_api_error(prog, "publish", ex)
+        if isinstance(ex, Except.DNSSkip):
+            # record is already up: no posthook line is needed
+            group.remove_post(line)
+        else:
+            prog.log.info3("  + posthook line now has pending '1'")
+            line.pending_on()
+        return errors
+    return on_error
+
 def archive_to_live(prog, group):
     """Move dane symlinks from pointing to archive certs to back to live certs.
 
@@ -1,8 +1,12 @@
 
 import os
 import re
+import tempfile
 
 from alnitak import prog as Prog
+from alnitak import journal
+from alnitak import store
+from alnitak import logging
 
 
 # A datafile will consist of lines:
@@ -44,9 +48,78 @@ from alnitak import prog as Prog
 #       hash: 123456789abcdef0...
 #
 
+# the compiled datafile line patterns, keyed by the regexes they are made
+# from (see 'line_patterns')
+patterns = {}
+
+def line_patterns(prog):
+    """Return the compiled patterns of the datafile lines.
+
+    The patterns are compiled only once, the first time they are needed.
+
+    Args:
+        prog (State): not changed.
+
+    Returns:
+        dict(DataLineType, re.Pattern): the pattern of every type of line.
+    """
+    key = (prog.tlsa_domain_regex, prog.tlsa_parameters_regex,
+           prog.tlsa_protocol_regex)
+
+    compiled = patterns.get(key)
+    if compiled:
+        return compiled
+
+    compiled = {
+        # prehook line
+        #   domain  dane_cert  live_cert  archive_cert  pending
+        Prog.DataLineType.pre: re.compile(r'(?P<domain>{})\s+"(?P<dane>(\\.|[^"])+)"\s+"(?P<live>(\\.|[^"])+)"\s+"(?P<archive>(\\.|[^"])+)"\s+(?P<pending>(0|1))'.format(*key)),
+        # posthook line
+        #   x.com 301 25 tcp x.com unix_time pending hash
+        Prog.DataLineType.post: re.compile(r'(?P<domain>{0})\s+(?P<tlsa_spec>{1})\s+(?P<tlsa_port>[0-9]+)\s+(?P<tlsa_protocol>{2})\s+(?P<tlsa_domain>{0})\s+(?P<time>[0-9]+)\s+(?P<pending>(0|1))\s+(?P<hash>[a-fA-F0-9]+)'.format(*key)),
+        # delete line
+        #   x.com delete 301 25 tcp x.com unix_time count hash
+        Prog.DataLineType.delete: re.compile(r'(?P<domain>{0})\s+delete\s+(?P<tlsa_spec>{1})\s+(?P<tlsa_port>[0-9]+)\s+(?P<tlsa_protocol>{2})\s+(?P<tlsa_domain>{0})\s+(?P<time>[0-9]+)\s+(?P<count>[0-9]+)\s+(?P<hash>[a-fA-F0-9]+)'.format(*key)),
+        }
+
+    patterns[key] = compiled
+    return compiled
+
+def line_type(l):
+    """Classify a datafile line by its first two fields.
+
+    The second field of a line tells the types apart: it is quoted in a
+    prehook line, is the literal 'delete' in a delete line and is the TLSA
+    parameters in a posthook line. The line must still be matched against
+    the pattern of its type (see 'line_patterns').
+
+    Args:
+        l (str): the line.
+
+    Returns:
+        DataLineType: the type the line must be, or else 'None' if an
+            empty (or comment) line, or 'False' if it can be of no type.
+    """
+    fields = l.split(None, 2)
+    if not fields or fields[0][0] == '#':
+        return None
+    if len(fields) < 2:
+        return False
+    if fields[1][0] == '"':
+        return Prog.DataLineType.pre
+    if fields[1] == 'delete':
+        return Prog.DataLineType.delete
+    return Prog.DataLineType.post
+
 def read(prog):
     """Read a datafile and set data in the internal program state.
 
+    The datafile is read a line at a time (and not all at once), and every
+    line is matched against (at most) one pattern: the pattern of the type
+    the line must be (see 'line_type'). A journal datafile or SQLite store
+    is read whatever the 'datafile_format' (see 'read_journal' and
+    'read_store').
+
     Args:
         prog (State): data is set based on the contents of the datafile.
             No datafile is not taken as an error: simply nothing is done.
@@ -58,11 +131,18 @@ def read(prog):
             failed.
     """
     prog.log.info1("+++ reading datafile '{}'".format(prog.datafile))
+    prog.journal = None
+    prog.store = None
+
+    if journal.is_journal(prog.datafile):
+        return read_journal(prog)
+    if store.is_store(prog.datafile):
+        return read_store(prog)
+
     retval = Prog.RetVal.ok
 
     try:
-        with open(str(prog.datafile), "r") as file:
-            raw = file.read().splitlines()
+        file = open(str(prog.datafile), "r")
     except FileNotFoundError as ex:
         # if there is no datafile, then posthook has nothing to do: we should
         # just exit.
@@ -73,82 +153,283 @@ def read(prog):
                 "datafile '{}': {}".format(ex.filename, ex.strerror.lower()))
         return Prog.RetVal.exit_failure
 
+    with file:
+        try:
+            retval = read_lines(prog, ( (line_pos, l.rstrip('\n'))
+                                    for line_pos, l in enumerate(file, 1) ))
+        except OSError as ex:
+            prog.log.error("datafile '{}': {}".format(prog.datafile,
+                                                      ex.strerror.lower()))
+            return Prog.RetVal.exit_failure
 
-    line_pos = 0
-
-    for l in raw:
-        line_pos += 1
+    prog.log.info3(prog.data)
+    return retval
 
-        # matches empty line
-        match = re.match(r'^\s*(#.*)?$', l)
-        if match:
-            continue
+def read_journal(prog):
+    """Read a journal datafile and set data in the internal program state.
 
-        # prehook line
-        #   domain  dane_cert  live_cert  archive_cert  pending
-        match = re.match(r'(?P<domain>{})\s+"(?P<dane>(\\.|[^"])+)"\s+"(?P<live>(\\.|[^"])+)"\s+"(?P<archive>(\\.|[^"])+)"\s+(?P<pending>(0|1))'.format(prog.tlsa_domain_regex), l)
-        if match:
+    The lines of the journal are read as the lines of a text datafile
+    would be, numbered in the order they were added to the journal.
 
-            prog.log.info3("  + line {}: prehook line (pending: {})".format(
-                                            line_pos, match.group('pending')))
+    Args:
+        prog (State): data is set based on the contents of the journal,
+            and 'journal' is set to the contents of the journal.
 
-            prog.data.add_line( prog, Prog.DataPre( match.group('domain'),
-                                               line_pos,
-                                               match.group('dane'),
-                                               match.group('live'),
-                                               match.group('archive'),
-                                               match.group('pending') ) )
+    Returns:
+        RetVal: returns 'RetVal.ok' if no errors encountered,
+            'RetVal.exit_failure' if errors found in the journal or
+            reading the journal failed.
+    """
+    prog.log.info2("  + reading journal datafile")
 
-            continue
+    try:
+        prog.journal = journal.load(prog.datafile)
+    except OSError as ex:
+        prog.log.error(
+                "datafile '{}': {}".format(ex.filename, ex.strerror.lower()))
+        return Prog.RetVal.exit_failure
 
-        # posthook line
-        #   x.com 301 25 tcp x.com unix_time pending hash
-        match = re.match(r'(?P<domain>{})\s+(?P<tlsa_spec>{})\s+(?P<tlsa_port>[0-9]+)\s+(?P<tlsa_protocol>{})\s+(?P<tlsa_domain>{})\s+(?P<time>[0-9]+)\s+(?P<pending>(0|1))\s+(?P<hash>[a-fA-F0-9]+)'.format(prog.tlsa_domain_regex, prog.tlsa_parameters_regex, prog.tlsa_protocol_regex, prog.tlsa_domain_regex), l)
-        if match:
+    if prog.journal.dropped:
+        prog.log.info1(
+            "  + incomplete journal record: {} bytes discarded".format(
+                                                    prog.journal.dropped))
 
-            prog.log.info3("  + line {}: posthook line (pending: {})".format(
-                                            line_pos, match.group('pending')))
+    retval = read_lines(prog, enumerate(prog.journal.lines, 1))
 
-            prog.data.add_line( prog, Prog.DataPost( match.group('domain'),
-                                                line_pos,
-                                                Prog.Tlsa(
-                                                  match.group('tlsa_spec'),
-                                                  match.group('tlsa_port'),
-                                                  match.group('tlsa_protocol'),
-                                                  match.group('tlsa_domain') ),
-                                                match.group('pending'),
-                                                match.group('time'),
-                                                match.group('hash') ) )
+    prog.log.info3(prog.data)
+    return retval
 
-            continue
+def read_store(prog):
+    """Read a SQLite store and set data in the internal program state.
 
-        # delete line
-        #   x.com delete 301 25 tcp x.com unix_time count hash
-        match = re.match(r'(?P<domain>{})\s+delete\s+(?P<tlsa_spec>{})\s+(?P<tlsa_port>[0-9]+)\s+(?P<tlsa_protocol>{})\s+(?P<tlsa_domain>{})\s+(?P<time>[0-9]+)\s+(?P<count>[0-9]+)\s+(?P<hash>[a-fA-F0-9]+)'.format(prog.tlsa_domain_regex, prog.tlsa_parameters_regex, prog.tlsa_protocol_regex, prog.tlsa_domain_regex), l)
-        if match:
+    If the 'datafile_format' is 'sqlite', then only the lines of the
+    renewed domains, and of the domains with work to do (see
+    'store.due_domains'), are read: the lines of the other domains are
+    left in the store as they are. Otherwise all the lines are read, so
+    that they can be written in the other format.
 
-            prog.log.info3("  + line {}: delete line (count: {})".format(
-                                            line_pos, match.group('count')))
+    Args:
+        prog (State): data is set based on the contents of the store, and
+            'store' is set to record what was read.
 
-            prog.data.add_line( prog, Prog.DataDelete(
-                                            match.group('domain'),
-                                            line_pos,
-                                            Prog.Tlsa( match.group('tlsa_spec'),
-                                                  match.group('tlsa_port'),
-                                                  match.group('tlsa_protocol'),
-                                                  match.group('tlsa_domain') ),
-                                            match.group('count'),
-                                            match.group('time'),
-                                            match.group('hash') ) )
+    Returns:
+        RetVal: returns 'RetVal.ok' if no errors encountered,
+            'RetVal.exit_failure' if reading the store failed.
+    """
+    prog.log.info2("  + reading sqlite datafile")
+    domains = None
 
-            continue
+    try:
+        with store.open_store(prog.datafile) as conn:
+            if prog.datafile_format == 'sqlite':
+                due = int("{:%s}".format(prog.timenow)) - prog.ttl
+                domains = (set(prog.renewed_domains)
+                                        | store.due_domains(conn, due))
+                prog.log.info2("  + reading lines of {} domains".format(
+                                                                len(domains)))
+            lines = store.load(conn, domains)
+            if domains is not None:
+                earliest = store.earliest(conn)
+                if earliest:
+                    prog.data.add_deadline(*earliest)
+    except store.Error as ex:
+        prog.log.error("datafile '{}': {}".format(prog.datafile, ex))
+        return Prog.RetVal.exit_failure
 
-        prog.log.error("line {}: malformed line".format(line_pos))
-        retval = Prog.RetVal.exit_failure
+    prog.store = store.Store(domains)
+    for l in lines:
+        prog.data.add_line(prog, l)
 
     prog.log.info3(prog.data)
+    return Prog.RetVal.ok
+
+def read_lines(prog, lines):
+    """Read datafile lines and add them to the internal program state.
+
+    If the 'datafile_loading' is 'lazy', then only the lines of the
+    renewed domains, and of the domains with work to do (see
+    'line_work'), are read: the lines of the other domains are kept as
+    they are in 'data.unloaded', to be written out unchanged.
+
+    Args:
+        prog (State): the lines are added to 'data'.
+        lines (iterable((int, str))): the line number and line of every
+            line.
+
+    Returns:
+        RetVal: returns 'RetVal.ok' if no errors encountered,
+            'RetVal.exit_failure' if any line is malformed.
+    """
+    retval = Prog.RetVal.ok
+    compiled = line_patterns(prog)
+
+    if prog.datafile_loading == 'lazy':
+        due = int("{:%s}".format(prog.timenow)) - prog.ttl
+        work = set(prog.renewed_domains)
+        domains = {}
+        for line_pos, l in lines:
+            domain, has_work, published = line_work(l, due)
+            if domain:
+                domains.setdefault(domain, []).append((line_pos, l, published))
+                if has_work:
+                    work.add(domain)
+
+        lines = []
+        for domain, domain_lines in domains.items():
+            if domain in work:
+                lines += [ (line_pos, l) for line_pos, l, published
+                                                        in domain_lines ]
+                continue
+            for line_pos, l, published in domain_lines:
+                prog.data.unloaded += [ l ]
+                if published is not None:
+                    prog.data.add_deadline(published, domain)
+
+        prog.log.info2("  + reading lines of {} of {} domains".format(
+                                    len(work & domains.keys()), len(domains)))
+
+    for line_pos, l in lines:
+        line = parse_line(prog, compiled, l, line_pos)
+        if line is False:
+            retval = Prog.RetVal.exit_failure
+        elif line:
+            prog.data.add_line(prog, line)
+
     return retval
 
+def line_work(l, due):
+    """Return the domain of a datafile line, and if it has work to do.
+
+    The line is only split into fields (and is not matched against its
+    pattern). A line has work to do if it is a delete line, a prehook line
+    that is not pending (i.e., there are no posthook lines), a posthook
+    line that is pending, or a posthook line whose time-to-live value has
+    passed. A line that cannot be classified has work to do too, so that
+    it is read (and any error reported).
+
+    Args:
+        l (str): the line.
+        due (int): the unix time a posthook line (not pending) must have
+            been published at or before for its time-to-live value to have
+            passed.
+
+    Returns:
+        (str, bool, int): the domain of the line (or else 'None' if an
+            empty or comment line), 'True' if the line has work to do, and
+            the publish time of a posthook line that is not pending (or
+            else 'None').
+    """
+    type = line_type(l)
+    if type == None:
+        return (None, False, None)
+
+    fields = l.split()
+    if type == Prog.DataLineType.pre:
+        return (fields[0], fields[-1] != '1', None)
+    if type == Prog.DataLineType.post:
+        try:
+            if fields[6] != '0':
+                return (fields[0], True, None)
+            published = int(fields[5])
+            return (fields[0], published <= due, published)
+        except (IndexError, ValueError):
+            pass
+    return (fields[0], True, None)
+
+def parse_line(prog, compiled, l, line_pos):
+    """Parse a datafile line.
+
+    Args:
+        prog (State): not changed (except for logging).
+        compiled (dict(DataLineType, re.Pattern)): the line patterns (see
+            'line_patterns').
+        l (str): the line.
+        line_pos (int): the line number of the line.
+
+    Returns:
+        DataLine: the data line, or else 'None' if an empty (or comment)
+            line, or 'False' if the line is malformed.
+    """
+    type = line_type(l)
+    if type == None:
+        return None
+
+    match = compiled[type].match(l) if type else None
+    if not match:
+        prog.log.error("line {}: malformed line".format(line_pos))
+        return False
+
+    return make_line(prog, type, match, line_pos)
+
+def parse_lines(prog, lines):
+    """Parse datafile lines.
+
+    Args:
+        prog (State): not changed (except for logging).
+        lines (list(str)): the lines.
+
+    Returns:
+        list(DataLine): the data lines, or else 'None' if any line is
+            malformed.
+    """
+    compiled = line_patterns(prog)
+    data = []
+
+    for line_pos, l in enumerate(lines, 1):
+        line = parse_line(prog, compiled, l, line_pos)
+        if line is False:
+            data = None
+        elif line and data is not None:
+            data += [ line ]
+
+    return data
+
+def make_line(prog, type, match, line_pos):
+    """Make a data line from a matched datafile line.
+
+    Args:
+        prog (State): not changed.
+        type (DataLineType): the type of the line.
+        match (re.Match): the match of the pattern of the type.
+        line_pos (int): the line number of the line.
+
+    Returns:
+        DataLine: the data line.
+    """
+    if type == Prog.DataLineType.pre:
+        prog.log.info3("  + line {}: prehook line (pending: {})".format(
+                                            line_pos, match.group('pending')))
+        return Prog.DataPre( match.group('domain'),
+                             line_pos,
+                             match.group('dane'),
+                             match.group('live'),
+                             match.group('archive'),
+                             match.group('pending') )
+
+    tlsa = Prog.Tlsa( match.group('tlsa_spec'),
+                      match.group('tlsa_port'),
+                      match.group('tlsa_protocol'),
+                      match.group('tlsa_domain') )
+
+    if type == Prog.DataLineType.post:
+        prog.log.info3("  + line {}: posthook line (pending: {})".format(
+                                            line_pos, match.group('pending')))
+        return Prog.DataPost( match.group('domain'),
+                              line_pos,
+                              tlsa,
+                              match.group('pending'),
+                              match.group('time'),
+                              match.group('hash') )
+
+    prog.log.info3("  + line {}: delete line (count: {})".format(
+                                            line_pos, match.group('count')))
+    return Prog.DataDelete( match.group('domain'),
+                            line_pos,
+                            tlsa,
+                            match.group('count'),
+                            match.group('time'),
+                            match.group('hash') )
+
 def check_data(prog):
     """Validate the data (from the datafile) in the internal program state.
 
@@ -240,15 +521,15 @@ def write_prehook(prog):
         return Prog.RetVal.exit_failure
 
 
-    data = ""
+    lines = []
 
     for t in prog.target_list:
         for c in t.certs:
             prog.log.info3("  + {}\n{}".format(t.domain, c))
-            data += '{} "{}" "{}" "{}" 0\n'.format(
-                                        t.domain, c.dane, c.live, c.archive)
+            lines += [ Prog.DataPre(t.domain, 0, c.dane_path, c.live_path,
+                                    c.archive_path, '0') ]
 
-    if not data:
+    if not lines:
         prog.log.info1("  + no dane symlinks changed: nothing to write")
         return Prog.RetVal.ok
 
@@ -256,24 +537,35 @@ def write_prehook(prog):
                                         prog.name, prog.version, prog.timenow)
 
 
-    try:
-        with open(str(prog.datafile), "a") as file:
-            file.write(header)
-    except OSError as ex:
-        prog.log.error("writing datafile '{}' failed: {}".format(
-                                            ex.filename, ex.strerror.lower()))
-        return Prog.RetVal.exit_failure
+    # prehook lines are added to any lines already in the datafile
+    return write_lines(prog, header, lines, append=True)
 
-    if fix_permissions(prog):
-        return Prog.RetVal.exit_failure
+def next_due(prog):
+    """Print the time when there will next be work to do.
 
-    try:
-        with open(str(prog.datafile), "a") as file:
-            file.write(data)
-    except OSError as ex:
-        prog.log.error("writing datafile '{}' failed: {}".format(
-                                            ex.filename, ex.strerror.lower()))
-        return Prog.RetVal.exit_failure
+    The datafile is read, and the unix time when a run will next have work
+    to do is printed (see 'Data.next_due'), or else 'none' if there is
+    nothing left to do (including if there is no datafile).
+
+    Args:
+        prog (State): data is set based on the contents of the datafile.
+
+    Returns:
+        RetVal: returns 'RetVal.ok' if no errors encountered,
+            'RetVal.exit_failure' if reading the datafile failed.
+    """
+    retval = read(prog)
+    if retval == Prog.RetVal.exit_ok:
+        due = None
+    elif retval != Prog.RetVal.ok:
+        return retval
+    else:
+        due = prog.data.next_due(prog)
+
+    prog.log.info1("+++ next due: {}".format(due))
+    if not (prog.log.type == logging.LogType.stdout
+                and prog.log.level == logging.LogLevel.debug):
+        print("none" if due is None else due)
 
     return Prog.RetVal.ok
 
@@ -295,60 +587,217 @@ def write_posthook(prog):
             'RetVal.ok' for success.
     """
     prog.log.info1("+++ writing to datafile '{}'".format(prog.datafile))
-    data = ""
+    lines = []
 
     for group in prog.data.groups:
         for l in group.pre:
             prog.log.info3(" ++ writing prehook datafile lines...")
             prog.log.info3("{}".format(l))
             if l.state == Prog.DataLineState.write:
-                data += '{} "{}" "{}" "{}" {}\n'.format(
-                        l.domain, l.cert.dane, l.cert.live, l.cert.archive,
-                        l.pending)
+                lines += [ l ]
         for l in group.post:
             prog.log.info3(" ++ writing posthook datafile lines...")
             prog.log.info3("{}".format(l))
             if l.state == Prog.DataLineState.write:
-                data += "{} {}{}{} {} {} {} {} {} {}\n".format(
-                        l.domain, l.tlsa.usage, l.tlsa.selector,
-                        l.tlsa.matching, l.tlsa.port, l.tlsa.protocol,
-                        l.tlsa.domain, l.time, l.pending, l.hash)
+                lines += [ l ]
         for l in group.special:
             prog.log.info3(" ++ writing delete datafile lines...")
             prog.log.info3("{}".format(l))
             if l.state == Prog.DataLineState.write:
-                data += "{} delete {}{}{} {} {} {} {} {} {}\n".format(
-                        l.domain, l.tlsa.usage, l.tlsa.selector,
-                        l.tlsa.matching, l.tlsa.port, l.tlsa.protocol,
-                        l.tlsa.domain, l.time, l.count, l.hash)
+                lines += [ l ]
 
-    if not data:
+    # a store only some of whose lines were read is kept, even if empty
+    if (not lines and not prog.data.unloaded
+            and not (prog.store and prog.store.domains is not None)):
         prog.log.info1("  + no data to write")
         return remove(prog)
 
     header = "# {0} {1}\n# posthook mode {2}, {2:%s}\n".format(
                                         prog.name, prog.version, prog.timenow)
 
-    try:
-        with open(str(prog.datafile), "w") as file:
-            file.write(header)
-    except OSError as ex:
-        prog.log.error("writing datafile '{}' failed: {}".format(
+    return write_lines(prog, header, lines, prog.data.unloaded)
+
+def line_text(l):
+    """Return the datafile line of a data line.
+
+    Args:
+        l (DataLine): the data line.
+
+    Returns:
+        str: the datafile line (with no newline).
+    """
+    if l.type == Prog.DataLineType.pre:
+        return '{} "{}" "{}" "{}" {}'.format(
+                        l.domain, l.cert.dane, l.cert.live, l.cert.archive,
+                        l.pending)
+    if l.type == Prog.DataLineType.post:
+        return "{} {}{}{} {} {} {} {} {} {}".format(
+                        l.domain, l.tlsa.usage, l.tlsa.selector,
+                        l.tlsa.matching, l.tlsa.port, l.tlsa.protocol,
+                        l.tlsa.domain, l.time, l.pending, l.hash)
+    return "{} delete {}{}{} {} {} {} {} {} {}".format(
+                        l.domain, l.tlsa.usage, l.tlsa.selector,
+                        l.tlsa.matching, l.tlsa.port, l.tlsa.protocol,
+                        l.tlsa.domain, l.time, l.count, l.hash)
+
+def write_lines(prog, header, lines, unloaded=[], append=False):
+    """Write lines to the datafile, in the 'datafile_format'.
+
+    A text datafile is rewritten (see 'write_atomic'). A journal datafile
+    only has the lines that changed appended to it, unless it needs to be
+    compacted, or was not a journal before, when it is rewritten as a
+    snapshot of its lines. A SQLite store is written by 'write_store'.
+
+    Args:
+        prog (State): not modified (except for logging, 'journal' and
+            'store').
+        header (str): the header (comment lines) of a text datafile.
+        lines (list(DataLine)): the lines to write.
+        unloaded (list(str)): lines (that were not read) to write as they
+            are.
+        append (bool): if 'True', the lines are added to the lines already
+            in the datafile (if any), else they replace them.
+
+    Returns:
+        RetVal: returns 'RetVal.exit_failure' if any errors encountered,
+            'RetVal.ok' for success.
+    """
+    if prog.datafile_format == 'sqlite':
+        if unloaded:
+            # a store is written from data lines
+            unloaded = parse_lines(prog, unloaded)
+            if unloaded is None:
+                return Prog.RetVal.exit_failure
+            lines = lines + unloaded
+        return write_store(prog, lines, append)
+
+    lines = [ line_text(l) for l in lines ] + unloaded
+    format = None
+    current = prog.journal
+    old = []
+    if append:
+        try:
+            format, current, old = read_current(prog)
+        except OSError as ex:
+            prog.log.error("reading datafile '{}' failed: {}".format(
                                             ex.filename, ex.strerror.lower()))
-        return Prog.RetVal.exit_failure
+            return Prog.RetVal.exit_failure
+        except store.Error as ex:
+            prog.log.error("reading datafile '{}' failed: {}".format(
+                                                        prog.datafile, ex))
+            return Prog.RetVal.exit_failure
 
-    if fix_permissions(prog):
-        return Prog.RetVal.exit_failure
+    if prog.datafile_format == 'text':
+        data = header + "".join([ l + "\n" for l in lines ])
+        if format in [ 'journal', 'sqlite' ]:
+            # the datafile is converted to text
+            return write_atomic(prog,
+                        "".join([ l + "\n" for l in old ]) + data)
+        return write_atomic(prog, data, append=append)
+
+    lines = old + lines
+    records = current.changes(lines) if current else None
+
+    if records == []:
+        prog.log.info1("  + no journal records to write")
+        return Prog.RetVal.ok
+
+    if records and not current.needs_compaction(len(records)):
+        prog.log.info2("  + appending {} journal records".format(len(records)))
+        try:
+            journal.append(prog.datafile, current, records)
+        except OSError as ex:
+            prog.log.error("writing datafile '{}' failed: {}".format(
+                                    prog.datafile, ex.strerror.lower()))
+            return Prog.RetVal.exit_failure
+        return Prog.RetVal.ok
+
+    prog.log.info2("  + writing journal snapshot of {} lines".format(
+                                                                len(lines)))
+    prog.journal = None
+    return write_atomic(prog, journal.snapshot(lines))
+
+def write_store(prog, lines, append=False):
+    """Write lines to a SQLite store datafile.
+
+    The lines are added to the store if 'append', or else replace the
+    lines read from the store (only the lines of the domains read: see
+    'read_store'), in one transaction. A datafile that is not a store is
+    converted: a new store is written with its lines (see
+    'replace_atomic').
 
+    Args:
+        prog (State): not modified (except for logging and 'store').
+        lines (list(DataLine)): the lines to write.
+        append (bool): if 'True', the lines are added to the lines already
+            in the datafile (if any), else they replace them.
+
+    Returns:
+        RetVal: returns 'RetVal.exit_failure' if any errors encountered,
+            'RetVal.ok' for success.
+    """
     try:
-        with open(str(prog.datafile), "a") as file:
-            file.write(data)
+        if store.is_store(prog.datafile) and (append or prog.store):
+            with store.open_store(prog.datafile) as conn:
+                if append:
+                    with conn:
+                        store.insert(conn, lines)
+                else:
+                    store.replace(conn, lines, prog.store.domains)
+            prog.log.info2("  + {} lines written to the store".format(
+                                                                len(lines)))
+            return Prog.RetVal.ok
+
+        if append:
+            format, current, old = read_current(prog)
+            old = parse_lines(prog, old)
+            if old is None:
+                return Prog.RetVal.exit_failure
+            lines = old + lines
     except OSError as ex:
         prog.log.error("writing datafile '{}' failed: {}".format(
-                                            ex.filename, ex.strerror.lower()))
+                                    prog.datafile, ex.strerror.lower()))
+        return Prog.RetVal.exit_failure
+    except store.Error as ex:
+        prog.log.error("writing datafile '{}' failed: {}".format(
+                                                        prog.datafile, ex))
         return Prog.RetVal.exit_failure
 
-    return Prog.RetVal.ok
+    prog.log.info2("  + writing new store of {} lines".format(len(lines)))
+    prog.store = None
+    return replace_atomic(prog, lambda file, name: store.create(name, lines))
+
+def read_current(prog):
+    """Read the lines currently in the datafile.
+
+    Args:
+        prog (State): not modified.
+
+    Returns:
+        (str, Journal, list(str)): the format of the datafile ('text',
+            'journal' or 'sqlite', or else 'None' if there is no
+            datafile), the contents of the datafile if a journal (else
+            'None'), and the lines in the datafile (without empty and
+            comment lines).
+
+    Raises:
+        OSError: if the datafile cannot be read.
+        store.Error: if the datafile is a store and cannot be read.
+    """
+    if journal.is_journal(prog.datafile):
+        current = journal.load(prog.datafile)
+        return ('journal', current, list(current.lines))
+
+    if store.is_store(prog.datafile):
+        with store.open_store(prog.datafile) as conn:
+            lines = store.load(conn)
+        return ('sqlite', None, [ line_text(l) for l in lines ])
+
+    try:
+        with open(str(prog.datafile), "r") as file:
+            return ('text', None, journal.text_lines(file.read()))
+    except FileNotFoundError:
+        return (None, None, [])
 
 def remove(prog):
     """Remove the datafile, if it exists.
@@ -385,16 +834,125 @@ def remove(prog):
                                             ex.filename, ex.strerror.lower()))
         return Prog.RetVal.exit_failure
 
+    store.remove_wal(prog.datafile)
     prog.log.info1("  + datafile removed")
     return Prog.RetVal.ok
 
-def fix_permissions(prog):
-    """Ensure the datafile has the correct permissions.
+def write_atomic(prog, data, append=False):
+    """Replace the datafile, atomically, with a file containing the data.
+
+    See 'replace_atomic'.
+
+    Args:
+        prog (State): not modified (except for logging).
+        data (str/bytes): the data to write.
+        append (bool): if 'True', the data is written after the current
+            contents of the datafile (if any), else it replaces them.
+
+    Returns:
+        RetVal: returns 'RetVal.exit_failure' if any errors encountered,
+            'RetVal.ok' for success.
+    """
+    if isinstance(data, str):
+        data = data.encode()
+
+    if append:
+        try:
+            with open(str(prog.datafile), "rb") as file:
+                data = file.read() + data
+        except FileNotFoundError:
+            pass
+        except OSError as ex:
+            prog.log.error("reading datafile '{}' failed: {}".format(
+                                            ex.filename, ex.strerror.lower()))
+            return Prog.RetVal.exit_failure
+
+    return replace_atomic(prog, lambda file, name: file.write(data))
+
+def replace_atomic(prog, write):
+    """Replace the datafile, atomically, with a new file.
+
+    The new file is written to a temporary file in the datafile's
+    directory, which is given the correct permissions (mode 0600 and owned
+    by root:root) before anything is written to it, is synced to disk and
+    is then renamed to the datafile. The directory is then synced, so that
+    the rename is durable. The datafile is thus either left as it was, or
+    else replaced with the complete new file: it is never left truncated.
+
+    Args:
+        prog (State): not modified (except for logging).
+        write (function): called as 'write(file, name)' to write the new
+            file, given the (binary) file object of the temporary file and
+            its name.
+
+    Returns:
+        RetVal: returns 'RetVal.exit_failure' if any errors encountered,
+            'RetVal.ok' for success.
+    """
+    directory = str(prog.datafile.parent)
+    try:
+        fd, temp = tempfile.mkstemp(
+                        prefix=".{}.".format(prog.datafile.name), dir=directory)
+    except OSError as ex:
+        prog.log.error("writing datafile '{}' failed: {}".format(
+                                    prog.datafile, ex.strerror.lower()))
+        return Prog.RetVal.exit_failure
+
+    prog.log.info3(" ++ writing datafile via temporary file '{}'".format(temp))
+
+    failed = True
+    try:
+        with open(fd, "wb") as file:
+            if not fix_permissions(prog, file.fileno(), temp):
+                write(file, temp)
+                file.flush()
+                os.fsync(file.fileno())
+                failed = False
+        if not failed:
+            os.replace(temp, str(prog.datafile))
+    except OSError as ex:
+        prog.log.error("writing datafile '{}' failed: {}".format(
+                                    prog.datafile, ex.strerror.lower()))
+        failed = True
+    except store.Error as ex:
+        prog.log.error("writing datafile '{}' failed: {}".format(
+                                                        prog.datafile, ex))
+        failed = True
+
+    if failed:
+        try:
+            os.unlink(temp)
+        except OSError:
+            pass
+        store.remove_wal(temp)
+        return Prog.RetVal.exit_failure
+
+    # any WAL files left are of the datafile just replaced
+    store.remove_wal(prog.datafile)
+
+    # the rename is only durable once the directory is synced. Not all
+    # systems can sync a directory: the datafile is written either way.
+    try:
+        dirfd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dirfd)
+        finally:
+            os.close(dirfd)
+    except OSError as ex:
+        prog.log.info3(" ++ syncing datafile directory '{}' failed: {}".format(
+                                            directory, ex.strerror.lower()))
+
+    return Prog.RetVal.ok
+
+def fix_permissions(prog, fd, name):
+    """Ensure the (temporary) datafile has the correct permissions.
 
     'Correct' means mode 0600 and owned by root:root.
 
     Args:
         prog (State): not modified (except for logging).
+        fd (int): the open file descriptor of the file.
+        name (str): the name of the file (for logging).
 
     Returns:
         RetVal: returns 'True' if any errors encountered, 'False' for
@@ -402,23 +960,22 @@ def fix_permissions(prog):
     """
     prog.log.info3(" ++ checking/fixing mode of datafile: should be '0600'")
     try:
-        prog.datafile.chmod(0o600)
+        os.fchmod(fd, 0o600)
     except OSError as ex:
         prog.log.error(
             "changing permissions of datafile '{}' failed: {}".format(
-                                            ex.filename, ex.strerror.lower()))
+                                                name, ex.strerror.lower()))
         return True
 
     prog.log.info3(
             " ++ checking/fixing owner of datafile: should be 'root:root'")
     try:
         if not prog.testing_mode:
-            os.chown(str(prog.datafile), 0, 0)
+            os.fchown(fd, 0, 0)
     except OSError as ex:
         prog.log.error(
                 "changing owner of datafile '{}' failed: {}".format(
-                                            ex.filename, ex.strerror.lower()))
+                                                name, ex.strerror.lower()))
         return True
 
     return False
-
@@ -47,6 +47,10 @@ class DNSProcessingError(DNSError):
     """Raised when processing has encountered an error."""
     pass
 
+class DNSZoneError(DNSProcessingError):
+    """Raised when the DNS provider does not recognize the zone."""
+    pass
+
 class DNSNoReturnError(DNSError):
     """Error that should not cause the program to exit non-zero."""
     pass
@@ -0,0 +1,278 @@
+
+import os
+import sys
+import zlib
+import struct
+
+
+# A journal datafile is an append-only alternative to the text datafile
+# (see 'datafile.py'): it records the same datafile lines, but as a sequence
+# of changes, so that a run need only append the lines that changed instead
+# of rewriting the whole file.
+#
+# The file starts with the 'magic' bytes, followed by records:
+#
+#       length  crc  payload
+#
+#       length: the number of bytes in the payload (4 bytes, big-endian)
+#       crc: the CRC-32 of the payload (4 bytes, big-endian)
+#       payload: an operation character followed by its data (UTF-8
+#                encoded):
+#                   '+' - the datafile line is added
+#                   '-' - the datafile line is removed
+#                   '*' - a batch: the data is a sequence of changes,
+#                         separated by newlines, each a '+' or '-'
+#                         followed by a datafile line
+#
+# Replaying the records in order gives the current datafile lines. A
+# record cut short (by a crash while it was being appended) or corrupted
+# ends the journal: it, and anything after it, is discarded, and is
+# overwritten by the next append. All the changes of a run are appended
+# as one batch record, so that they are either all kept or all discarded.
+#
+# A journal is compacted, when its records greatly outnumber its lines, by
+# atomically replacing it with a 'snapshot': a journal with one '+' record
+# for every current line.
+
+magic = b"#alnitak-journal 1\n"
+header = struct.Struct(">II")
+
+add = '+'
+remove = '-'
+batch = '*'
+
+
+class Journal:
+    """The current contents of a journal datafile.
+
+    Attributes:
+        lines (dict(str: None)): the current datafile lines, in the order
+            they were added (only the keys are used).
+        records (int): the number of (valid) changes in the journal: a
+            batch record counts as the number of changes in it.
+        size (int): the number of bytes of valid records (and the magic) in
+            the journal: any bytes after this are discarded.
+        dropped (int): the number of bytes discarded from the end of the
+            journal.
+        compact_factor (int): a journal is compacted when it would have
+            more records than 'compact_factor' times its lines, plus
+            'compact_minimum'.
+        compact_minimum (int): see 'compact_factor'.
+    """
+    compact_factor = 2
+    compact_minimum = 64
+
+    def __init__(self):
+        self.lines = {}
+        self.records = 0
+        self.size = len(magic)
+        self.dropped = 0
+
+    def apply(self, op, line):
+        """Apply a record to the lines."""
+        if op == add:
+            self.lines[line] = None
+        else:
+            self.lines.pop(line, None)
+
+    def changes(self, lines):
+        """Return the records that change the lines to the given lines.
+
+        Args:
+            lines (list(str)): the new datafile lines.
+
+        Returns:
+            list((str, str)): the records, as (operation, line).
+        """
+        new = dict.fromkeys(lines)
+        return ( [ (remove, l) for l in self.lines if l not in new ]
+                 + [ (add, l) for l in new if l not in self.lines ] )
+
+    def needs_compaction(self, records):
+        """Return 'True' if the journal should be compacted instead of
+        having the given number of records appended to it."""
+        return (self.records + records > self.compact_minimum
+                        + self.compact_factor * len(self.lines))
+
+
+def is_journal(path):
+    """Return 'True' if the file is a journal datafile.
+
+    Args:
+        path (pathlib.Path): the file.
+
+    Returns:
+        bool: 'False' if the file does not start with the journal magic
+            bytes, or if it cannot be read.
+    """
+    try:
+        with open(str(path), "rb") as file:
+            return file.read(len(magic)) == magic
+    except OSError:
+        return False
+
+def encode(records):
+    """Encode records.
+
+    Args:
+        records (list((str, str))): the records, as (operation, line).
+
+    Returns:
+        bytes: the encoded records.
+    """
+    data = []
+    for op, line in records:
+        payload = (op + line).encode()
+        data += [ header.pack(len(payload), zlib.crc32(payload)), payload ]
+    return b"".join(data)
+
+def snapshot(lines):
+    """Return the contents of a (compacted) journal of the given lines.
+
+    Args:
+        lines (list(str)): the datafile lines.
+
+    Returns:
+        bytes: the journal file contents.
+    """
+    return magic + encode([ (add, l) for l in dict.fromkeys(lines) ])
+
+def load(path):
+    """Read a journal datafile.
+
+    Args:
+        path (pathlib.Path): the journal.
+
+    Returns:
+        Journal: the contents of the journal.
+
+    Raises:
+        OSError: if the file cannot be read.
+        ValueError: if the file is not a journal.
+    """
+    with open(str(path), "rb") as file:
+        data = file.read()
+
+    if not data.startswith(magic):
+        raise ValueError("not a journal")
+
+    journal = Journal()
+    pos = len(magic)
+    while pos + header.size <= len(data):
+        length, crc = header.unpack_from(data, pos)
+        payload = data[pos + header.size:pos + header.size + length]
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            break
+        try:
+            text = payload.decode()
+        except UnicodeDecodeError:
+            break
+        if text[:1] == batch:
+            changes = [ (c[:1], c[1:]) for c in text[1:].split('\n') ]
+        else:
+            changes = [ (text[:1], text[1:]) ]
+        if [ op for op, line in changes if op not in (add, remove) ]:
+            break
+
+        for op, line in changes:
+            journal.apply(op, line)
+        journal.records += len(changes)
+        pos += header.size + length
+
+    journal.size = pos
+    journal.dropped = len(data) - pos
+    return journal
+
+def append(path, journal, records):
+    """Append records to a journal datafile, and sync it to disk.
+
+    The records are appended as one batch record, so that if the append is
+    cut short, none of them are kept. Any bytes discarded when the journal
+    was read are overwritten.
+
+    Args:
+        path (pathlib.Path): the journal.
+        journal (Journal): the contents of the journal, as read: it is
+            updated with the records.
+        records (list((str, str))): the records, as (operation, line).
+
+    Raises:
+        OSError: if the journal cannot be written.
+    """
+    if not records:
+        return
+
+    with open(str(path), "r+b") as file:
+        file.truncate(journal.size)
+        file.seek(journal.size)
+        data = encode([ (batch, "\n".join([ op + line
+                                            for op, line in records ])) ])
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+
+    for op, line in records:
+        journal.apply(op, line)
+    journal.records += len(records)
+    journal.size += len(data)
+    journal.dropped = 0
+
+def text_lines(text):
+    """Return the datafile lines of a text datafile.
+
+    Args:
+        text (str): the contents of a text datafile.
+
+    Returns:
+        list(str): the lines, without empty and comment lines.
+    """
+    return [ l for l in text.splitlines()
+                        if l.strip() and not l.lstrip().startswith('#') ]
+
+def export_text(path, text_path):
+    """Convert a journal datafile to a text datafile.
+
+    Args:
+        path (pathlib.Path): the journal to read.
+        text_path (pathlib.Path): the text datafile to write (mode 0600).
+
+    Raises:
+        OSError: if a file cannot be read or written.
+        ValueError: if 'path' is not a journal.
+    """
+    journal = load(path)
+    fd = os.open(str(text_path), os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                 0o600)
+    with open(fd, "w") as file:
+        file.write("# exported journal datafile\n")
+        file.write("".join([ l + "\n" for l in journal.lines ]))
+
+def import_text(text_path, path):
+    """Convert a text datafile to a journal datafile.
+
+    Args:
+        text_path (pathlib.Path): the text datafile to read.
+        path (pathlib.Path): the journal to write (mode 0600).
+
+    Raises:
+        OSError: if a file cannot be read or written.
+    """
+    with open(str(text_path), "r") as file:
+        lines = text_lines(file.read())
+
+    fd = os.open(str(path), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(fd, "wb") as file:
+        file.write(snapshot(lines))
+
+
+if __name__ == "__main__":
+    # python -m alnitak.journal <export|import> <from file> <to file>
+    if len(sys.argv) != 4 or sys.argv[1] not in [ 'export', 'import' ]:
+        sys.exit("usage: python -m alnitak.journal <export|import> <from file> <to file>")
+    try:
+        if sys.argv[1] == 'export':
+            export_text(sys.argv[2], sys.argv[3])
+        else:
+            import_text(sys.argv[2], sys.argv[3])
+    except (OSError, ValueError) as ex:
+        sys.exit("error: {}".format(ex))
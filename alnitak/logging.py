@@ -370,3 +370,39 @@ class Log:
     def set_quiet(self):
         self.quiet = True
 
+
+class LogBuffer:
+    """Record log messages to be sent to a Log object at a later time.
+
+    This class has the same logging methods as the Log class, but the
+    messages are only recorded. They are sent to an actual Log object, in
+    the same order, by calling 'replay'. This is used to keep the log
+    output of concurrently running jobs from being interleaved.
+
+    Attributes:
+        messages (list((str, str))): the recorded messages, as a tuple of
+            the name of the Log method to call and the message itself.
+    """
+    def __init__(self):
+        self.messages = []
+
+    def info1(self, msg):
+        self.messages += [ ('info1', msg) ]
+
+    def info2(self, msg):
+        self.messages += [ ('info2', msg) ]
+
+    def info3(self, msg):
+        self.messages += [ ('info3', msg) ]
+
+    def error(self, msg):
+        self.messages += [ ('error', msg) ]
+
+    def warning(self, msg):
+        self.messages += [ ('warning', msg) ]
+
+    def replay(self, log):
+        """Send the recorded messages to 'log' and clear the buffer."""
+        for method, msg in self.messages:
+            getattr(log, method)(msg)
+        self.messages = []
@@ -78,6 +78,35 @@ def ttl_check(prog, pos, flag_name, input):
 
     return ttl
 
+def jobs_check(prog, pos, flag_name, input):
+    """Parse inputs to the '--jobs' flag.
+
+    Args:
+        prog (State): program state.
+        pos (int): flag command-line position.
+        flag_name (str): flag name.
+        input (str): input string from the command-line parser.
+
+    Returns:
+        int: returns the input converted to an integer, unmodified.
+
+    Raises:
+        Except.Error: if the input does not conform. Derived classes thrown
+            are: Except.Error1013, Except.Error1100 or Except.Error1101.
+    """
+    try:
+        jobs = int(input)
+    except ValueError:
+        raise Except.Error1013(pos, flag_name, input)
+
+    if jobs > prog.jobs_max:
+        raise Except.Error1100(pos, flag_name, input, prog.jobs_max)
+
+    if jobs < prog.jobs_min:
+        raise Except.Error1101(pos, flag_name, input, prog.jobs_min)
+
+    return jobs
+
 
 
 def version_message(prog):
@@ -114,6 +143,7 @@ Mode:'''
     reset           reset (or create) the dane directory.
     configtest      check the configuration file for errors.
     print           print TLSA certificate data.
+    next-due        print when there will next be work to do.
 '''
 
     opts_common='''
@@ -159,6 +189,12 @@ Options:
                         Let's Encrypt certificate must be made. Effectively,
                         this is the minimum time set for the TLSA DNS records
                         to propogate before the new certificate is used.
+'''
+    j_flag='''
+    -j, --jobs NUM      run up to 'NUM' jobs in parallel (certificate data
+                        generation in print mode, or the processing of
+                        domains otherwise). By default, only one job is run
+                        at a time.
 '''
     q_flag='''
     -q, --quiet         do not print errors to the screen. Note that they
@@ -169,7 +205,8 @@ Options:
 
     default='''
     In default mode:
-       alnitak [-l LOG] [-L LEVEL] [-C DIR] [-D DIR] [-c CONF] [-t TIME] [-q]
+       alnitak [-l LOG] [-L LEVEL] [-C DIR] [-D DIR] [-c CONF] [-t TIME]
+               [-j NUM] [-q]
 
             run in default mode, to process any dane certificates that need
             to be cleaned up after renewal has occurred. 
@@ -186,7 +223,7 @@ Options:
     deploym='''
     deploy
        alnitak deploy [-l LOG] [-L LEVEL] [-C DIR] [-D DIR] [-c CONF]
-                      [-t TIME] [-q]
+                      [-t TIME] [-j NUM] [-q]
 
             run in deploy-hook mode, to be run after Let's Encrypt certificate
             renewal, prefably on certbot's '--deploy-hook'.
@@ -209,12 +246,15 @@ Options:
 
     printm='''
     print
-       alnitak print [-l LOG] [-L LEVEL] [-C DIR] [-c CONF] [XZY:CERT...]
+       alnitak print [-l LOG] [-L LEVEL] [-C DIR] [-c CONF] [-j NUM]
+                     [XZY:CERT...]
 
             print TLSA certificate data for the targets in the configuration
             file if no inputs are given. If inputs 'XYZ:CERT' are given, then
             instead print certificate data for 'CERT' corresponding to TLSA
             usage field 'X', selector field 'Y' and matching type 'Z'.
+            With '--jobs', certificate data for the targets is generated
+            in parallel, but is still printed in the same order.
             'CERT' may either be:
                 - path/to/cert.pem
                     print certificate data for the file specified.
@@ -230,11 +270,23 @@ Options:
                 - archive/example.com/cert1.pem
                     print certificate data for the specific file in the
                     Let's Encrypt directory (/etc/letsencrypt/)
+'''
+    nextduem='''
+    next-due
+       alnitak next-due [-l LOG] [-L LEVEL] [-D DIR] [-c CONF] [-t TIME]
+                        [-q]
+
+            print the time (in seconds since the epoch) when running alnitak
+            will next have work to do: the time now if there is work to do
+            already, otherwise the earliest time that an old TLSA record can
+            be deleted (once the time set by '--ttl' has passed). If there
+            is nothing left to do, 'none' is printed instead. The program
+            can then be scheduled (e.g., by cron) to run at that time.
 '''
     if not mode.names:
-        return "{}{}{}{}{}{}{}{}{}{}{}\n{}".format(
+        return "{}{}{}{}{}{}{}{}{}{}{}{}\n{}".format(
                 head, modes, default, opts_common,
-                c_flag, C_flag, D_flag, l_flag, L_flag, t_flag, q_flag,
+                c_flag, C_flag, D_flag, l_flag, L_flag, t_flag, j_flag, q_flag,
                 version_message(prog))
     if 'pre' in mode.names:
         return "{}{}{}{}{}{}{}{}{}{}\n{}".format(
@@ -242,9 +294,9 @@ Options:
                 c_flag, C_flag, D_flag, l_flag, L_flag, t_flag, q_flag,
                 version_message(prog))
     if 'deploy' in mode.names:
-        return "{}{}{}{}{}{}{}{}{}{}\n{}".format(
+        return "{}{}{}{}{}{}{}{}{}{}{}\n{}".format(
                 head, deploym, opts_common,
-                c_flag, C_flag, D_flag, l_flag, L_flag, t_flag, q_flag,
+                c_flag, C_flag, D_flag, l_flag, L_flag, t_flag, j_flag, q_flag,
                 version_message(prog))
     if 'reset' in mode.names:
         return "{}{}{}{}{}{}{}{}{}{}{}\n{}".format(
@@ -257,14 +309,19 @@ Options:
                 c_flag, l_flag, L_flag, q_flag,
                 version_message(prog))
     if 'print' in mode.names:
-        return "{}{}{}{}{}{}{}\n{}".format(
+        return "{}{}{}{}{}{}{}{}\n{}".format(
                 head, printm, opts_common,
-                c_flag, C_flag, l_flag, L_flag,
+                c_flag, C_flag, j_flag, l_flag, L_flag,
+                version_message(prog))
+    if 'next-due' in mode.names:
+        return "{}{}{}{}{}{}{}{}{}\n{}".format(
+                head, nextduem, opts_common,
+                c_flag, D_flag, l_flag, L_flag, t_flag, q_flag,
                 version_message(prog))
 
-    return "{}{}{}{}{}{}{}{}{}{}{}\n{}".format(
+    return "{}{}{}{}{}{}{}{}{}{}{}{}\n{}".format(
             head, modes, default, opts_common,
-            c_flag, C_flag, D_flag, l_flag, L_flag, t_flag, q_flag,
+            c_flag, C_flag, D_flag, l_flag, L_flag, t_flag, j_flag, q_flag,
             version_message(prog))
 
 
@@ -806,6 +863,7 @@ def parse_args(prog):
     C_flag = Flag(FlagType.mandatory, '-C', '--letsencrypt-directory')
     D_flag = Flag(FlagType.mandatory, '-D', '--dane-directory')
     t_flag = Flag(FlagType.mandatory, '-t', '--ttl', match=ttl_check)
+    j_flag = Flag(FlagType.mandatory, '-j', '--jobs', match=jobs_check)
     q_flag = Flag(FlagType.bare, '-q', '--quiet')
 
 
@@ -818,7 +876,7 @@ def parse_args(prog):
     p.add_mandatory('-L', '--log-level', match=r'(no|normal|verbose|debug)$')
 
     defm = Mode()
-    defm.add_flag(C_flag, D_flag, t_flag, q_flag)
+    defm.add_flag(C_flag, D_flag, t_flag, j_flag, q_flag)
     p.add_mode(defm)
 
     prem = Mode('pre', 'prehook')
@@ -826,7 +884,7 @@ def parse_args(prog):
     p.add_mode(prem)
 
     deploym = Mode('deploy', 'deployhook', 'post', 'posthook')
-    deploym.add_flag(C_flag, D_flag, t_flag, q_flag)
+    deploym.add_flag(C_flag, D_flag, t_flag, j_flag, q_flag)
     p.add_mode(deploym)
 
     resetm = Mode('reset', 'init')
@@ -839,10 +897,14 @@ def parse_args(prog):
     p.add_mode(configm)
 
     printm = Mode('print')
-    printm.add_flag(C_flag)
+    printm.add_flag(C_flag, j_flag)
     printm.set_collect_if(print_check)
     p.add_mode(printm)
 
+    nextduem = Mode('next-due', 'nextdue')
+    nextduem.add_flag(D_flag, t_flag, q_flag)
+    p.add_mode(nextduem)
+
     if p.parse_args():
         for err in p.errors:
             print("{}: error: {}.".format(prog.name, err), file=sys.stderr)
@@ -861,6 +923,10 @@ def parse_args(prog):
     if ttl:
         prog.set_ttl(ttl, False)
 
+    jobs = p.has('j')
+    if jobs:
+        prog.set_jobs(jobs, False)
+
     # must set 'prog.log.quiet' before the other 'prog.log' details.
     if p.has('q'):
         prog.log.set_quiet()
@@ -910,6 +976,14 @@ def parse_args(prog):
         else:
             exec_list = [ config.read, printrecord.certificate_data ]
 
+    elif p.is_mode('next-due'):
+        # do not log anything below 'debug':
+        if prog.log.level in [logging.LogLevel.normal,
+                              logging.LogLevel.verbose]:
+            prog.log.set_no_logging()
+
+        exec_list = [ config.read, datafile.next_due ]
+
     elif p.is_mode('configtest'):
         exec_list = [ config.read ]
 
@@ -2,6 +2,7 @@
 import re
 import argparse
 import pathlib
+import concurrent.futures
 
 from alnitak import prog as Prog
 from alnitak import exceptions as Except
@@ -93,40 +94,115 @@ def certificate_data(prog):
     """
     retval = Prog.RetVal.ok
     prog.log.info3("+++ generating certificate data (hashes)...")
+
+    jobs = []
     for target in prog.target_list:
         uniq = []
         for t in target.tlsa:
             if t.params() in uniq:
                 continue
             uniq += [ t.params() ]
+        jobs += [ (target.domain, uniq) ]
 
+    for domain, results in get_results(prog, jobs):
+        for params, data, error in results:
             prog.log.info3(
-                    " ++ tlsa: {}{}{}, request: {}".format(t.usage, t.selector,
-                                                           t.matching,
-                                                           target.domain))
-            try:
-                data = get_data(prog, target.domain, t)
-                for d in data:
-                    prog.log.info3(
-                            "  + cert: {}\n  + data: {}".format(d[0], d[1]))
-
-                    # The only time we _don't_ print this, is if we are
-                    # printing the log info to stdout and the debug level
-                    # is 'debug':
-                    if not (prog.log.type == logging.LogType.stdout
-                                and prog.log.level == logging.LogLevel.debug):
-                        print("{} {} {} {} {} {}".format(
-                                get_domain(prog, d[0]),
-                                t.usage, t.selector, t.matching, d[1], d[0]))
-
-            except (Except.FunctionError, Except.InternalError,
-                    Except.DNSProcessingError) as ex:
-                prog.log.error("{}: {}".format(target.domain, ex.message))
+                    " ++ tlsa: {}, request: {}".format(params, domain))
+            if error:
+                prog.log.error("{}: {}".format(domain, error))
                 retval = Prog.RetVal.exit_failure
                 continue
 
+            for d in data:
+                prog.log.info3(
+                        "  + cert: {}\n  + data: {}".format(d[0], d[1]))
+
+                # The only time we _don't_ print this, is if we are
+                # printing the log info to stdout and the debug level
+                # is 'debug':
+                if not (prog.log.type == logging.LogType.stdout
+                            and prog.log.level == logging.LogLevel.debug):
+                    print("{} {} {} {} {} {}".format(
+                            get_domain(prog, d[0]),
+                            params[0], params[1], params[2], d[1], d[0]))
+
     return retval
 
+def get_results(prog, jobs):
+    """Generate the certificate data for every job, in order.
+
+    If more than one job is allowed ('--jobs'), then the targets are
+    farmed out to a pool of worker processes, with each worker handling
+    every TLSA specification of a target so that a certificate is only
+    parsed once. The results are always generated in the order of the
+    input list, regardless of which worker finished first, so the output
+    is deterministic. If a process pool cannot be created, the jobs are
+    run in this process instead.
+
+    Args:
+        prog (State): program state.
+        jobs (list((str, list(str)))): list of tuples of the target domain
+            and the (unique) TLSA parameters to create data for.
+
+    Returns:
+        generator((str, list((str, list, str)))): the target domain and the
+            output of 'get_target_data' for that target.
+    """
+    workers = min(prog.jobs, len(jobs))
+    if workers > 1:
+        try:
+            pool = concurrent.futures.ProcessPoolExecutor(workers)
+        except (OSError, NotImplementedError) as ex:
+            prog.log.info3(
+                    "  + process pool not available: {}".format(ex))
+        else:
+            with pool:
+                results = pool.map(get_target_data,
+                                   [ prog.letsencrypt_directory ]*len(jobs),
+                                   [ j[0] for j in jobs ],
+                                   [ j[1] for j in jobs ])
+                for j, r in zip(jobs, results):
+                    yield (j[0], r)
+            return
+
+    for j in jobs:
+        yield (j[0], get_target_data(prog.letsencrypt_directory, j[0], j[1],
+                                     prog))
+
+def get_target_data(letsencrypt_directory, domain, params, prog=None):
+    """Return certificate data for every TLSA specification of a target.
+
+    This function is the unit of work handed to the worker processes, so
+    its arguments and return value must be picklable. An error for one
+    TLSA specification is recorded and does not affect the others.
+
+    Args:
+        letsencrypt_directory (pathlib.Path): the Let's Encrypt directory.
+        domain (str): the target (a file, or else a domain directory).
+        params (list(str)): TLSA parameters (e.g. '311') to create the data
+            for.
+        prog (State): program state. If not given (e.g. in a worker
+            process), a new State object is made.
+
+    Returns:
+        list((str, list([str, str]), str)): a list of tuples, one for each
+            TLSA parameter, of the parameter, the output of 'get_data' (or
+            'None' on error) and an error message (or 'None' on success).
+    """
+    if not prog:
+        prog = Prog.State(lock=False)
+        prog.set_letsencrypt_directory(letsencrypt_directory)
+
+    ret = []
+    for p in params:
+        try:
+            ret += [ (p, get_data(prog, domain, Prog.Tlsa(p, None, None, None)),
+                      None) ]
+        except (Except.FunctionError, Except.InternalError,
+                Except.DNSProcessingError) as ex:
+            ret += [ (p, None, ex.message) ]
+    return ret
+
 def get_data(prog, domain, tlsa):
     """Return certificate data (hashes) for the TLSA specs given.
 
@@ -164,9 +240,7 @@ def get_data(prog, domain, tlsa):
     else:
         cert = [ name ]
 
-    return [ [ c, certop.get_hash(tlsa.selector, tlsa.matching,
-                                  certop.read_cert(c, tlsa.usage)) ]
-             for c in cert ]
+    return [ [ c, certop.get_tlsa_hash(prog, c, tlsa) ] for c in cert ]
 
 def try_as_file(inp):
     """Read the input and try to resolve it as an extant _file_.
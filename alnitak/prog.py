@@ -2,8 +2,12 @@
 import sys
 from enum import Enum
 import pathlib
+import heapq
+import bisect
 import datetime
 import fcntl
+import time
+import threading
 
 from alnitak import exceptions as Except
 from alnitak import logging
@@ -40,6 +44,8 @@ class State:
             protocol.
         ttl_min (int): minimum allowed value for the '--ttl' flag.
         ttl_max (int): maximum allowed value for the '--ttl' flag.
+        jobs_min (int): minimum allowed value for the '--jobs' flag.
+        jobs_max (int): maximum allowed value for the '--jobs' flag.
         timenow (datetime.datetime): UTC time right now.
         testing_mode (bool): normally 'False'. If set to 'True', then
             root-only processes are not run. This is just performing a
@@ -67,6 +73,15 @@ class State:
         ttl (int): the time-to-live value (in seconds). At least this
             number of seconds must pass since the publication of a new
             TLSA record before the old one is deleted.
+        jobs (int): the maximum number of jobs to run in parallel.
+        hook_deadline (int): the most number of seconds that may be spent
+            running the programs of 'exec' api schemes, from when the first
+            is run, or else 'None' for no limit.
+        datafile_format (str): the format the datafile is written in:
+            either 'text', 'journal' or 'sqlite'.
+        datafile_loading (str): either 'full', if every line of a text or
+            journal datafile is read, or 'lazy', if only the lines of the
+            domains with work to do are (see 'datafile.read_lines').
         log (Log): an instance of the 'Log' class, which controls logging.
         recreate_dane (bool): set to 'True' if the '--reset' flag is
             given.
@@ -83,6 +98,32 @@ class State:
             this will be set to an empty list.
         data (Data): the Data object that records the data lines read
             from (or need to be written to) a datafile.
+        cert_cache (dict): parsed certificates (certop.Certificate),
+            keyed by certificate file path, modification time, inode and
+            tlsa usage, so that every certificate is read and parsed only
+            once per run.
+        zone_cache (ZoneCache): Cloudflare zone IDs, read from (and
+            written to) the zone cache file.
+        sessions (dict((str, str): requests.Session)): HTTP sessions for
+            the Cloudflare API, keyed by account email and key, so that
+            every account uses one pool of connections.
+        sessions_lock (threading.Lock): lock that must be held to change
+            'sessions' or 'schedulers'.
+        schedulers (dict((str, str): cloudflare.RequestScheduler)): request
+            schedulers (rate limiting and retries) for the Cloudflare API,
+            keyed by account email and key, since the rate limits apply to
+            the account.
+        workers (dict(tuple: exec.Worker)): the running worker processes
+            of 'exec' api schemes using the 'worker' protocol, keyed by
+            the command and user they are run as.
+        workers_lock (threading.Lock): lock that must be held to change
+            'workers'.
+        hook_times (HookTimes): how long the programs of 'exec' api schemes
+            took to run, and the deadline for running them.
+        journal (journal.Journal): the contents of the datafile, if it was
+            read as a journal datafile, else 'None'.
+        store (store.Store): what was read from the datafile, if it was
+            read as a SQLite store, else 'None'.
     """
     def __init__(self, lock=True, testing=False):
         ## program constants
@@ -95,6 +136,8 @@ class State:
         self.tlsa_protocol_regex = r"\w+"
         self.ttl_min = 0
         self.ttl_max = 7*24*60*60
+        self.jobs_min = 1
+        self.jobs_max = 256
         self.timenow = datetime.datetime.utcnow()
         self.testing_mode = testing
         self.datafile = ( pathlib.Path("/var")
@@ -111,6 +154,10 @@ class State:
         self.letsencrypt_directory = pathlib.Path("/etc/letsencrypt")
         self.letsencrypt_live_directory = self.letsencrypt_directory / "live"
         self.ttl = 86400
+        self.jobs = 1
+        self.hook_deadline = None
+        self.datafile_format = 'text'
+        self.datafile_loading = 'full'
         self.log = logging.Log(self.name, self.version, self.timenow, testing,
                                "/var/log/{}.log".format(self.name))
         self.recreate_dane = False
@@ -143,6 +190,16 @@ class State:
             #                     'y.com': [ 'link1', 'link2' ] }
         self.renewed_domains = []
         self.data = Data()
+        self.cert_cache = { }
+        self.zone_cache = ZoneCache()
+        self.sessions = { }
+        self.sessions_lock = threading.Lock()
+        self.schedulers = { }
+        self.workers = { }
+        self.workers_lock = threading.Lock()
+        self.hook_times = HookTimes()
+        self.journal = None
+        self.store = None
 
     def lock(self):
         if not self.can_lock:
@@ -224,6 +281,14 @@ class State:
             self.setcl.ttl = True
         self.ttl = ttl
 
+    def set_jobs(self, jobs, config=True):
+        if config:
+            if self.setcl.jobs:
+                return
+        else:
+            self.setcl.jobs = True
+        self.jobs = jobs
+
     def set_log_level(self, level, config=True):
         if config:
             if self.setcl.level:
@@ -241,6 +306,132 @@ class State:
     def set_config_file(self, path):
         self.config = self.make_absolute(path)
 
+class HookTimes:
+    """Run times of the programs of 'exec' api schemes.
+
+    Used to give every program run a timeout: either fixed, or adapted to
+    the latest run times of the command (see 'timeout'). No timeout is
+    later than the deadline of the run, if there is one (see 'start').
+
+    Attributes:
+        deadline (float): the time (as given by 'time.monotonic') by which
+            all programs must have finished, or else 'None' for no deadline.
+        history (dict(tuple(str), list(float))): the latest run times (in
+            seconds) of every command, oldest first.
+        lock (threading.Lock): lock that must be held to use the
+            attributes.
+        keep (int): the number of run times to keep for every command.
+        samples (int): the number of run times needed before a timeout is
+            adapted to them.
+        factor (float): an adapted timeout is this many times the longest
+            of the latest run times...
+        minimum (float): ...but at least this many seconds.
+    """
+    keep = 20
+    samples = 5
+    factor = 4
+    minimum = 10
+
+    def __init__(self):
+        self.deadline = None
+        self.history = { }
+        self.lock = threading.Lock()
+
+    def start(self, seconds):
+        """Set the deadline, if not already set, to 'seconds' from now.
+
+        Args:
+            seconds (int): the number of seconds, or else 'None' for no
+                deadline.
+        """
+        with self.lock:
+            if self.deadline == None and seconds != None:
+                self.deadline = time.monotonic() + seconds
+
+    def remaining(self):
+        """Return the number of seconds left before the deadline.
+
+        Returns:
+            float: the seconds left (which may be negative), or else 'None'
+                if there is no deadline.
+        """
+        with self.lock:
+            if self.deadline == None:
+                return None
+            return self.deadline - time.monotonic()
+
+    def record(self, command, seconds):
+        """Record the run time of a command.
+
+        Args:
+            command (list(str)): the command run.
+            seconds (float): the number of seconds it ran for.
+        """
+        with self.lock:
+            times = self.history.setdefault(tuple(command), [])
+            times.append(seconds)
+            del times[:-self.keep]
+
+    def timeout(self, command, cap, adaptive):
+        """Return the timeout for a run of a command.
+
+        Args:
+            command (list(str)): the command to run.
+            cap (int): the timeout (in seconds) if not adapted, and the
+                most the timeout may be if adapted.
+            adaptive (bool): whether to adapt the timeout to the latest
+                run times of the command.
+
+        Returns:
+            float: the timeout (in seconds), not counting the deadline.
+        """
+        if not adaptive:
+            return cap
+
+        with self.lock:
+            times = self.history.get(tuple(command), [])
+            if len(times) < self.samples:
+                return cap
+            return min(cap, max(self.minimum, self.factor * max(times)))
+
+class ZoneCache:
+    """Cache of Cloudflare zone IDs that persists across runs.
+
+    The cache is kept in a file next to the datafile and is only read
+    when first needed.
+
+    Attributes:
+        entries (dict((str, str): (str, int))): the zone ID and the time it
+            was looked up, keyed by the account email and the zone name.
+        loaded (bool): whether the cache file has been read yet.
+        lock (threading.Lock): lock that must be held to access the cache,
+            since data groups may be processed concurrently.
+    """
+    def __init__(self):
+        self.entries = { }
+        self.loaded = False
+        self.lock = threading.Lock()
+
+class GroupState:
+    """Program state for the processing of a single DataGroup.
+
+    When DataGroups are processed concurrently, each group is handed one of
+    these objects instead of the State object. Every attribute is read from
+    the State object, except for 'log', which is a LogBuffer. This way the
+    log output of each group is kept together and can be sent to the real
+    log, in the order of the groups, once processing is done.
+
+    Attributes:
+        prog (State): the program state.
+        log (LogBuffer): the log messages of the group.
+    """
+    def __init__(self, prog):
+        self.prog = prog
+        self.log = logging.LogBuffer()
+
+    def __getattr__(self, name):
+        return getattr(self.prog, name)
+
 class SetCL:
     """Parameters set at the command-line, overriding config equivalents.
 
@@ -248,12 +439,14 @@ class SetCL:
         dane_directory (bool): True if '-D' set on the command-line.
         letsencrypt_directory (bool): True if '-C' set on the command-line.
         ttl (bool): True if '-t' set on the command-line.
+        jobs (bool): True if '-j' set on the command-line.
         level (bool): True if '-L' set on the command-line.
     """
     def __init__(self):
         self.dane_directory = False
         self.letsencrypt_directory = False
         self.ttl = False
+        self.jobs = False
         self.level = False
 
 class RetVal(Enum):
@@ -295,6 +488,33 @@ class ApiCloudflare(Api):
         zone (str): the Cloudflare zone.
         email (str): the email of the user to login as.
         key (str): the key of the user to login with.
+        session (requests.Session): the HTTP session used by the fallback
+            (non-native) calls, created on first use so that connections
+            are kept alive and reused for every call in a run. The session
+            is shared by every api object of the same account.
+        url (str): the base url of the Cloudflare API for fallback calls.
+        client (str): the HTTP client of the fallback calls: either
+            'requests' or 'async' (see 'asynchttp.Client'). With the
+            'async' client, only fallback calls are made.
+        timeout ((float, float)): the connect and read timeouts, in
+            seconds, of the fallback calls.
+        zone_ttl (int): the number of seconds a zone ID may be kept in the
+            zone cache. A value of 0 disables the cache.
+        zone_cached (bool): whether 'zone' was read from the zone cache.
+        retry (int): the number of seconds per run that may be spent
+            waiting to retry throttled or failed calls. A value of 0
+            disables retries.
+        scheduler (cloudflare.RequestScheduler): the request scheduler of
+            the account, set on first use.
+        batch (int): if not zero, publishes and deletes are queued and then
+            made in batches of (at most) this many changes by
+            'cloudflare.api_finish'.
+        queue (list(ApiOp)): the queued publishes and deletes.
+        records (dict): index of the TLSA records of the zone, listed once
+            per run (see 'cloudflare.load_records'); 'None' if not listed.
+        lock (threading.RLock): lock held whilst getting the zone ID or
+            using the records index, since the api object may be shared by
+            targets processed concurrently.
     """
 
     def __init__(self, email=None, key=None):
@@ -303,13 +523,32 @@ class ApiCloudflare(Api):
         self.zone = None
         self.email = email
         self.key = key
+        self.session = None
+        self.url = "https://api.cloudflare.com/client/v4"
+        self.client = "requests"
+        self.timeout = (10, 60)
+        self.zone_ttl = 7*24*60*60
+        self.zone_cached = False
+        self.retry = 300
+        self.scheduler = None
+        self.batch = 0
+        self.queue = []
+        self.records = None
+        self.lock = threading.RLock()
 
     def copy(self):
         # this will be use in config.read to do a 'shallow' copy: we don't
         # want any global api instance to be bound to any targets since then
         # changes to the domain of that api object for every target will
         # affect every other target's api object.
-        return ApiCloudflare(self.email, self.key)
+        api = ApiCloudflare(self.email, self.key)
+        api.url = self.url
+        api.client = self.client
+        api.timeout = self.timeout
+        api.zone_ttl = self.zone_ttl
+        api.batch = self.batch
+        api.retry = self.retry
+        return api
 
     def __str__(self):
         return "    - {}\n       domain: {}\n       email: ...({})\n       key: ...({})".format(self.type, self.domain, len(self.email), len(self.key))
@@ -318,10 +557,49 @@ class ApiCloudflare(Api):
         return (self.type == a.type and self.domain == a.domain
                 and self.zone == a.zone
                 and self.email == a.email
-                and self.key == a.key)
+                and self.key == a.key
+                and self.url == a.url
+                and self.client == a.client
+                and self.timeout == a.timeout
+                and self.zone_ttl == a.zone_ttl
+                and self.retry == a.retry
+                and self.batch == a.batch)
 
     def __hash__(self):
-        return super().__hash__()
+        # 'zone' is left out: it is only set once the api object is used
+        return hash((self.type, self.domain, self.email, self.key, self.url,
+                     self.client, self.timeout, self.zone_ttl, self.retry,
+                     self.batch))
+
+class ApiOp:
+    """A publish or delete queued by an api scheme, to be made later.
+
+    The caller of the api function that queued the operation is told of
+    its failure (once made) by the functions in 'on_error'.
+
+    Attributes:
+        method (str): either 'post' (publish) or 'delete'.
+        tlsa (Tlsa): details of the DANE TLSA record.
+        hash (str): the 'certificate data' of the record.
+        id (str): the ID of the record to delete, or of the published
+            record (if known).
+        live_hash (str): the 'certificate data' of a record that must be up
+            before the record can be deleted, if any.
+        error (DNSExcept): the exception raised for the operation if it
+            failed, otherwise 'None'.
+        on_error (list(function)): functions to call as 'f(prog, error)' if
+            the operation failed. They should return 'True' for errors,
+            'False' otherwise.
+    """
+
+    def __init__(self, method, tlsa, hash, id=None, live_hash=None):
+        self.method = method
+        self.tlsa = tlsa
+        self.hash = hash
+        self.id = id
+        self.live_hash = live_hash
+        self.error = None
+        self.on_error = []
 
 class ApiExec(Api):
     """The 'exec' API scheme
@@ -332,6 +610,30 @@ class ApiExec(Api):
             as the same user as the calling user (usually 'root').
         gid (int): NOT USED. Envisioned as the GID to run the process
             under. This is instead set from the passwd info of the UID.
+        jobs (int): the number of programs that may be run at once. If
+            more than one, publishes and deletes are queued and then made
+            by 'exec.api_finish'.
+        protocol (str): either 'env' (the default: the program is run for
+            every record, given by environment parameters, and its exit
+            code is the result) or 'batch' (the program is run once for all
+            the queued records, given as JSON lines on its stdin, and the
+            results are read from its stdout) or 'worker' (the program is
+            started once and kept running for the whole run, and every
+            record is sent to it as a JSON line, as it is processed: see
+            'exec.Worker').
+        timeout (int): the number of seconds the program may run for (for
+            every record, or for all of them with the 'batch' protocol).
+        adaptive (bool): if 'True', the timeout is adapted to how long the
+            program took to run recently, with 'timeout' the most it may
+            be (see 'HookTimes.timeout').
+        output_limit (int): the most bytes of output of the program to log
+            (for every record, or for all of them with the 'batch'
+            protocol).
+        queue (list((ApiExec, ApiOp))): the queued publishes and deletes,
+            and the api object each was queued with. The queue is shared
+            by the copies of the api object, so that the programs run for
+            every domain of the same 'api' line count towards 'jobs'.
+        lock (threading.Lock): lock that must be held to change 'queue'.
     """
 
     def __init__(self, command, uid=None, gid=None):
@@ -339,13 +641,28 @@ class ApiExec(Api):
         self.command = command
         self.uid = uid
         self.gid = gid # NOTE: not used.
+        self.jobs = 1
+        self.protocol = 'env'
+        self.timeout = 300
+        self.adaptive = False
+        self.output_limit = 1048576
+        self.queue = []
+        self.lock = threading.Lock()
 
     def copy(self):
         # this will be use in config.read to do a 'shallow' copy: we don't
         # want any global api instance to be bound to any targets since then
         # changes to the domain of that api object for every target will
         # affect every other target's api object.
-        return ApiExec(self.command, self.uid, self.gid)
+        api = ApiExec(self.command, self.uid, self.gid)
+        api.jobs = self.jobs
+        api.protocol = self.protocol
+        api.timeout = self.timeout
+        api.adaptive = self.adaptive
+        api.output_limit = self.output_limit
+        api.queue = self.queue
+        api.lock = self.lock
+        return api
 
     def __str__(self):
         return "    - {}\n       domain: {}\n       command: {} [uid: {}]".format(self.type, self.domain, self.command, self.uid, self.gid)
@@ -357,7 +674,12 @@ class ApiExec(Api):
         return (self.type == a.type and self.domain == a.domain
                 and self.command == a.command
                 and self.uid == a.uid
-                and self.gid == a.gid)
+                and self.gid == a.gid
+                and self.jobs == a.jobs
+                and self.protocol == a.protocol
+                and self.timeout == a.timeout
+                and self.adaptive == a.adaptive
+                and self.output_limit == a.output_limit)
 
     def __hash__(self):
         return super().__hash__()
@@ -387,13 +709,33 @@ class Record:
     def __str__(self):
         return "  params: {}\n  cert: {}".format(self.params, self.cert)
 
+def intern(string):
+    """Return the interned copy of a string.
+
+    Used for the values that many records share (e.g. the TLSA parameters,
+    ports and protocols), so that only one copy of each is kept.
+
+    Args:
+        string (str): the string, or 'None'.
+
+    Returns:
+        str: the interned string, or else 'None' if 'string' is 'None'.
+    """
+    if string == None:
+        return None
+    return sys.intern(string)
+
 class Tlsa:
     """Class recording the data of a TLSA record.
 
+    The string attributes are interned (see 'intern').
+
     Attributes:
-        usage (str): either '2' or '3'.
-        selector (str): either '0' or '1'.
-        matching (str): either '0', '1' or '2'.
+        param (str): the usage, selector and matching type fields,
+            concatenated (e.g. '311').
+        usage (str): either '2' or '3' (read-only: from 'param').
+        selector (str): either '0' or '1' (read-only: from 'param').
+        matching (str): either '0', '1' or '2' (read-only: from 'param').
         port (str): port number of the TLSA record.
         protocol (str): protocol of the TLSA record.
         domain (str): domain of the TLSA record.
@@ -405,23 +747,34 @@ class Tlsa:
             all already been done.
     """
 
+    __slots__ = ('param', 'port', 'protocol', 'domain', 'publish')
+
     def __init__(self, param, port, protocol, domain):
-        self.usage = param[0]
-        self.selector = param[1]
-        self.matching = param[2]
-        self.port = port
-        self.protocol = protocol
-        self.domain = domain
+        self.param = intern(param[0:3])
+        self.port = intern(port)
+        self.protocol = intern(protocol)
+        self.domain = intern(domain)
         self.publish = True
 
+    @property
+    def usage(self):
+        return self.param[0]
+
+    @property
+    def selector(self):
+        return self.param[1]
+
+    @property
+    def matching(self):
+        return self.param[2]
+
     def __eq__(self, t):
-        return ( self.usage == t.usage and self.selector == t.selector
-                    and self.matching == t.matching and self.port == t.port
+        return ( self.param == t.param and self.port == t.port
                     and self.protocol == t.protocol
                     and self.domain == t.domain and self.publish == t.publish )
 
     def params(self):
-        return "{}{}{}".format(self.usage, self.selector, self.matching)
+        return self.param
 
     def __str__(self):
         return "    - tlsa: {}{}{} {} {} {} [state:{}]".format(
@@ -439,20 +792,38 @@ class Tlsa:
 class Cert:
     """A set of corresponding live, archive and dane certificates.
 
+    The paths are kept as strings (a 'pathlib.Path' object is several
+    times the size), and a 'pathlib.Path' object made whenever one is read.
+
     Attributes:
         dane (pathlib.Path): the absolute path of the dane certificate.
         live (pathlib.Path): the absolute path of the live certificate.
         archive (pathlib.Path): the absolute path of the archive certificate.
     """
 
+    __slots__ = ('dane_path', 'live_path', 'archive_path')
+
     def __init__(self, dane, live, archive):
-        self.dane = pathlib.Path(dane)
-        self.live = pathlib.Path(live)
-        self.archive = pathlib.Path(archive)
+        self.dane_path = str(pathlib.Path(dane))
+        self.live_path = str(pathlib.Path(live))
+        self.archive_path = str(pathlib.Path(archive))
+
+    @property
+    def dane(self):
+        return pathlib.Path(self.dane_path)
+
+    @property
+    def live(self):
+        return pathlib.Path(self.live_path)
+
+    @property
+    def archive(self):
+        return pathlib.Path(self.archive_path)
 
     def __eq__(self, c):
-        return ( self.dane == c.dane and self.live == c.live
-                    and self.archive == c.archive )
+        return ( self.dane_path == c.dane_path
+                    and self.live_path == c.live_path
+                    and self.archive_path == c.archive_path )
 
     def __str__(self):
         return "    - dane: {}\n      . live: {}\n      . archive: {}".format(
@@ -474,6 +845,8 @@ class Target:
             the target.
     """
 
+    __slots__ = ('domain', 'certs', 'tlsa', 'api')
+
     def __init__(self, domain):
         self.domain = domain        # This is the subfolder 
         self.certs = []             # [ Cert()... ]
@@ -539,6 +912,10 @@ class ConfigState:
 class DataLine:
     """Base class for datalines.
 
+    Datalines (and their subclasses) have no '__dict__', to keep them small:
+    only the attributes given in '__slots__' can be set. The string
+    attributes that many lines share are interned (see 'intern').
+
     Attributes:
         type (DataLineType): the type of the line.
         domain (str): the domain of the line (e.g. 'example.com').
@@ -548,12 +925,17 @@ class DataLine:
             or not.
     """
 
+    __slots__ = ('type', 'domain', 'lineno', 'state')
+
     def __init__(self, type, domain, lineno):
         self.type = type
-        self.domain = domain
+        self.domain = intern(domain)
         self.lineno = lineno
         self.state = DataLineState.write
 
+    def write_state_on(self):
+        self.state = DataLineState.write
+
     def write_state_off(self):
         self.state = DataLineState.skip
 
@@ -567,10 +949,12 @@ class DataPre(DataLine):
             present), or else '1' when posthook lines also present.
     """
 
+    __slots__ = ('cert', 'pending')
+
     def __init__(self, domain, lineno, dane, live, archive, pending):
         super().__init__(DataLineType.pre, domain, lineno)
         self.cert = Cert(dane, live, archive)
-        self.pending = pending
+        self.pending = intern(pending)
 
     def __eq__(self, l):
         return ( self.type == l.type and self.domain == l.domain
@@ -585,6 +969,15 @@ class DataPre(DataLine):
                 and self.lineno == l.lineno and self.state == l.state
                 and self.cert == l.cert and self.pending == l.pending)
 
+    def key(self):
+        """Return the key of the line in the index of its group.
+
+        Made from the attributes (compared by '__eq__') that do not change
+        once the line is made.
+        """
+        return (self.domain, self.cert.dane_path, self.cert.live_path,
+                self.cert.archive_path)
+
     def pending_on(self):
         self.pending = '1'
 
@@ -610,11 +1003,13 @@ class DataPost(DataLine):
             it.
     """
 
+    __slots__ = ('tlsa', 'pending', 'time', 'hash', 'mark_delete')
+
     def __init__(self, domain, lineno, tlsa, pending, time, hash):
         super().__init__(DataLineType.post, domain, lineno)
         self.tlsa = tlsa
-        self.pending = pending
-        self.time = time
+        self.pending = intern(pending)
+        self.time = intern(time)
         self.hash = hash
         self.mark_delete = False
 
@@ -632,6 +1027,18 @@ class DataPost(DataLine):
                 and self.tlsa == l.tlsa and self.pending == l.pending
                 and self.hash == l.hash and sel.make_absolute == l.mark_delete)
 
+    def key(self):
+        """Return the key of the line in the index of its group.
+
+        Made from the attributes (compared by '__eq__') that do not change
+        once the line is made.
+        """
+        return (self.domain, self.tlsa.param, self.tlsa.port,
+                self.tlsa.protocol, self.tlsa.domain, self.hash)
+
+    def pending_on(self):
+        self.pending = '1'
+
     def pending_off(self):
         self.pending = '0'
 
@@ -654,11 +1061,13 @@ class DataDelete(DataLine):
         hash (str): the 'certificate data' of the TLSA record to delete.
     """
 
+    __slots__ = ('tlsa', 'count', 'time', 'hash')
+
     def __init__(self, domain, lineno, tlsa, count, time, hash):
         super().__init__(DataLineType.delete, domain, lineno)
         self.tlsa = tlsa
-        self.count = count
-        self.time = time
+        self.count = intern(count)
+        self.time = intern(time)
         self.hash = hash
 
     def __eq__(self, l):
@@ -675,6 +1084,15 @@ class DataDelete(DataLine):
                 and self.tlsa == l.tlsa and self.count == l.count
                 and self.hash == l.hash)
 
+    def key(self):
+        """Return the key of the line in the index of its group.
+
+        Made from the attributes (compared by '__eq__') that do not change
+        once the line is made.
+        """
+        return (self.domain, self.tlsa.param, self.tlsa.port,
+                self.tlsa.protocol, self.tlsa.domain, self.hash)
+
     def increment_count(self):
         c = int(self.count)
         c += 1
@@ -703,23 +1121,34 @@ class DataGroup:
         pre: (list(DataPre)): list of prehook lines.
         post: (list(DataPost)): list of posthook lines.
         special: (list(DataDelete)): list of delete lines.
+        deferred (list(function)): functions to call as 'f(prog, group)'
+            once any queued api operations have been made (see
+            'dane.finish_api_calls'). They should return 'True' for errors,
+            'False' otherwise.
+        index (dict(DataLineType, dict(tuple, list(DataLine)))): the lines
+            of every type, keyed by 'DataLine.key', so that a line need only
+            be compared with the lines of the same key when checking if it
+            is already in the group. Lines must only be added (or removed)
+            with the methods of the group, so that the index is kept
+            up to date.
     """
 
-    def __init__(self, prog, line):
+    def __init__(self, prog, line, targets=None):
         self.domain = line.domain
 
-        for t in prog.target_list:
-            if line.domain == t.domain:
-                self.target = t
-                break
-        else:
-            self.target = None
+        if targets == None:
+            targets = Data.target_index(prog)
+        self.target = targets.get(line.domain)
+        if not self.target:
             prog.log.warning(
                     "line {}: domain '{}' not found in config file".format(
                                                     line.lineno, line.domain))
         self.pre = []
         self.post = []
         self.special = []
+        self.deferred = []
+        self.index = { DataLineType.pre: {}, DataLineType.post: {},
+                       DataLineType.delete: {} }
         if line.type == DataLineType.pre:
             self.add_pre(line)
         elif line.type == DataLineType.post:
@@ -746,19 +1175,44 @@ class DataGroup:
             self.add_special(line)
 
     def add_pre(self, line):
-        if line in self.pre:
-            return
-        self.pre += [ line ]
+        if self.index_line(line):
+            self.pre += [ line ]
 
     def add_post(self, line):
-        if line in self.post:
-            return
-        self.post += [ line ]
+        if self.index_line(line):
+            self.post += [ line ]
 
     def add_special(self, line):
-        if line in self.special:
-            return
-        self.special += [ line ]
+        if self.index_line(line):
+            self.special += [ line ]
+
+    def index_line(self, line):
+        """Add a line to the index, unless already in the group.
+
+        Args:
+            line (DataLine): the line.
+
+        Returns:
+            bool: 'True' if the line was added to the index (and so should
+                be added to the group), 'False' if an equal line is already
+                in the group.
+        """
+        bucket = self.index[line.type].setdefault(line.key(), [])
+        if line in bucket:
+            return False
+        bucket += [ line ]
+        return True
+
+    def remove_post(self, line):
+        """Remove a posthook line (the very object given) from the group."""
+        self.post = [ l for l in self.post if l is not line ]
+        key = line.key()
+        bucket = [ l for l in self.index[DataLineType.post].get(key, [])
+                                                            if l is not line ]
+        if bucket:
+            self.index[DataLineType.post][key] = bucket
+        else:
+            self.index[DataLineType.post].pop(key, None)
 
 class Data:
     """Class to record all the data in the datafile.
@@ -766,19 +1220,119 @@ class Data:
     Attributes:
         groups (list(DataGroup)): Lines in the datafile are grouped by
             their domain.
+        index (dict(str, DataGroup)): the groups, keyed by their domain.
+        targets (dict(str, Target)): the targets of the config file, keyed
+            by their domain (see 'target_index').
+        targets_from ((list(Target), int)): the target list (and its
+            length) that 'targets' was made from.
+        unloaded (list(str)): the lines of the groups that were not read
+            (see 'datafile_loading' of 'State'), to be written out as they
+            are.
+        deadlines (list((int, str))): a heap of the publish times (and
+            domains) of the posthook lines that are not pending: the old
+            TLSA records of such a line can be deleted once its time plus
+            the time-to-live value has passed. This includes the lines that
+            were not read (or, for a SQLite store, the earliest of them).
+        pending (set(str)): the domains with posthook lines that are
+            pending.
     """
 
     def __init__(self):
         self.groups = []
+        self.index = {}
+        self.unloaded = []
+        self.deadlines = []
+        self.pending = set()
+        self.targets = None
+        self.targets_from = None
 
     def add_line(self, prog, line):
         """Line is added to either an existing group, or a new group."""
-        for d in self.groups:
-            if d.domain == line.domain:
-                d.add_line(line)
-                break
-        else:
-            self.groups += [ DataGroup(prog, line) ]
+        if line.type == DataLineType.post:
+            if line.pending == '0':
+                self.add_deadline(int(line.time), line.domain)
+            else:
+                self.pending.add(line.domain)
+
+        group = self.index.get(line.domain)
+        if group:
+            group.add_line(line)
+            return
+
+        # the config file may have been read again since the index was made
+        if (not self.targets_from
+                or self.targets_from[0] is not prog.target_list
+                or self.targets_from[1] != len(prog.target_list)):
+            self.targets = self.target_index(prog)
+            self.targets_from = (prog.target_list, len(prog.target_list))
+
+        group = DataGroup(prog, line, self.targets)
+        self.groups += [ group ]
+        self.index[line.domain] = group
+
+    def add_deadline(self, time, domain):
+        """Record the publish time of a posthook line that is not pending."""
+        heapq.heappush(self.deadlines, (time, domain))
+
+    def work_groups(self, prog):
+        """Return the groups with work to do.
+
+        A group has no work to do if its domain was not renewed, and it has
+        posthook lines, none of which are pending or have had their
+        time-to-live value pass: processing it would change nothing. The
+        groups whose time-to-live value has passed are found from
+        'deadlines', without looking at their lines.
+
+        Args:
+            prog (State): not changed.
+
+        Returns:
+            list(DataGroup): the groups, in the order they were read.
+        """
+        due = int("{:%s}".format(prog.timenow)) - prog.ttl
+        # a sorted list is still a heap
+        self.deadlines.sort()
+        end = bisect.bisect_left(self.deadlines, (due + 1,))
+
+        work = set(prog.renewed_domains) | self.pending
+        work.update([ d for t, d in self.deadlines[:end] ])
+        return [ g for g in self.groups if not g.post or g.domain in work ]
+
+    def next_due(self, prog):
+        """Return the time a run will next have work to do.
+
+        Args:
+            prog (State): not changed.
+
+        Returns:
+            int: the unix time: the time now if there is work to do now,
+                or else the earliest time that the old TLSA records of a
+                posthook line can be deleted. If there is no work to do
+                at all, 'None' is returned.
+        """
+        now = int("{:%s}".format(prog.timenow))
+        if self.work_groups(prog):
+            return now
+        if not self.deadlines:
+            return None
+        return max(now, self.deadlines[0][0] + prog.ttl)
+
+    @staticmethod
+    def target_index(prog):
+        """Return the targets of the config file, keyed by their domain.
+
+        If more than one target has the same domain, the first is used.
+
+        Args:
+            prog (State): not changed.
+
+        Returns:
+            dict(str, Target): the targets.
+        """
+        targets = {}
+        for t in prog.target_list:
+            targets.setdefault(t.domain, t)
+        return targets
 
     def __str__(self):
         ret = " ++ printing data groups:"
@@ -0,0 +1,298 @@
+
+import os
+import contextlib
+
+from alnitak import prog as Prog
+
+
+# A SQLite store is an alternative to the text datafile (see 'datafile.py')
+# for hosts with many domains: it keeps the same datafile lines, but in
+# tables (one for each type of line), indexed by domain and by pending
+# state, so that a run need only load (and write back) the lines of the
+# domains it has work to do for.
+#
+# The database is kept in WAL mode.
+#
+# The 'sqlite3' module is only imported once a store is opened, and its
+# errors are raised as 'Error' by 'open_store' (and 'create').
+
+magic = b"SQLite format 3\x00"
+
+schema = [
+    """CREATE TABLE IF NOT EXISTS prehook (
+            domain TEXT NOT NULL,
+            dane TEXT NOT NULL,
+            live TEXT NOT NULL,
+            archive TEXT NOT NULL,
+            pending INTEGER NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS posthook (
+            domain TEXT NOT NULL,
+            param TEXT NOT NULL,
+            port TEXT NOT NULL,
+            protocol TEXT NOT NULL,
+            tlsa_domain TEXT NOT NULL,
+            time INTEGER NOT NULL,
+            pending INTEGER NOT NULL,
+            hash TEXT NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS deletes (
+            domain TEXT NOT NULL,
+            param TEXT NOT NULL,
+            port TEXT NOT NULL,
+            protocol TEXT NOT NULL,
+            tlsa_domain TEXT NOT NULL,
+            time INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            hash TEXT NOT NULL)""",
+    "CREATE INDEX IF NOT EXISTS prehook_domain ON prehook (domain)",
+    "CREATE INDEX IF NOT EXISTS prehook_pending ON prehook (pending)",
+    "CREATE INDEX IF NOT EXISTS posthook_domain ON posthook (domain)",
+    "CREATE INDEX IF NOT EXISTS posthook_pending ON posthook (pending, time)",
+    "CREATE INDEX IF NOT EXISTS deletes_domain ON deletes (domain)",
+    ]
+
+tables = { Prog.DataLineType.pre: 'prehook',
+           Prog.DataLineType.post: 'posthook',
+           Prog.DataLineType.delete: 'deletes' }
+
+
+class Error(Exception):
+    """Raised if a SQLite store cannot be opened, read or written."""
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return "{}".format(self.message)
+
+class Store:
+    """A datafile that was read as a SQLite store.
+
+    Attributes:
+        domains (set(str)): the domains whose lines were read, or else
+            'None' if all the lines were read.
+    """
+
+    def __init__(self, domains=None):
+        self.domains = domains
+
+
+def is_store(path):
+    """Return 'True' if the file is a SQLite store.
+
+    Args:
+        path (pathlib.Path): the file.
+
+    Returns:
+        bool: 'False' if the file does not start with the SQLite magic
+            bytes, or if it cannot be read.
+    """
+    try:
+        with open(str(path), "rb") as file:
+            return file.read(len(magic)) == magic
+    except OSError:
+        return False
+
+def connect(path):
+    """Open a SQLite store, creating its tables if need be.
+
+    Args:
+        path (pathlib.Path): the store.
+
+    Returns:
+        sqlite3.Connection: the connection to the store.
+
+    Raises:
+        sqlite3.Error: if the store cannot be opened.
+    """
+    import sqlite3
+
+    conn = sqlite3.connect(str(path))
+    try:
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = FULL")
+        with conn:
+            for statement in schema:
+                conn.execute(statement)
+    except sqlite3.Error:
+        conn.close()
+        raise
+    return conn
+
+@contextlib.contextmanager
+def open_store(path):
+    """Open a SQLite store for the duration of a 'with' block.
+
+    Args:
+        path (pathlib.Path): the store.
+
+    Returns:
+        sqlite3.Connection: the connection to the store (see 'connect'),
+            closed at the end of the block.
+
+    Raises:
+        Error: if the store cannot be opened, or if a SQLite error is
+            raised in the block.
+    """
+    import sqlite3
+
+    try:
+        conn = connect(path)
+        try:
+            yield conn
+        finally:
+            conn.close()
+    except sqlite3.Error as ex:
+        raise Error("{}".format(ex))
+
+def due_domains(conn, time):
+    """Return the domains that have work to do, whether renewed or not.
+
+    These are the domains with delete lines, with prehook lines but no
+    posthook lines (prehook lines are pending exactly when there are
+    posthook lines), with posthook lines still to be published, or with
+    posthook lines whose old TLSA records may now be deleted.
+
+    Args:
+        conn (sqlite3.Connection): the connection to the store.
+        time (int): the unix time posthook lines (not pending) must have
+            been published at or before for their old TLSA records to be
+            deleted (i.e., the time now minus the time-to-live value).
+
+    Returns:
+        set(str): the domains.
+    """
+    rows = conn.execute("""
+            SELECT domain FROM deletes
+            UNION SELECT domain FROM prehook WHERE pending = 0
+            UNION SELECT domain FROM posthook WHERE pending = 1
+            UNION SELECT domain FROM posthook WHERE pending = 0 AND time <= ?
+            """, (time,))
+    return set([ r[0] for r in rows ])
+
+def load(conn, domains=None):
+    """Read the lines of a SQLite store.
+
+    Args:
+        conn (sqlite3.Connection): the connection to the store.
+        domains (set(str)): only the lines of these domains are read, or
+            else all the lines if 'None'.
+
+    Returns:
+        list(DataLine): the lines, numbered by their row in their table.
+    """
+    where = ""
+    if domains is not None:
+        conn.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS load (domain TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM load")
+        conn.executemany("INSERT INTO load VALUES (?)",
+                         [ (d,) for d in domains ])
+        where = "WHERE domain IN (SELECT domain FROM load)"
+
+    lines = []
+    for r in conn.execute(
+            "SELECT rowid, domain, dane, live, archive, pending "
+            "FROM prehook {} ORDER BY rowid".format(where)):
+        lines += [ Prog.DataPre(r[1], r[0], r[2], r[3], r[4], str(r[5])) ]
+
+    for r in conn.execute(
+            "SELECT rowid, domain, param, port, protocol, tlsa_domain, time, "
+            "pending, hash FROM posthook {} ORDER BY rowid".format(where)):
+        lines += [ Prog.DataPost(r[1], r[0], Prog.Tlsa(r[2], r[3], r[4], r[5]),
+                                 str(r[7]), str(r[6]), r[8]) ]
+
+    for r in conn.execute(
+            "SELECT rowid, domain, param, port, protocol, tlsa_domain, time, "
+            "count, hash FROM deletes {} ORDER BY rowid".format(where)):
+        lines += [ Prog.DataDelete(r[1], r[0],
+                                   Prog.Tlsa(r[2], r[3], r[4], r[5]),
+                                   str(r[7]), str(r[6]), r[8]) ]
+
+    return lines
+
+def earliest(conn):
+    """Return the earliest posthook line (not pending) that was not read.
+
+    Args:
+        conn (sqlite3.Connection): the connection to the store: 'load' must
+            have been called (with domains) first.
+
+    Returns:
+        (int, str): the publish time and domain of the line, or else
+            'None' if there is no such line.
+    """
+    return conn.execute("""
+            SELECT time, domain FROM posthook
+            WHERE pending = 0 AND domain NOT IN (SELECT domain FROM load)
+            ORDER BY time LIMIT 1""").fetchone()
+
+def row(l):
+    """Return the row of a line in its table."""
+    if l.type == Prog.DataLineType.pre:
+        return (l.domain, l.cert.dane_path, l.cert.live_path,
+                l.cert.archive_path, int(l.pending))
+    if l.type == Prog.DataLineType.post:
+        return (l.domain, l.tlsa.param, l.tlsa.port, l.tlsa.protocol,
+                l.tlsa.domain, int(l.time), int(l.pending), l.hash)
+    return (l.domain, l.tlsa.param, l.tlsa.port, l.tlsa.protocol,
+            l.tlsa.domain, int(l.time), int(l.count), l.hash)
+
+def insert(conn, lines):
+    """Add lines to a SQLite store (not committed).
+
+    Args:
+        conn (sqlite3.Connection): the connection to the store.
+        lines (list(DataLine)): the lines.
+    """
+    for type, table in tables.items():
+        rows = [ row(l) for l in lines if l.type == type ]
+        if rows:
+            conn.executemany("INSERT INTO {} VALUES ({})".format(
+                        table, ", ".join([ "?" ] * len(rows[0]))), rows)
+
+def replace(conn, lines, domains=None):
+    """Replace the lines of a SQLite store, in one transaction.
+
+    Args:
+        conn (sqlite3.Connection): the connection to the store.
+        lines (list(DataLine)): the new lines.
+        domains (set(str)): only the lines of these domains are replaced,
+            or else all the lines if 'None'.
+    """
+    with conn:
+        for table in tables.values():
+            if domains is None:
+                conn.execute("DELETE FROM {}".format(table))
+            else:
+                conn.executemany(
+                        "DELETE FROM {} WHERE domain = ?".format(table),
+                        [ (d,) for d in domains ])
+        insert(conn, lines)
+
+def create(path, lines):
+    """Write lines to a new SQLite store.
+
+    Args:
+        path (str): the store: must not exist, or else be an empty file.
+        lines (list(DataLine)): the lines.
+
+    Raises:
+        Error: if the store cannot be written.
+    """
+    with open_store(path) as conn:
+        replace(conn, lines)
+
+def remove_wal(path):
+    """Remove the WAL files of a SQLite store, if any.
+
+    The WAL files of a store that was removed, or replaced, must not be
+    left: they would be taken as part of any new store made with the same
+    name.
+
+    Args:
+        path (pathlib.Path): the store.
+    """
+    for suffix in [ '-wal', '-shm' ]:
+        try:
+            os.unlink(str(path) + suffix)
+        except OSError:
+            pass
@@ -0,0 +1,140 @@
+
+import pytest
+
+from alnitak import certop
+from alnitak import prog as Prog
+from alnitak import exceptions as Except
+from alnitak.tests import setup
+
+
+def test_cert_cache():
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s)
+
+    live = s.live / 'a.com'
+    t311 = setup.create_tlsa_obj('311', '25', 'tcp', 'a.com')
+    t301 = setup.create_tlsa_obj('301', '25', 'tcp', 'a.com')
+    t201 = setup.create_tlsa_obj('201', '25', 'tcp', 'a.com')
+
+    assert prog.cert_cache == {}
+
+    assert certop.get_tlsa_hash(prog, live / 'fullchain.pem', t311) == \
+                                            s.hash['a.com']['cert1'][311]
+    assert len(prog.cert_cache) == 1
+
+    # same certificate and usage: read from the cache
+    cert = certop.load_cert(prog, live / 'fullchain.pem', '3')
+    assert certop.get_tlsa_hash(prog, live / 'fullchain.pem', t301) == \
+                                            s.hash['a.com']['cert1'][301]
+    assert certop.load_cert(prog, live / 'fullchain.pem', '3') is cert
+    assert len(prog.cert_cache) == 1
+
+    # a different usage picks the intermediate certificate
+    assert certop.get_tlsa_hash(prog, live / 'fullchain.pem', t201) == \
+                                            s.hash['a.com']['cert1'][201]
+    assert len(prog.cert_cache) == 2
+
+    assert certop.get_tlsa_hash(prog, live / 'cert.pem', t311) == \
+                                            s.hash['a.com']['cert1'][311]
+    assert len(prog.cert_cache) == 3
+
+
+def test_cert_cache_renewed():
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s)
+
+    live = s.live / 'a.com'
+    t311 = setup.create_tlsa_obj('311', '25', 'tcp', 'a.com')
+
+    assert certop.get_tlsa_hash(prog, live / 'cert.pem', t311) == \
+                                            s.hash['a.com']['cert1'][311]
+
+    # the live symlink now points to a different file
+    s.renew_a()
+
+    assert certop.get_tlsa_hash(prog, live / 'cert.pem', t311) == \
+                                            s.hash['a.com']['cert2'][311]
+    assert len(prog.cert_cache) == 2
+
+
+def test_cert_cache_errors():
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s)
+
+    t311 = setup.create_tlsa_obj('311', '25', 'tcp', 'a.com')
+
+    with pytest.raises(Except.DNSProcessingError):
+        certop.get_tlsa_hash(prog, s.live / 'a.com' / 'nonexistent.pem', t311)
+
+    with pytest.raises(Except.InternalError):
+        certop.get_tlsa_hash(prog, s.archive / 'a.com' / 'privkey1.pem', t311)
+
+    assert prog.cert_cache == {}
+
+
+def test_digest_table():
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s)
+
+    cert = certop.load_cert(prog, s.live / 'a.com' / 'fullchain.pem', '3')
+    assert cert.digests is None
+
+    assert cert.hash('1', '1') == s.hash['a.com']['cert1'][311]
+
+    # all six selector/matching type combinations are made at once
+    assert len(cert.digests) == 6
+    for param in [ 300, 301, 302, 310, 311, 312 ]:
+        sm = str(param)[1:]
+        assert cert.digests[sm] == s.hash['a.com']['cert1'][param]
+        assert cert.hash(sm[0], sm[1]) == s.hash['a.com']['cert1'][param]
+
+    table = cert.digests
+    t312 = setup.create_tlsa_obj('312', '25', 'tcp', 'a.com')
+    assert certop.get_tlsa_hash(prog, s.live / 'a.com' / 'fullchain.pem',
+                                t312) == s.hash['a.com']['cert1'][312]
+    assert cert.digests is table
+
+    with pytest.raises(Except.InternalError):
+        cert.hash('2', '1')
+
+
+def test_pem_blocks():
+    b = b"-----BEGIN CERTIFICATE-----\nAAAA\n-----END CERTIFICATE-----\n"
+    c = b"-----BEGIN CERTIFICATE-----\r\nBBBB\r\n-----END CERTIFICATE-----\r\n"
+
+    assert certop.pem_blocks(b"") == []
+    assert certop.pem_blocks(b"junk\n") == []
+    assert certop.pem_blocks(b) == [ (0, len(b)) ]
+    assert certop.pem_blocks(b + c) == [ (0, len(b)), (len(b), len(b+c)) ]
+    assert certop.pem_blocks(b"junk\n" + b + b"junk\n" + c) == [
+                        (5, 5 + len(b)), (10 + len(b), 10 + len(b+c)) ]
+
+    # no END line: the block runs to the end of the data
+    assert certop.pem_blocks(b + c[:-27]) == [ (0, len(b)),
+                                              (len(b), len(b+c) - 27) ]
+
+
+def test_read_cert_fullchain():
+    s = setup.Init(keep=True)
+
+    fullchain = s.live / 'a.com' / 'fullchain.pem'
+    with open(str(fullchain), 'rb') as file:
+        data = file.read()
+
+    blocks = certop.pem_blocks(data)
+    assert len(blocks) == 2
+
+    cert = certop.read_cert(fullchain, '3')
+    chain = certop.read_cert(fullchain, '2')
+    assert cert.encode() == data[blocks[0][0]:blocks[0][1]]
+    assert chain.encode() == data[blocks[1][0]:blocks[1][1]]
+
+    with open(str(s.live / 'a.com' / 'chain.pem'), 'r') as file:
+        assert chain.strip() == file.read().strip()
+
+    t311 = setup.create_tlsa_obj('311', '25', 'tcp', 'a.com')
+    t211 = setup.create_tlsa_obj('211', '25', 'tcp', 'a.com')
+    assert certop.get_hash(t311.selector, t311.matching, cert) == \
+                                            s.hash['a.com']['cert1'][311]
+    assert certop.get_hash(t211.selector, t211.matching, chain) == \
+                                            s.hash['a.com']['cert1'][211]
@@ -1,11 +1,23 @@
 
 import pytest
+import os
 import re
+import sys
+import json
+import datetime
+import threading
+import subprocess
+import socketserver
+import http.server
+from urllib.parse import urlparse, parse_qs
 from pathlib import Path
 from time import sleep
 
 from alnitak import config
+from alnitak import dane
+from alnitak import datafile
 from alnitak.api import cloudflare
+from alnitak.api import asynchttp
 from alnitak.tests import setup
 from alnitak import prog as Prog
 from alnitak import exceptions as Except
@@ -20,6 +32,175 @@ def api_file_exists(cloudflare_api):
         return True
     return False
 
+class CloudflareHandler(http.server.BaseHTTPRequestHandler):
+    """Local stand-in for the Cloudflare API (fallback calls only)."""
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, code, result=None, errors=[], result_info=None):
+        response = { 'success': not errors, 'errors': errors,
+                     'result': result }
+        if result_info:
+            response['result_info'] = result_info
+        data = json.dumps(response).encode()
+        self.send_response(code)
+        for k, v in self.server.headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_request(self, method):
+        server = self.server
+        url = urlparse(self.path)
+        query = { k: v[0] for k, v in parse_qs(url.query).items() }
+        parts = url.path.strip('/').split('/')
+
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+
+        server.requests += [ (method, url.path, query) ]
+        sleep(server.delay)
+
+        if server.status:
+            # e.g. rate limited (429) or a server error (5xx)
+            self.reply(server.status.pop(0), errors=[ { 'code': 10100,
+                                            'message': 'Try again later' } ])
+            return
+
+        if (self.headers['X-Auth-Email'] != server.email
+                or self.headers['X-Auth-Key'] != server.key):
+            self.reply(403, errors=[ { 'code': 10000,
+                                       'message': 'Authentication error' } ])
+            return
+
+        if parts == [ 'zones' ]:
+            self.reply(200, [ { 'id': z, 'name': n }
+                                for n, z in server.zones.items()
+                                    if n == query.get('name') ])
+            return
+
+        if (len(parts) < 3 or parts[0] != 'zones' or parts[2] != 'dns_records'
+                or parts[1] not in server.zones.values()):
+            self.reply(404, errors=[ { 'code': 7003,
+                                       'message': 'Could not route' } ])
+            return
+
+        records = server.records
+        if method == 'POST' and parts[3:] == [ 'batch' ]:
+            self.reply_batch(json.loads(body.decode()))
+        elif method == 'GET':
+            result = [ r for r in records.values()
+                        if r['type'] == query.get('type', r['type'])
+                            and r['name'] == query.get('name', r['name']) ]
+            page = int(query.get('page', 1))
+            per_page = int(query.get('per_page', 100))
+            self.reply(200, result[(page-1)*per_page:page*per_page],
+                       result_info={ 'page': page, 'per_page': per_page,
+                                     'total_count': len(result),
+                                     'total_pages':
+                                        (len(result) + per_page - 1) // per_page })
+        elif method == 'POST':
+            data = json.loads(body.decode())
+            if data['data']['certificate'] in server.fail:
+                self.reply(400, errors=[ { 'code': 1004,
+                                    'message': 'DNS Validation Error' } ])
+                return
+            for r in records.values():
+                if r['name'] == data['name'] and r['data'] == data['data']:
+                    self.reply(400, errors=[ { 'code': 81057,
+                                    'message': 'The record already exists.' } ])
+                    return
+            server.next_id += 1
+            data['id'] = 'id{}'.format(server.next_id)
+            records[data['id']] = data
+            self.reply(200, data)
+        elif method == 'DELETE':
+            if parts[3] not in records:
+                self.reply(404, errors=[ { 'code': 81044,
+                                        'message': 'Record does not exist.' } ])
+                return
+            del records[parts[3]]
+            self.reply(200, { 'id': parts[3] })
+
+    def reply_batch(self, data):
+        # a batch is applied as a whole, or not at all
+        server = self.server
+        records = server.records
+        deletes = data.get('deletes', [])
+        posts = data.get('posts', [])
+        for d in deletes:
+            if d['id'] not in records:
+                self.reply(404, errors=[ { 'code': 81044,
+                                    'message': 'Record does not exist.' } ])
+                return
+        for p in posts:
+            if p['data']['certificate'] in server.fail:
+                self.reply(400, errors=[ { 'code': 1004,
+                                    'message': 'DNS Validation Error' } ])
+                return
+            for r in records.values():
+                if r['name'] == p['name'] and r['data'] == p['data']:
+                    self.reply(400, errors=[ { 'code': 81057,
+                                    'message': 'The record already exists.' } ])
+                    return
+
+        result = { 'deletes': [], 'posts': [] }
+        for d in deletes:
+            result['deletes'] += [ records.pop(d['id']) ]
+        for p in posts:
+            server.next_id += 1
+            p['id'] = 'id{}'.format(server.next_id)
+            records[p['id']] = p
+            result['posts'] += [ p ]
+        self.reply(200, result)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+class CloudflareServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # e.g. the client timed out and closed the connection
+        pass
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), CloudflareHandler)
+        self.email = 'user@a.com'
+        self.key = 'abc123'
+        self.zones = { 'a.com': 'zone1' }
+        self.records = {}
+        self.fail = set()
+        self.status = []
+        self.headers = {}
+        self.next_id = 0
+        self.delay = 0
+        self.connections = 0
+        self.requests = []
+        self.url = 'http://127.0.0.1:{}'.format(self.server_address[1])
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+def create_local_api(server, domain='a.com'):
+    api = Prog.ApiCloudflare(server.email, server.key)
+    api.set_domain(domain)
+    api.url = server.url
+    return api
+
+
 def get_domain(api_path):
     with open(str(api_path), 'r') as file:
         lines = file.read().splitlines()
@@ -109,3 +290,853 @@ def test_cloudflare(cloudflare_api):
         with pytest.raises(Except.DNSNotLive) as ex:
             cloudflare.api_read(prog, api, tlsa2)
 
+
+
+def test_cloudflare_session():
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s)
+    server = CloudflareServer()
+
+    try:
+        api = create_local_api(server)
+        tlsa1 = setup.create_tlsa_obj('211', '53527', 'tcp', 'a.com')
+        tlsa2 = setup.create_tlsa_obj('311', '53527', 'tcp', 'a.com')
+        hash211 = s.hash['a.com']['cert1'][211]
+        hash311 = s.hash['a.com']['cert1'][311]
+
+        cloudflare.api_publish(prog, api, tlsa1, hash211)
+        cloudflare.api_publish(prog, api, tlsa2, hash311)
+        assert api.zone == 'zone1'
+
+        with pytest.raises(Except.DNSSkipProcessing):
+            cloudflare.api_publish(prog, api, tlsa1, hash211)
+
+        records211 = cloudflare.api_read(prog, api, tlsa1)
+        assert list(records211) == [ hash211 ]
+
+        cloudflare.api_delete(prog, api, tlsa1, records211[hash211])
+
+        with pytest.raises(Except.DNSNotLive):
+            cloudflare.api_read(prog, api, tlsa1)
+
+        with pytest.raises(Except.DNSProcessingError):
+            cloudflare.api_delete(prog, api, tlsa1, records211[hash211])
+
+        # every call was made over the one (kept alive) connection
+        assert len(server.requests) == 7
+        assert server.connections == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_cloudflare_session_errors():
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s)
+    server = CloudflareServer()
+
+    try:
+        tlsa = setup.create_tlsa_obj('311', '53527', 'tcp', 'a.com')
+
+        # read timeout
+        api = create_local_api(server)
+        api.timeout = (5, 0.2)
+        server.delay = 0.5
+        with pytest.raises(Except.DNSProcessingError) as ex:
+            cloudflare.api_read(prog, api, tlsa)
+        assert ex.value.message == "request timed out"
+        server.delay = 0
+
+        # bad credentials
+        api = create_local_api(server)
+        api.key = 'wrong'
+        with pytest.raises(Except.DNSProcessingError):
+            cloudflare.api_read(prog, api, tlsa)
+
+        # unknown zone
+        api = create_local_api(server, 'b.com')
+        with pytest.raises(Except.DNSProcessingError):
+            cloudflare.api_read(prog, api, tlsa)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # no server listening (and no connection left open from before)
+    prog = setup.create_state_obj(s)
+    api = create_local_api(server)
+    with pytest.raises(Except.DNSProcessingError) as ex:
+        cloudflare.api_read(prog, api, tlsa)
+    assert ex.value.message == "connection error encountered"
+
+
+def test_cloudflare_zone_cache():
+    s = setup.Init(keep=True)
+    server = CloudflareServer()
+    cache = s.datadir / 'alnitak.zones'
+
+    def zone_lookups():
+        return len([ r for r in server.requests if r[1] == '/zones' ])
+
+    try:
+        tlsa = setup.create_tlsa_obj('311', '53527', 'tcp', 'a.com')
+        hash311 = s.hash['a.com']['cert1'][311]
+
+        prog = setup.create_state_obj(s)
+        api = create_local_api(server)
+        cloudflare.api_publish(prog, api, tlsa, hash311)
+        assert zone_lookups() == 1
+        assert not api.zone_cached
+
+        with open(str(cache), 'r') as file:
+            lines = file.read().splitlines()
+        assert len(lines) == 1
+        assert lines[0].split()[:3] == [ 'user@a.com', 'a.com', 'zone1' ]
+        assert cache.stat().st_mode & 0o777 == 0o600
+
+        # a later run reads the zone ID from the cache
+        prog = setup.create_state_obj(s)
+        api = create_local_api(server)
+        assert cloudflare.api_read(prog, api, tlsa) != {}
+        assert zone_lookups() == 1
+        assert api.zone_cached
+
+        # the zone ID changed: the cached value is dropped and looked up
+        os.link(str(cache), str(s.datadir / 'zones.old'))
+        server.zones['a.com'] = 'zone2'
+        prog = setup.create_state_obj(s)
+        api = create_local_api(server)
+        assert cloudflare.api_read(prog, api, tlsa) != {}
+        assert zone_lookups() == 2
+        assert api.zone == 'zone2'
+        assert not api.zone_cached
+
+        with open(str(cache), 'r') as file:
+            assert file.read().split()[:3] == [ 'user@a.com', 'a.com',
+                                                'zone2' ]
+
+        # the file was replaced (via a temporary file), not rewritten
+        with open(str(s.datadir / 'zones.old'), 'r') as file:
+            assert file.read().split()[:3] == [ 'user@a.com', 'a.com',
+                                                'zone1' ]
+        assert cache.stat().st_mode & 0o777 == 0o600
+        assert [ f.name for f in s.datadir.iterdir()
+                            if f.name.startswith('.alnitak.zones') ] == []
+
+        # an expired entry is not used
+        prog = setup.create_state_obj(s)
+        prog.timenow += datetime.timedelta(seconds=120)
+        api = create_local_api(server)
+        api.zone_ttl = 60
+        assert cloudflare.api_read(prog, api, tlsa) != {}
+        assert zone_lookups() == 3
+
+        # caching disabled
+        prog = setup.create_state_obj(s)
+        api = create_local_api(server)
+        api.zone_ttl = 0
+        assert cloudflare.api_read(prog, api, tlsa) != {}
+        assert zone_lookups() == 4
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_cloudflare_get_api():
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s)
+
+    state = Prog.ConfigState()
+    api = cloudflare.get_api(prog, 'a.com',
+                    [ 'email:user@a.com', 'zone_ttl:60', 'key:abc123' ], state)
+    assert api.email == 'user@a.com'
+    assert api.key == 'abc123'
+    assert api.zone_ttl == 60
+    assert api.copy().zone_ttl == 60
+
+    api = cloudflare.get_api(prog, 'a.com',
+                    [ 'email:user@a.com', 'key:abc123' ], state)
+    assert api.zone_ttl == 7*24*60*60
+    assert api.batch == 0
+    assert not state.errors
+
+    api = cloudflare.get_api(prog, 'a.com',
+                    [ 'batch:20', 'email:user@a.com', 'key:abc123' ], state)
+    assert api.batch == 20
+    assert api.copy().batch == 20
+
+    api = cloudflare.get_api(prog, 'a.com',
+                    [ 'email:user@a.com', 'key:abc123', 'retry:0' ], state)
+    assert api.retry == 0
+    assert api.copy().retry == 0
+
+    api = cloudflare.get_api(prog, 'a.com',
+                    [ 'client:async', 'email:user@a.com', 'key:abc123' ], state)
+    assert api.client == 'async'
+    assert api.copy().client == 'async'
+
+    with prog.log:
+        for inputs in [ [ 'zone_ttl:60' ],
+                        [ 'email:user@a.com', 'zone_ttl:x', 'key:abc123' ],
+                        [ 'email:user@a.com', 'zone_ttl:1', 'zone_ttl:2',
+                          'key:abc123' ],
+                        [ 'email:user@a.com', 'key:abc123', 'client:x' ] ]:
+            state = Prog.ConfigState()
+            assert cloudflare.get_api(prog, 'a.com', inputs, state) == None
+            assert state.errors
+
+
+def test_cloudflare_shared_api():
+    s = setup.Init(keep=True)
+    server = CloudflareServer()
+    server.zones['b.com'] = 'zoneb'
+
+    conf = s.parent / 'cloudflare_shared.conf'
+    with open(str(conf), 'w') as file:
+        file.write('''
+            api = cloudflare email:{} key:{} zone_ttl:0
+            [a.com]
+            tlsa = 311 53527
+            [x.a.com]
+            tlsa = 311 53527
+            [y.a.com]
+            tlsa = 311 53527
+            [b.com]
+            tlsa = 311 53527
+            '''.format(server.email, server.key))
+
+    prog = setup.create_state_obj(s, config=conf)
+
+    try:
+        with prog.log:
+            retval = config.read(prog)
+            assert retval == Prog.RetVal.ok
+
+        targets = prog.target_list
+        assert len(targets) == 4
+
+        # one api object per zone
+        assert targets[0].api is targets[1].api
+        assert targets[0].api is targets[2].api
+        assert targets[0].api is not targets[3].api
+        assert targets[3].api.domain == 'b.com'
+
+        for t in targets:
+            t.api.url = server.url
+            with pytest.raises(Except.DNSNotLive):
+                cloudflare.api_read(prog, t.api, t.tlsa[0])
+
+        # one zone lookup per zone, and one session for the account
+        assert len([ r for r in server.requests if r[1] == '/zones' ]) == 2
+        assert len(prog.sessions) == 1
+        assert targets[0].api.session is targets[3].api.session
+        assert server.connections == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_cloudflare_records(monkeypatch):
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s)
+    server = CloudflareServer()
+    monkeypatch.setattr(cloudflare, 'records_per_page', 2)
+
+    def add_record(name, usage, selector, matching, cert, type='TLSA'):
+        server.next_id += 1
+        id = 'id{}'.format(server.next_id)
+        server.records[id] = { 'id': id, 'type': type, 'name': name,
+                               'data': { 'usage': usage,
+                                         'selector': selector,
+                                         'matching_type': matching,
+                                         'certificate': cert } }
+        return id
+
+    def listings():
+        return len([ r for r in server.requests
+                        if r[0] == 'GET' and r[1].endswith('/dns_records') ])
+
+    try:
+        id1 = add_record('_25._tcp.a.com', 3, 1, 1, 'ABC')
+        id2 = add_record('_25._tcp.a.com', 3, 1, 1, 'def')
+        id3 = add_record('_25._tcp.a.com', 2, 1, 1, 'abc')
+        id4 = add_record('_443._tcp.x.a.com', 3, 1, 1, 'abc')
+        add_record('_25._udp.a.com', 3, 1, 1, 'abc')
+        add_record('a.com', 3, 1, 1, 'abc', type='A')
+
+        api = create_local_api(server)
+        t311 = setup.create_tlsa_obj('311', '25', 'tcp', 'a.com')
+        t211 = setup.create_tlsa_obj('211', '25', 'tcp', 'A.com')
+        t301 = setup.create_tlsa_obj('301', '25', 'tcp', 'a.com')
+        tx = setup.create_tlsa_obj('311', '443', 'tcp', 'x.a.com')
+
+        assert cloudflare.api_read(prog, api, t311) == { 'abc': id1,
+                                                         'def': id2 }
+        # five TLSA records, two per page
+        assert listings() == 3
+        assert [ r[2]['type'] for r in server.requests[1:] ] == [ 'TLSA' ]*3
+
+        assert cloudflare.api_read(prog, api, t211) == { 'abc': id3 }
+        assert cloudflare.api_read(prog, api, tx) == { 'abc': id4 }
+        with pytest.raises(Except.DNSNotLive):
+            cloudflare.api_read(prog, api, t301)
+
+        # our own publishes and deletes update the index
+        hash301 = s.hash['a.com']['cert1'][301]
+        cloudflare.api_publish(prog, api, t301, hash301)
+        records = cloudflare.api_read(prog, api, t301)
+        assert list(records) == [ hash301 ]
+        assert records[hash301] in server.records
+
+        records = cloudflare.api_read(prog, api, t311)
+        for h in records:
+            cloudflare.api_delete(prog, api, t311, records[h])
+        with pytest.raises(Except.DNSNotLive):
+            cloudflare.api_read(prog, api, t311)
+        assert cloudflare.api_read(prog, api, t211) == { 'abc': id3 }
+
+        assert listings() == 3
+
+        # the zone is listed again in the next run
+        prog = setup.create_state_obj(s)
+        api = create_local_api(server)
+        assert list(cloudflare.api_read(prog, api, t301)) == [ hash301 ]
+        # four TLSA records left
+        assert listings() == 5
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_cloudflare_batch():
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s)
+    server = CloudflareServer()
+
+    def requests():
+        return [ (r[0], r[1].split('/')[-1]) for r in server.requests ]
+
+    try:
+        api = create_local_api(server)
+        t311 = setup.create_tlsa_obj('311', '25', 'tcp', 'a.com')
+        t211 = setup.create_tlsa_obj('211', '25', 'tcp', 'a.com')
+        t301 = setup.create_tlsa_obj('301', '25', 'tcp', 'a.com')
+        hash311 = s.hash['a.com']['cert1'][311]
+        hash211 = s.hash['a.com']['cert1'][211]
+        hash301 = s.hash['a.com']['cert1'][301]
+        hash312 = s.hash['a.com']['cert1'][312]
+
+        cloudflare.api_publish(prog, api, t311, hash312)
+        old = cloudflare.api_read(prog, api, t311)[hash312]
+        del server.requests[:]
+
+        api.batch = 2
+        ops = [ cloudflare.api_publish(prog, api, t311, hash311),
+                cloudflare.api_publish(prog, api, t211, hash211),
+                cloudflare.api_publish(prog, api, t301, hash301),
+                cloudflare.api_delete(prog, api, t311, old) ]
+        assert api.queue == ops
+        assert [ op.method for op in ops ] == [ 'post' ]*3 + [ 'delete' ]
+
+        # the record is already up: not queued
+        with pytest.raises(Except.DNSSkipProcessing):
+            cloudflare.api_publish(prog, api, t311, hash312)
+
+        # nothing is sent until the queue is finished
+        assert server.requests == []
+        assert cloudflare.api_read(prog, api, t311) == { hash312: old }
+
+        server.fail.add(hash211)
+        assert cloudflare.api_finish(prog, api) == ops
+        assert api.queue == []
+
+        # the first batch failed, so its changes were made one at a time
+        assert requests() == [ ('POST', 'batch'), ('POST', 'dns_records'),
+                               ('POST', 'dns_records'), ('POST', 'batch') ]
+        assert ops[0].error is None
+        assert isinstance(ops[1].error, Except.DNSProcessingError)
+        assert ops[2].error is None
+        assert ops[3].error is None
+
+        assert ops[0].id in server.records
+        assert ops[2].id in server.records
+        assert old not in server.records
+        assert len(server.records) == 2
+
+        # the index is updated
+        assert cloudflare.api_read(prog, api, t311) == { hash311: ops[0].id }
+        assert cloudflare.api_read(prog, api, t301) == { hash301: ops[2].id }
+        with pytest.raises(Except.DNSNotLive):
+            cloudflare.api_read(prog, api, t211)
+
+        assert cloudflare.api_finish(prog, api) == []
+        assert len(server.requests) == 4
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_cloudflare_async_batch():
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s)
+    prog.jobs = 4
+    server = CloudflareServer()
+
+    try:
+        api = create_local_api(server)
+        api.client = 'async'
+        api.batch = 1
+        t311 = setup.create_tlsa_obj('311', '25', 'tcp', 'a.com')
+        t211 = setup.create_tlsa_obj('211', '25', 'tcp', 'a.com')
+        t301 = setup.create_tlsa_obj('301', '25', 'tcp', 'a.com')
+        hash311 = s.hash['a.com']['cert1'][311]
+        hash211 = s.hash['a.com']['cert1'][211]
+        hash301 = s.hash['a.com']['cert1'][301]
+
+        ops = [ cloudflare.api_publish(prog, api, t311, hash311),
+                cloudflare.api_publish(prog, api, t211, hash211),
+                cloudflare.api_publish(prog, api, t301, hash301) ]
+        del server.requests[:]
+
+        # the batches are submitted together, then the changes of the
+        # failed batch
+        server.fail.add(hash211)
+        server.delay = 0.5
+        start = datetime.datetime.now()
+        assert cloudflare.api_finish(prog, api) == ops
+        elapsed = (datetime.datetime.now() - start).total_seconds()
+        assert 1 <= elapsed < 1.5
+
+        assert sorted([ r[1].split('/')[-1] for r in server.requests ]) == \
+                            [ 'batch', 'batch', 'batch', 'dns_records' ]
+        assert ops[0].error is None
+        assert isinstance(ops[1].error, Except.DNSProcessingError)
+        assert ops[2].error is None
+        assert sorted([ ops[0].id, ops[2].id ]) == sorted(server.records)
+        assert cloudflare.api_read(prog, api, t301) == { hash301: ops[2].id }
+
+        # the client is closed at the end of the run
+        client = api.session
+        assert client.opened == 3
+        cloudflare.api_close(prog)
+        assert client.closed
+        assert not client.thread.is_alive()
+        assert prog.sessions == {}
+
+        server.delay = 0
+        api.batch = 0
+        cloudflare.api_delete(prog, api, t301, ops[2].id)
+        assert api.session is not client
+        assert ops[2].id not in server.records
+        cloudflare.api_close(prog)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_cloudflare_batch_dane():
+    s = setup.Init(keep=True)
+    server = CloudflareServer()
+    server.zones['b.com'] = 'zoneb'
+    cwd = Path.cwd()
+
+    conf = s.parent / 'cloudflare_batch.conf'
+    with open(str(conf), 'w') as file:
+        file.write('''
+            api = cloudflare email:{} key:{} zone_ttl:0 batch:10
+            [a.com]
+            tlsa = 311 12725
+            tlsa = 201 12725
+            [b.com]
+            tlsa = 311 12780
+            '''.format(server.email, server.key))
+
+    prog = setup.create_state_obj(s, config=conf, log=True)
+
+    def read_config():
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.ok
+        for t in prog.target_list:
+            t.api.url = server.url
+
+    def posthook(renewed):
+        setup.clear_state(prog)
+        read_config()
+        prog.renewed_domains = renewed
+
+        assert datafile.read(prog) == Prog.RetVal.ok
+        assert datafile.check_data(prog) == Prog.RetVal.ok
+        retval = dane.process_data(prog)
+        assert datafile.write_posthook(prog) == Prog.RetVal.ok
+
+        with open(str(prog.datafile), 'r') as file:
+            lines = [ l.split() for l in file.read().splitlines()[2:] ]
+        return retval, [ l for l in lines if len(l) == 8 ]
+
+    def batches():
+        return len([ r for r in server.requests if r[1].endswith('/batch') ])
+
+    try:
+        with prog.log:
+            read_config()
+            assert dane.init_dane_directory(prog) == Prog.RetVal.ok
+            assert dane.live_to_archive(prog) == Prog.RetVal.ok
+            assert datafile.write_prehook(prog) == Prog.RetVal.ok
+
+            # one publish fails
+            hash201 = s.hash['a.com']['cert1'][201]
+            server.fail.add(hash201)
+            retval, lines = posthook([ 'a.com', 'b.com' ])
+            assert retval == Prog.RetVal.continue_failure
+            assert batches() == 2
+
+            assert sorted([ (l[0], l[1], l[6]) for l in lines ]) == [
+                    ('a.com', '201', '1'), ('a.com', '311', '0'),
+                    ('b.com', '311', '0') ]
+            assert len(server.records) == 2
+
+            # the failed publish is retried (and queued) in the next run
+            server.fail.clear()
+            retval, lines = posthook([])
+            assert retval == Prog.RetVal.ok
+            assert batches() == 3
+
+            assert sorted([ (l[0], l[1], l[6]) for l in lines ]) == [
+                    ('a.com', '201', '0'), ('a.com', '311', '0'),
+                    ('b.com', '311', '0') ]
+            assert len(server.records) == 3
+            assert hash201 in [ r['data']['certificate']
+                                        for r in server.records.values() ]
+
+            # the prehook lines are still written
+            with open(str(prog.datafile), 'r') as file:
+                df = file.read()
+            assert str(cwd / s.archive / 'a.com' / 'cert1.pem') in df
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_cloudflare_retry(monkeypatch):
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s)
+    server = CloudflareServer()
+    monkeypatch.setattr(cloudflare, 'retry_backoff', 0.01)
+
+    try:
+        api = create_local_api(server)
+        tlsa = setup.create_tlsa_obj('311', '25', 'tcp', 'a.com')
+        hash311 = s.hash['a.com']['cert1'][311]
+
+        # idempotent calls are retried after rate limiting or server errors
+        server.status = [ 429, 503 ]
+        with pytest.raises(Except.DNSNotLive):
+            cloudflare.api_read(prog, api, tlsa)
+        assert len(server.requests) == 4
+        assert server.requests[0][1] == server.requests[1][1] == '/zones'
+
+        scheduler = prog.schedulers[(server.email, server.key)]
+        assert api.scheduler is scheduler
+        assert scheduler.throttled == 1
+        assert scheduler.retried == 2
+
+        # a rejected (429) publish is retried, a failed (5xx) one is not
+        server.status = [ 429 ]
+        cloudflare.api_publish(prog, api, tlsa, hash311)
+        assert len(server.records) == 1
+        assert scheduler.retried == 3
+
+        server.status = [ 500 ]
+        with pytest.raises(Except.DNSProcessingError):
+            cloudflare.api_publish(prog, api, tlsa,
+                                   s.hash['a.com']['cert1'][312])
+        assert len(server.records) == 1
+        assert scheduler.retried == 3
+
+        # the retry delay follows Retry-After
+        server.headers = { 'Retry-After': '0.5' }
+        server.status = [ 429 ]
+        start = datetime.datetime.now()
+        cloudflare.api_delete(prog, api, tlsa, list(server.records)[0])
+        assert (datetime.datetime.now() - start).total_seconds() >= 0.5
+        assert server.records == {}
+        server.headers = {}
+
+        # attempts are limited
+        server.status = [ 503 ] * (cloudflare.retry_attempts + 1)
+        with pytest.raises(Except.DNSProcessingError):
+            cloudflare.api_delete(prog, api, tlsa, 'id1')
+        assert server.status == [ 503 ]
+        server.status = []
+
+        # no retry budget: no retries
+        retried = scheduler.retried
+        api.retry = 0
+        server.status = [ 429 ]
+        with pytest.raises(Except.DNSProcessingError):
+            cloudflare.api_publish(prog, api, tlsa, hash311)
+        assert scheduler.retried == retried
+        assert scheduler.waited < 1
+
+        # the counts are logged at the end of the run
+        schedulers = prog.schedulers
+        prog = setup.create_state_obj(s, log=True)
+        prog.schedulers = schedulers
+        with prog.log:
+            cloudflare.api_close(prog)
+
+        with open(str(s.varlog / 'log'), 'r') as file:
+            log = file.read().splitlines()
+        assert "+++ Cloudflare calls: {} throttled, {} retried ({:.1f} seconds spent waiting to retry)".format(scheduler.throttled, retried, scheduler.waited) in log
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_request_scheduler():
+    # a burst of two calls, then five calls a second
+    scheduler = cloudflare.RequestScheduler(2, 0.4)
+    assert scheduler.acquire() == 0
+    assert scheduler.acquire() == 0
+    assert scheduler.throttled == 0
+
+    wait = scheduler.acquire()
+    assert 0.1 < wait <= 0.2
+    assert scheduler.throttled == 1
+
+    # Cloudflare says no calls remain for a second
+    scheduler = cloudflare.RequestScheduler()
+    assert scheduler.update({ 'Ratelimit': '"default";r=0;t=1' }, 200) is None
+    assert 0.8 < scheduler.acquire() <= 1
+
+    scheduler = cloudflare.RequestScheduler()
+    scheduler.update({ 'Ratelimit': '"default";r=5;t=30' }, 200)
+    assert scheduler.tokens == 5
+    assert scheduler.update({ 'Retry-After': '0.2' }, 429) == 0.2
+    assert scheduler.throttled == 1
+    assert 0.1 < scheduler.acquire() <= 0.2
+
+
+def test_cloudflare_async():
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s)
+    server = CloudflareServer()
+
+    try:
+        api = create_local_api(server)
+        api.client = 'async'
+        tlsa1 = setup.create_tlsa_obj('211', '53527', 'tcp', 'a.com')
+        tlsa2 = setup.create_tlsa_obj('311', '53527', 'tcp', 'a.com')
+        hash211 = s.hash['a.com']['cert1'][211]
+        hash311 = s.hash['a.com']['cert1'][311]
+
+        cloudflare.api_publish(prog, api, tlsa1, hash211)
+        cloudflare.api_publish(prog, api, tlsa2, hash311)
+        assert api.zone == 'zone1'
+        assert api.cloudflare is None
+
+        with pytest.raises(Except.DNSSkipProcessing):
+            cloudflare.api_publish(prog, api, tlsa1, hash211)
+
+        records211 = cloudflare.api_read(prog, api, tlsa1)
+        assert list(records211) == [ hash211 ]
+
+        cloudflare.api_delete(prog, api, tlsa1, records211[hash211])
+
+        with pytest.raises(Except.DNSNotLive):
+            cloudflare.api_read(prog, api, tlsa1)
+
+        with pytest.raises(Except.DNSProcessingError):
+            cloudflare.api_delete(prog, api, tlsa1, records211[hash211])
+
+        assert len(server.requests) == 7
+        assert server.connections == 1
+        assert isinstance(api.session, asynchttp.Client)
+
+        # calls made concurrently are multiplexed over the pooled
+        # connections
+        prog = setup.create_state_obj(s)
+        prog.jobs = 4
+        server.delay = 0.5
+        apis = [ create_local_api(server) for i in range(8) ]
+        for a in apis:
+            a.client = 'async'
+            a.zone = 'zone1'
+
+        start = datetime.datetime.now()
+        threads = [ threading.Thread(target=cloudflare.api_read,
+                                     args=(prog, a, tlsa2)) for a in apis ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = (datetime.datetime.now() - start).total_seconds()
+
+        client = apis[0].session
+        assert all([ a.session is client for a in apis ])
+        assert client.opened == 4
+        assert 1 <= elapsed < 2
+        for a in apis:
+            assert a.records == { cloudflare.record_key(tlsa2):
+                                            { hash311: 'id2' } }
+
+        # errors
+        client.close()
+        prog = setup.create_state_obj(s)
+        api = create_local_api(server)
+        api.client = 'async'
+        api.timeout = (5, 0.2)
+        with pytest.raises(Except.DNSProcessingError) as ex:
+            cloudflare.api_read(prog, api, tlsa1)
+        assert ex.value.message == "request timed out"
+        api.session.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    prog = setup.create_state_obj(s)
+    api = create_local_api(server)
+    api.client = 'async'
+    with pytest.raises(Except.DNSProcessingError) as ex:
+        cloudflare.api_read(prog, api, tlsa1)
+    assert ex.value.message == "connection error encountered"
+    api.session.close()
+
+
+
+def test_cloudflare_native_retry(monkeypatch):
+    exceptions = pytest.importorskip('CloudFlare.exceptions')
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s)
+    monkeypatch.setattr(cloudflare, 'retry_backoff', 0.01)
+
+    api = Prog.ApiCloudflare('email', 'key')
+    api.set_domain('a.com')
+
+    errors = []
+    def call(*args):
+        if errors:
+            raise exceptions.CloudFlareAPIError(errors.pop(0), "error")
+        return args
+
+    # native calls are scheduled with the account's scheduler, and are
+    # retried after rate limiting or (if idempotent) server errors
+    errors[:] = [ 429, 971, 503 ]
+    assert cloudflare.native_call(prog, api, "GET", call, 'x') == ('x',)
+    scheduler = prog.schedulers[('email', 'key')]
+    assert api.scheduler is scheduler
+    assert scheduler.throttled == 2
+    assert scheduler.retried == 3
+    assert scheduler.tokens <= scheduler.capacity - 3
+
+    # a failed (5xx) publish is not retried, nor is any other error
+    errors[:] = [ 500 ]
+    with pytest.raises(exceptions.CloudFlareAPIError):
+        cloudflare.native_call(prog, api, "POST", call)
+    errors[:] = [ 1001 ]
+    with pytest.raises(exceptions.CloudFlareAPIError):
+        cloudflare.native_call(prog, api, "GET", call)
+    assert scheduler.retried == 3
+
+    # no retry budget: no retries
+    api.retry = 0
+    errors[:] = [ 429 ]
+    with pytest.raises(exceptions.CloudFlareAPIError):
+        cloudflare.native_call(prog, api, "GET", call)
+    assert scheduler.retried == 3
+
+
+def test_asynchttp_chunked():
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            while self.rfile.readline().strip():
+                pass
+            self.wfile.write(b"HTTP/1.1 200 OK\r\n"
+                             b"Transfer-Encoding: chunked\r\n\r\n"
+                             + b"".join([ b"4\r\n" + b"%04d" % i + b"\r\n"
+                                                    for i in range(1000) ])
+                             + b"0\r\n\r\n")
+
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    client = asynchttp.Client(
+                    'http://127.0.0.1:{}'.format(server.server_address[1]))
+    try:
+        r = client.request('GET', '/', timeout=(5, 5))
+        assert r.status_code == 200
+        assert r.content == b"".join([ b"%04d" % i for i in range(1000) ])
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+
+
+def test_asynchttp_no_body():
+    responses = {
+        '/204': b"HTTP/1.1 204 No Content\r\n\r\n",
+        '/304': b"HTTP/1.1 304 Not Modified\r\nETag: x\r\n\r\n",
+        '/head': b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\n",
+        '/100': b"HTTP/1.1 100 Continue\r\n\r\n"
+                b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok",
+        '/nolength': b"HTTP/1.1 200 OK\r\n\r\nbody",
+        '/close': b"HTTP/1.1 200 OK\r\nConnection: close\r\n\r\nbody" }
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            # keep the connection open (and idle) after every response
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                while self.rfile.readline().strip():
+                    pass
+                path = line.split()[1].decode()
+                self.wfile.write(responses[path])
+                if path == '/close':
+                    return
+
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    client = asynchttp.Client(
+                    'http://127.0.0.1:{}'.format(server.server_address[1]))
+    try:
+        start = datetime.datetime.now()
+
+        # no body to read: the responses do not wait for the read timeout,
+        # and the connection is reused
+        assert client.request('GET', '/204', timeout=(5, 5)).content == b''
+        assert client.request('GET', '/304', timeout=(5, 5)).content == b''
+        r = client.request('HEAD', '/head', timeout=(5, 5))
+        assert r.status_code == 200
+        assert r.content == b''
+        r = client.request('GET', '/100', timeout=(5, 5))
+        assert r.status_code == 200
+        assert r.content == b'ok'
+        assert client.opened == 1
+
+        # a body without a length is only read to the end of a connection
+        # that the server is closing
+        assert client.request('GET', '/close', timeout=(5, 5)).content == b'body'
+        with pytest.raises(asynchttp.ConnectionError):
+            client.request('GET', '/nolength', timeout=(5, 5))
+
+        assert (datetime.datetime.now() - start).total_seconds() < 2
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_cloudflare_import():
+    # the asynchttp client is only imported for 'client:async' (it needs a
+    # later Python than the rest of the package)
+    proc = subprocess.Popen([ sys.executable, '-c',
+                              'import sys; '
+                              'from alnitak.api import cloudflare; '
+                              'print("alnitak.api.asynchttp" in sys.modules)' ],
+                            stdout=subprocess.PIPE)
+    stdout, stderr = proc.communicate(timeout=300)
+    assert stdout == b"False\n"
@@ -546,3 +546,129 @@ def test_fail_configX22():
         assert prog.letsencrypt_directory == cwd / s.le
 
 
+
+
+def test_config_exec_options():
+    s = setup.Init(keep=True)
+
+    conf = s.parent / 'exec_options.conf'
+    with open(str(conf), 'w') as file:
+        file.write('''
+            hook_deadline = 600
+            [a.com]
+            tlsa = 311 1
+            api = exec timeout:auto:60 protocol:worker {0}
+            [b.com]
+            tlsa = 311 1
+            api = exec timeout:auto {0}
+            [c.com]
+            tlsa = 311 1
+            api = exec {0}
+            '''.format(s.bin / 'dns'))
+
+    prog = setup.create_state_obj(s, config=conf)
+
+    with prog.log:
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.ok
+
+    assert prog.hook_deadline == 600
+
+    a, b, c = [ t.api for t in prog.target_list ]
+    assert (a.timeout, a.adaptive, a.protocol) == (60, True, 'worker')
+    assert (b.timeout, b.adaptive, b.protocol) == (300, True, 'env')
+    assert (c.timeout, c.adaptive, c.protocol) == (300, False, 'env')
+
+    for option in [ 'timeout:0', 'timeout:auto:', 'timeout:x',
+                    'protocol:x', 'jobs:4 protocol:batch' ]:
+        with open(str(conf), 'w') as file:
+            file.write('''
+                [a.com]
+                tlsa = 311 1
+                api = exec {} {}
+                '''.format(option, s.bin / 'dns'))
+
+        prog = setup.create_state_obj(s, config=conf)
+        with prog.log:
+            retval = config.read(prog)
+            assert retval == Prog.RetVal.config_failure
+
+    with open(str(conf), 'w') as file:
+        file.write('''
+            hook_deadline = 0
+            [a.com]
+            tlsa = 311 1
+            api = exec {}
+            '''.format(s.bin / 'dns'))
+
+    prog = setup.create_state_obj(s, config=conf)
+    with prog.log:
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.config_failure
+
+
+def test_config_cloudflare_options():
+    s = setup.Init(keep=True)
+
+    conf = s.parent / 'cloudflare_options.conf'
+    with open(str(conf), 'w') as file:
+        file.write('''
+            [a.com]
+            tlsa = 311 1
+            api = cloudflare email:user@a.com key:abc
+            [x.a.com]
+            tlsa = 311 1
+            api = cloudflare email:user@a.com key:abc batch:50 client:async
+            [y.a.com]
+            tlsa = 311 1
+            api = cloudflare email:user@a.com key:abc retry:0 zone_ttl:0
+            [z.a.com]
+            tlsa = 311 1
+            api = cloudflare email:user@a.com key:abc
+            ''')
+
+    prog = setup.create_state_obj(s, config=conf)
+
+    with prog.log:
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.ok
+
+    # only targets with the same options share an api object
+    a, x, y, z = [ t.api for t in prog.target_list ]
+    assert a is z
+    assert x is not a and y is not a and x is not y
+    assert (a.batch, a.client, a.retry, a.zone_ttl) == \
+                                            (0, 'requests', 300, 7*24*60*60)
+    assert (x.batch, x.client, x.retry, x.zone_ttl) == \
+                                            (50, 'async', 300, 7*24*60*60)
+    assert (y.batch, y.client, y.retry, y.zone_ttl) == (0, 'requests', 0, 0)
+
+
+def test_config_datafile_format():
+    s = setup.Init(keep=True)
+
+    conf = s.parent / 'datafile_format.conf'
+    for param, value, retval in [
+                ('datafile_format', 'journal', Prog.RetVal.ok),
+                ('datafile_format', 'sqlite', Prog.RetVal.ok),
+                ('datafile_format', 'text', Prog.RetVal.ok),
+                ('datafile_format', 'binary', Prog.RetVal.config_failure),
+                ('datafile_format', 'text journal',
+                                            Prog.RetVal.config_failure),
+                ('datafile_loading', 'lazy', Prog.RetVal.ok),
+                ('datafile_loading', 'full', Prog.RetVal.ok),
+                ('datafile_loading', 'some', Prog.RetVal.config_failure) ]:
+        with open(str(conf), 'w') as file:
+            file.write('''
+                {} = {}
+                [a.com]
+                tlsa = 311 1
+                api = exec {}
+                '''.format(param, value, s.bin / 'dns'))
+
+        prog = setup.create_state_obj(s, config=conf)
+        with prog.log:
+            assert config.read(prog) == retval
+
+        if retval == Prog.RetVal.ok:
+            assert getattr(prog, param) == value
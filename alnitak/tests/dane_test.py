@@ -0,0 +1,1377 @@
+import os
+import sys
+import pwd
+import shlex
+import subprocess
+import datetime
+import pytest
+from pathlib import Path
+
+from alnitak import config
+from alnitak import datafile
+from alnitak import journal
+from alnitak import store
+from alnitak import prog as Prog
+from alnitak import dane
+from alnitak import exceptions as Except
+from alnitak.api import exec as exec_api
+from alnitak.tests import setup
+
+
+def test_process_data_jobs():
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s, log=True)
+    cwd = Path.cwd()
+
+    with prog.log:
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = dane.init_dane_directory(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = dane.live_to_archive(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = datafile.write_prehook(prog)
+        assert retval == Prog.RetVal.ok
+
+
+        # posthook with all domains renewed, processed concurrently
+        setup.clear_state(prog)
+        ptime = "{:%s}".format(prog.timenow)
+        prog.jobs = 3
+
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.ok
+
+        prog.renewed_domains = [ 'a.com', 'b.com', 'c.com' ]
+
+        retval = datafile.read(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = datafile.check_data(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = dane.process_data(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = datafile.write_posthook(prog)
+        assert retval == Prog.RetVal.ok
+
+    with open(str(prog.datafile), 'r') as file:
+        df = file.read().splitlines()
+
+    df_lines = []
+    for k in df[2:]:
+        df_lines += [ shlex.split(k) ]
+
+    lines = []
+    for d in [ 'a.com', 'b.com', 'c.com' ]:
+        for c in [ 'cert1.pem', 'chain1.pem', 'fullchain1.pem',
+                   'privkey1.pem' ]:
+            lines += [ setup.prehook_line(s, cwd, d, c, 1) ]
+    lines += [
+            [ 'a.com', '311', '12725', 'tcp', 'a.com', ptime, '0',
+              s.hash['a.com']['cert1'][311] ],
+            [ 'a.com', '201', '12725', 'tcp', 'a.com', ptime, '0',
+              s.hash['a.com']['cert1'][201] ],
+            [ 'b.com', '311', '12780', 'udp', 'b.com', ptime, '0',
+              s.hash['b.com']['cert1'][311] ],
+            [ 'b.com', '201', '12780', 'sctp', 'A.b.com', ptime, '0',
+              s.hash['b.com']['cert1'][201] ],
+            [ 'c.com', '311', '12722', 'tcp', 'A.c.com', ptime, '0',
+              s.hash['c.com']['cert1'][311] ],
+            [ 'c.com', '311', '12723', 'tcp', 'B.c.com', ptime, '0',
+              s.hash['c.com']['cert1'][311] ],
+            ]
+    assert sorted(df_lines) == sorted(lines)
+
+    # lines are still written out in group order
+    assert [ l[0] for l in df_lines ] == sorted([ l[0] for l in df_lines ])
+
+    with open(str(s.data / 'calls'), 'r') as file:
+        cl = file.read().splitlines()
+
+    calls = [
+            setup.call_line('p', "", 311, s.hash['a.com']['cert1'][311]),
+            setup.call_line('p', "", 201, s.hash['a.com']['cert1'][201]),
+            setup.call_line('p', "", 311, s.hash['b.com']['cert1'][311]),
+            setup.call_line('p', "", 201, s.hash['b.com']['cert1'][201]),
+            setup.call_line('p', "", 311, s.hash['c.com']['cert1'][311]),
+            setup.call_line('p', "", 311, s.hash['c.com']['cert1'][311]),
+            ]
+    assert sorted(cl) == sorted(calls)
+
+    # the log output of every group is kept together, in group order
+    with open(str(s.varlog / 'log'), 'r') as file:
+        log = file.read().splitlines()
+
+    groups = [ i for i, l in enumerate(log)
+                            if l.startswith("+++ prehook line: domain ") ]
+    assert len(groups) == 3
+    for i, d in zip(groups, [ 'a.com', 'b.com', 'c.com' ]):
+        assert "'{}'".format(d) in log[i]
+
+    publish = [ i for i, l in enumerate(log)
+                    if l.startswith(" ++ will attempt to publish TLSA") ]
+    assert len(publish) == 6
+    assert groups[0] < publish[0] < publish[1] < groups[1]
+    assert groups[1] < publish[2] < publish[3] < groups[2]
+    assert groups[2] < publish[4] < publish[5]
+
+
+def test_group_state():
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s)
+
+    st = Prog.GroupState(prog)
+    assert st.ttl == prog.ttl
+    assert st.cert_cache is prog.cert_cache
+    assert st.log is not prog.log
+
+    st.log.info1("one")
+    st.log.error("two")
+    st.log.info3("three")
+    assert st.log.messages == [ ('info1', 'one'), ('error', 'two'),
+                                ('info3', 'three') ]
+
+
+def test_data_index():
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s, log=True)
+
+    with prog.log:
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.ok
+
+        data = Prog.Data()
+        t311 = setup.create_tlsa_obj('311', '12725', 'tcp', 'a.com')
+        t201 = setup.create_tlsa_obj('201', '12725', 'tcp', 'a.com')
+
+        p1 = Prog.DataPost('a.com', 1, t311, '0', '100', 'aaaa')
+        p2 = Prog.DataPost('a.com', 2, t201, '0', '100', 'aaaa')
+        p3 = Prog.DataPost('a.com', 3, t311, '0', '200', 'aaaa')
+        d1 = Prog.DataDelete('b.com', 4, t311, '1', '100', 'aaaa')
+        p4 = Prog.DataPost('x.com', 5, t311, '0', '100', 'aaaa')
+        for l in [ p1, d1, p2, p3, p4 ]:
+            data.add_line(prog, l)
+
+        assert [ g.domain for g in data.groups ] == [ 'a.com', 'b.com',
+                                                     'x.com' ]
+        assert data.index['a.com'] is data.groups[0]
+        assert data.groups[0].target is prog.target_list[0]
+        assert data.groups[2].target == None
+
+        # equal lines (the time is not compared) are only added once
+        group = data.groups[0]
+        assert group.post == [ p1, p2 ]
+        assert group.post[0] is p1
+
+        # lines are compared as they are now, not as they were added
+        p1.pending_on()
+        group.add_post(p3)
+        assert group.post == [ p1, p2, p3 ]
+
+        group.remove_post(p1)
+        assert group.post == [ p2, p3 ]
+        group.add_post(Prog.DataPost('a.com', 0, t311, '1', '300', 'aaaa'))
+        assert len(group.post) == 3
+
+        # loading is not quadratic in the number of lines
+        start = datetime.datetime.now()
+        for i in range(20000):
+            data.add_line(prog, Prog.DataPost('c.com', i, t311, '0', '100',
+                                              "{:064x}".format(i)))
+        assert (datetime.datetime.now() - start).total_seconds() < 5
+        assert len(data.index['c.com'].post) == 20000
+
+
+def test_datafile_parse():
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s, log=True)
+
+    with prog.log:
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.ok
+
+        with open(str(prog.datafile), 'w') as file:
+            file.write(
+                '\n'
+                '  # a comment\n'
+                'a.com "{0}/a.com/cert.pem" "{0}/a.com/cert.pem" '
+                    '"/x y/cert1.pem" 0\n'
+                'a.com 311 25 tcp a.com 100 0 aaaa\n'
+                'a.com 201 25 tcp a.com 100 1 bbbb trailing\n'
+                'b.com delete 311 25 tcp b.com 100 2 cccc\n'
+                'b.com\n'
+                'b.com delete 311 25 tcp b.com 100 2\n'
+                'b.com 311 25 tcp\n'.format(s.live))
+
+        retval = datafile.read(prog)
+        assert retval == Prog.RetVal.exit_failure
+
+    assert [ g.domain for g in prog.data.groups ] == [ 'a.com', 'b.com' ]
+    a, b = prog.data.groups
+    assert a.pre[0].lineno == 3
+    assert a.pre[0].cert.archive_path == '/x y/cert1.pem'
+    assert [ (l.lineno, l.tlsa.params(), l.pending, l.hash) for l in a.post ] \
+            == [ (4, '311', '0', 'aaaa'), (5, '201', '1', 'bbbb') ]
+    assert [ (l.lineno, l.count, l.hash) for l in b.special ] == \
+                                                    [ (6, '2', 'cccc') ]
+
+    with open(str(s.varlog / 'log'), 'r') as file:
+        log = file.read()
+    for line in [ 7, 8, 9 ]:
+        assert "line {}: malformed line".format(line) in log
+    assert "line 1:" not in log
+    assert "line 2:" not in log
+
+    # the patterns are compiled once
+    assert datafile.line_patterns(prog) is datafile.line_patterns(prog)
+
+
+def test_datafile_write():
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s, log=True)
+
+    with prog.log:
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = dane.init_dane_directory(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = dane.live_to_archive(prog)
+        assert retval == Prog.RetVal.ok
+
+        with open(str(prog.datafile), 'w') as file:
+            file.write('# old line\n')
+        prog.datafile.chmod(0o644)
+
+        retval = datafile.write_prehook(prog)
+        assert retval == Prog.RetVal.ok
+
+        # prehook lines are added to the lines already there
+        with open(str(prog.datafile), 'r') as file:
+            df = file.read().splitlines()
+        assert df[0] == '# old line'
+        assert len(df) == 3 + 12
+        assert prog.datafile.stat().st_mode & 0o777 == 0o600
+        assert [ f.name for f in prog.datafile.parent.iterdir() ] == \
+                                                    [ prog.datafile.name ]
+
+        if os.geteuid() == 0:
+            # root can write to the directory anyway
+            return
+
+        # a failed write leaves the datafile as it was
+        prog.datafile.parent.chmod(0o500)
+        try:
+            retval = datafile.write_prehook(prog)
+            assert retval == Prog.RetVal.exit_failure
+        finally:
+            prog.datafile.parent.chmod(0o700)
+
+        with open(str(prog.datafile), 'r') as file:
+            assert file.read().splitlines() == df
+        assert [ f.name for f in prog.datafile.parent.iterdir() ] == \
+                                                    [ prog.datafile.name ]
+
+
+def test_datafile_journal():
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s, log=True)
+    cwd = Path.cwd()
+
+    with prog.log:
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.ok
+        prog.datafile_format = 'journal'
+
+        retval = dane.init_dane_directory(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = dane.live_to_archive(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = datafile.write_prehook(prog)
+        assert retval == Prog.RetVal.ok
+
+        assert journal.is_journal(prog.datafile)
+        j = journal.load(prog.datafile)
+        assert (len(j.lines), j.records, j.dropped) == (12, 12, 0)
+
+        # the same prehook lines are not added again
+        retval = datafile.write_prehook(prog)
+        assert retval == Prog.RetVal.ok
+        assert journal.load(prog.datafile).size == j.size
+
+        # posthook only appends the lines that changed
+        setup.clear_state(prog)
+        ptime = "{:%s}".format(prog.timenow)
+
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.ok
+        prog.datafile_format = 'journal'
+        prog.renewed_domains = [ 'a.com', 'b.com', 'c.com' ]
+
+        retval = datafile.read(prog)
+        assert retval == Prog.RetVal.ok
+        assert len(prog.journal.lines) == 12
+
+        retval = datafile.check_data(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = dane.process_data(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = datafile.write_posthook(prog)
+        assert retval == Prog.RetVal.ok
+
+        # 12 prehook lines changed (pending) and 6 posthook lines added
+        j = journal.load(prog.datafile)
+        assert (len(j.lines), j.records) == (18, 12 + 12 + 12 + 6)
+
+        # an incomplete record at the end is discarded, and overwritten
+        with open(str(prog.datafile), 'ab') as file:
+            file.write(b'\x00\x00\x01\x00abc')
+
+        setup.clear_state(prog)
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.ok
+        prog.datafile_format = 'journal'
+
+        retval = datafile.read(prog)
+        assert retval == Prog.RetVal.ok
+        assert (len(prog.journal.lines), prog.journal.dropped) == (18, 7)
+
+        for l in prog.data.groups[0].post:
+            l.state = Prog.DataLineState.skip
+        retval = datafile.write_posthook(prog)
+        assert retval == Prog.RetVal.ok
+
+        j = journal.load(prog.datafile)
+        assert (len(j.lines), j.records, j.dropped) == (16, 44, 0)
+
+        # compaction replaces the journal with a snapshot of its lines
+        prog.journal.compact_minimum = 0
+        prog.data.groups[1].post[0].state = Prog.DataLineState.skip
+        retval = datafile.write_posthook(prog)
+        assert retval == Prog.RetVal.ok
+
+        j = journal.load(prog.datafile)
+        assert (len(j.lines), j.records) == (15, 15)
+        assert prog.datafile.stat().st_mode & 0o777 == 0o600
+
+    # conversion to and from the text format
+    text = s.parent / 'datafile.txt'
+    journal.export_text(prog.datafile, text)
+    with open(str(text), 'r') as file:
+        df = file.read().splitlines()
+    assert df[1:] == list(j.lines)
+    lines = [ setup.prehook_line(s, cwd, d, c, 1)
+                    for d in [ 'a.com', 'b.com', 'c.com' ]
+                    for c in [ 'cert1.pem', 'chain1.pem', 'fullchain1.pem',
+                               'privkey1.pem' ] ]
+    lines += [ [ 'b.com', '201', '12780', 'sctp', 'A.b.com', ptime, '0',
+                 s.hash['b.com']['cert1'][201] ],
+               [ 'c.com', '311', '12722', 'tcp', 'A.c.com', ptime, '0',
+                 s.hash['c.com']['cert1'][311] ],
+               [ 'c.com', '311', '12723', 'tcp', 'B.c.com', ptime, '0',
+                 s.hash['c.com']['cert1'][311] ] ]
+    assert sorted([ shlex.split(l) for l in df[1:] ]) == sorted(lines)
+
+    journal.import_text(text, s.parent / 'datafile.journal')
+    assert list(journal.load(s.parent / 'datafile.journal').lines) == df[1:]
+
+    # a journal datafile is converted by the next write
+    prog.datafile_format = 'text'
+    with prog.log:
+        retval = datafile.write_posthook(prog)
+        assert retval == Prog.RetVal.ok
+
+    assert not journal.is_journal(prog.datafile)
+    with open(str(prog.datafile), 'r') as file:
+        df_text = journal.text_lines(file.read())
+    assert sorted(df_text) == sorted(df[1:])
+
+
+def test_journal_torn_append():
+    s = setup.Init(keep=True)
+    path = s.parent / 'torn.journal'
+    old = 'a.com 311 25 tcp a.com 100 1 aaaa'
+    new = 'a.com 311 25 tcp a.com 200 0 aaaa'
+    with open(str(path), 'wb') as file:
+        file.write(journal.snapshot([ old ]))
+
+    j = journal.load(path)
+    size = j.size
+    records = j.changes([ new ])
+    assert records == [ (journal.remove, old), (journal.add, new) ]
+    journal.append(path, j, records)
+    assert list(journal.load(path).lines) == [ new ]
+    assert journal.load(path).records == 3
+
+    with open(str(path), 'rb') as file:
+        data = file.read()
+
+    # an append cut short (here, inside its second change, once its first
+    # change was written) is discarded as a whole
+    second = size + journal.header.size + len('*-{}\n'.format(old)) + 5
+    for end in [ second, size + 3, len(data) - 1 ]:
+        with open(str(path), 'wb') as file:
+            file.write(data[:end])
+        j = journal.load(path)
+        assert list(j.lines) == [ old ]
+        assert (j.records, j.size, j.dropped) == (1, size, end - size)
+
+    # and is overwritten by the next append
+    journal.append(path, j, j.changes([ new ]))
+    j = journal.load(path)
+    assert (list(j.lines), j.dropped) == ([ new ], 0)
+    with open(str(path), 'rb') as file:
+        assert file.read() == data
+
+
+def test_datafile_store():
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s, log=True)
+
+    def read(renewed=[], ttl=None, format='sqlite'):
+        setup.clear_state(prog)
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.ok
+        prog.datafile_format = format
+        prog.renewed_domains = renewed
+        if ttl is not None:
+            prog.ttl = ttl
+        retval = datafile.read(prog)
+        assert retval == Prog.RetVal.ok
+
+    def rows():
+        with store.open_store(prog.datafile) as conn:
+            return [ datafile.line_text(l) for l in store.load(conn) ]
+
+    with prog.log:
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.ok
+        prog.datafile_format = 'sqlite'
+
+        retval = dane.init_dane_directory(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = dane.live_to_archive(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = datafile.write_prehook(prog)
+        assert retval == Prog.RetVal.ok
+
+        assert store.is_store(prog.datafile)
+        assert prog.datafile.stat().st_mode & 0o777 == 0o600
+        assert len(rows()) == 12
+
+        # prehook lines only: every domain has work to do
+        read()
+        assert prog.store.domains == set([ 'a.com', 'b.com', 'c.com' ])
+
+        prog.renewed_domains = [ 'a.com', 'b.com', 'c.com' ]
+        retval = dane.process_data(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = datafile.write_posthook(prog)
+        assert retval == Prog.RetVal.ok
+
+        all_rows = rows()
+        assert len(all_rows) == 12 + 6
+
+        conn = store.connect(prog.datafile)
+        try:
+            mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        finally:
+            conn.close()
+        assert mode == 'wal'
+
+        # nothing to do: no lines are read, and the store is kept
+        read()
+        assert prog.store.domains == set()
+        assert prog.data.groups == []
+
+        retval = datafile.write_posthook(prog)
+        assert retval == Prog.RetVal.ok
+        assert rows() == all_rows
+
+        # only the lines of the renewed domains are read, and replaced
+        read(renewed=[ 'b.com' ])
+        assert [ g.domain for g in prog.data.groups ] == [ 'b.com' ]
+        assert (len(prog.data.groups[0].pre),
+                len(prog.data.groups[0].post)) == (4, 2)
+
+        for l in prog.data.groups[0].post:
+            l.write_state_off()
+        retval = datafile.write_posthook(prog)
+        assert retval == Prog.RetVal.ok
+
+        b_post = [ l for l in all_rows if l.startswith('b.com ')
+                                            and '"' not in l ]
+        assert len(b_post) == 2
+        assert sorted(rows()) == sorted([ l for l in all_rows
+                                                    if l not in b_post ])
+
+        # posthook lines whose time-to-live has passed are work to do
+        read(ttl=0)
+        assert [ g.domain for g in prog.data.groups ] == [ 'a.com', 'c.com' ]
+
+        # a store is read in full if converted to text
+        read(format='text')
+        assert prog.store.domains is None
+        assert len(prog.data.groups) == 3
+
+        retval = datafile.write_posthook(prog)
+        assert retval == Prog.RetVal.ok
+
+    assert not store.is_store(prog.datafile)
+    with open(str(prog.datafile), 'r') as file:
+        df = journal.text_lines(file.read())
+    assert sorted(df) == sorted([ l for l in all_rows if l not in b_post ])
+    assert sorted([ f.name for f in prog.datafile.parent.iterdir() ]) == \
+                                                    [ prog.datafile.name ]
+
+    # and a text datafile is converted to a store
+    with prog.log:
+        read(renewed=[ 'a.com', 'b.com', 'c.com' ], format='sqlite')
+        assert prog.store is None
+        retval = datafile.write_posthook(prog)
+        assert retval == Prog.RetVal.ok
+
+    assert sorted(rows()) == sorted(df)
+
+    # a store that cannot be read is an error
+    with open(str(prog.datafile), 'wb') as file:
+        file.write(store.magic + b'\x00' * 200)
+    with pytest.raises(store.Error):
+        rows()
+
+    with prog.log:
+        setup.clear_state(prog)
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.ok
+        prog.datafile_format = 'sqlite'
+        retval = datafile.read(prog)
+        assert retval == Prog.RetVal.exit_failure
+
+
+def test_datafile_lazy():
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s, log=True)
+
+    now = int("{:%s}".format(prog.timenow))
+    old = now - prog.ttl - 1
+    pre = '{0} "/d/{0}/cert.pem" "/l/{0}/cert.pem" "/a/{0}/cert1.pem" {1}'
+    df = [ pre.format('a.com', 1),
+           'a.com 311 25 tcp a.com {} 0 aaaa'.format(now),
+           pre.format('b.com', 1),
+           'b.com 311 25 tcp b.com {} 1 bbbb'.format(now),
+           pre.format('c.com', 1),
+           'c.com 311 25 tcp c.com {} 0 cccc'.format(old),
+           '# comment',
+           'd.com delete 311 25 tcp d.com {} 1 dddd'.format(now),
+           pre.format('e.com', 0),
+           pre.format('f.com', 1),
+           'f.com 311 25 tcp f.com {} 0 ffff'.format(now),
+           'a.com 201 25 tcp a.com {} 0 aaab'.format(now) ]
+
+    def read(loading, lines):
+        setup.clear_state(prog)
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.ok
+        prog.datafile_loading = loading
+        prog.renewed_domains = [ 'f.com' ]
+
+        with open(str(prog.datafile), 'w') as file:
+            file.write("".join([ l + '\n' for l in lines ]))
+        return datafile.read(prog)
+
+    with prog.log:
+        assert read('full', df) == Prog.RetVal.ok
+        assert len(prog.data.groups) == 6
+        assert prog.data.unloaded == []
+
+        # a.com: no work to do, and not renewed
+        assert read('lazy', df) == Prog.RetVal.ok
+        assert [ g.domain for g in prog.data.groups ] == [
+                            'b.com', 'c.com', 'd.com', 'e.com', 'f.com' ]
+        assert prog.data.groups[0].pre[0].lineno == 3
+        assert prog.data.unloaded == [ df[0], df[1], df[11] ]
+
+        # lines not read are written out as they were
+        retval = datafile.write_posthook(prog)
+        assert retval == Prog.RetVal.ok
+
+        with open(str(prog.datafile), 'r') as file:
+            written = journal.text_lines(file.read())
+        assert sorted(written) == sorted([ l for l in df if l[0] != '#' ])
+        assert written[-3:] == [ df[0], df[1], df[11] ]
+
+        # a line that cannot be classified is read (and reported)
+        assert read('lazy', df + [ 'a.com 311 25 tcp' ]) == \
+                                                Prog.RetVal.exit_failure
+        assert prog.data.groups[0].domain == 'a.com'
+        assert prog.data.unloaded == []
+
+
+def test_data_deadlines(capsys):
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s, log=True)
+
+    now = int("{:%s}".format(prog.timenow))
+    old = now - prog.ttl - 1
+    pre = '{0} "/d/{0}/cert.pem" "/l/{0}/cert.pem" "/a/{0}/cert1.pem" {1}'
+    df = [ pre.format('a.com', 1),
+           'a.com 311 25 tcp a.com {} 0 aaaa'.format(now - 10),
+           pre.format('b.com', 1),
+           'b.com 311 25 tcp b.com {} 1 bbbb'.format(now),
+           pre.format('c.com', 1),
+           'c.com 311 25 tcp c.com {} 0 cccc'.format(old),
+           'd.com delete 311 25 tcp d.com {} 1 dddd'.format(now),
+           pre.format('e.com', 0),
+           pre.format('f.com', 1),
+           'f.com 311 25 tcp f.com {} 0 ffff'.format(now) ]
+
+    def read(lines, loading='full', renewed=[]):
+        setup.clear_state(prog)
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.ok
+        prog.datafile_loading = loading
+        prog.renewed_domains = renewed
+
+        with open(str(prog.datafile), 'w') as file:
+            file.write("".join([ l + '\n' for l in lines ]))
+        assert datafile.read(prog) == Prog.RetVal.ok
+
+    def work():
+        return [ g.domain for g in prog.data.work_groups(prog) ]
+
+    with prog.log:
+        # a.com: waiting for its time-to-live value to pass
+        read(df, renewed=[ 'f.com' ])
+        assert work() == [ 'b.com', 'c.com', 'd.com', 'e.com', 'f.com' ]
+        assert prog.data.pending == set([ 'b.com' ])
+        assert prog.data.next_due(prog) == now
+
+        read(df)
+        assert work() == [ 'b.com', 'c.com', 'd.com', 'e.com' ]
+
+        # only waiting left to do
+        waiting = df[0:2] + df[8:10]
+        read(waiting)
+        assert work() == []
+        assert prog.data.deadlines[0] == (now - 10, 'a.com')
+        assert prog.data.next_due(prog) == now - 10 + prog.ttl
+
+        ttl = prog.ttl
+        prog.ttl = 5
+        assert work() == [ 'a.com' ]
+        assert prog.data.next_due(prog) == now
+        prog.ttl = ttl
+
+        # the lines not read are still taken into account
+        read(waiting, loading='lazy')
+        assert prog.data.groups == []
+        assert prog.data.next_due(prog) == now - 10 + prog.ttl
+
+        capsys.readouterr()
+        prog.ttl = 100
+        setup.clear_state(prog)
+        assert datafile.next_due(prog) == Prog.RetVal.ok
+        assert capsys.readouterr().out == "{}\n".format(now - 10 + 100)
+
+        read([ '# no lines' ])
+        assert prog.data.next_due(prog) == None
+
+        prog.datafile.unlink()
+        setup.clear_state(prog)
+        assert datafile.next_due(prog) == Prog.RetVal.ok
+        assert capsys.readouterr().out == "none\n"
+
+
+def test_record_slots():
+    port = "".join([ '2', '5' ])
+    t1 = Prog.Tlsa('311', port, 'tcp', 'a.com')
+    t2 = Prog.Tlsa("".join([ '3', '1', '1' ]), '25', "".join([ 't', 'c', 'p' ]),
+                   'a.com')
+
+    # shared values are kept once
+    assert t1.port is t2.port
+    assert t1.param is t2.param
+    assert t1.protocol is t2.protocol
+    assert (t1.usage, t1.selector, t1.matching) == ('3', '1', '1')
+    assert t1.params() == '311'
+    assert t1 == t2
+
+    p = Prog.DataPost('a.com', 1, t1, '0', '100', 'aaaa')
+    d = Prog.DataDelete('a.com', 2, t2, '1', '100', 'aaaa')
+    pre = Prog.DataPre('a.com', 3, '/d/cert.pem', '/l/cert.pem',
+                       '/a/cert1.pem', '0')
+    for obj in [ t1, p, d, pre, pre.cert, Prog.Target('a.com') ]:
+        assert not hasattr(obj, '__dict__')
+        with pytest.raises(AttributeError):
+            obj.unknown = True
+
+    assert pre.cert.live == Path('/l/cert.pem')
+    assert pre.cert == Prog.Cert(Path('/d/cert.pem'), '/l/cert.pem',
+                                 '/a/cert1.pem')
+
+
+def test_exec_jobs():
+    s = setup.Init(keep=True)
+    cwd = Path.cwd()
+
+    # a program that takes a while to return
+    slow = s.bin / 'slow'
+    with open(str(slow), 'w') as file:
+        file.write('#!/bin/sh\nsleep 0.5\nexec {} "$@"\n'.format(s.binary))
+    slow.chmod(0o755)
+
+    conf = s.parent / 'exec_jobs.conf'
+    with open(str(conf), 'w') as file:
+        file.write('''
+            api = exec jobs:6 {} --is-up=201
+            [a.com]
+            tlsa = 311 12725
+            tlsa = 201 12725
+            [b.com]
+            tlsa = 311 12780 udp
+            tlsa = 201 12780 sctp A.b.com
+            [c.com]
+            tlsa = 311 12722 A.c.com
+            tlsa = 311 12723 B.c.com
+            '''.format(slow))
+
+    prog = setup.create_state_obj(s, config=conf, log=True)
+
+    with prog.log:
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.ok
+        assert prog.target_list[0].api.jobs == 6
+
+        retval = dane.init_dane_directory(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = dane.live_to_archive(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = datafile.write_prehook(prog)
+        assert retval == Prog.RetVal.ok
+
+        setup.clear_state(prog)
+        ptime = "{:%s}".format(prog.timenow)
+
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.ok
+
+        prog.renewed_domains = [ 'a.com', 'b.com', 'c.com' ]
+
+        retval = datafile.read(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = datafile.check_data(prog)
+        assert retval == Prog.RetVal.ok
+
+        start = datetime.datetime.now()
+        retval = dane.process_data(prog)
+        assert retval == Prog.RetVal.ok
+        elapsed = (datetime.datetime.now() - start).total_seconds()
+
+        retval = datafile.write_posthook(prog)
+        assert retval == Prog.RetVal.ok
+
+    # the six programs (for all three domains) ran at the same time
+    assert elapsed < 1.5
+
+    with open(str(prog.datafile), 'r') as file:
+        df = file.read().splitlines()
+
+    df_lines = []
+    for k in df[2:]:
+        df_lines += [ shlex.split(k) ]
+
+    # the '201' records were already up: no posthook lines for them
+    lines = []
+    for d in [ 'a.com', 'b.com', 'c.com' ]:
+        for c in [ 'cert1.pem', 'chain1.pem', 'fullchain1.pem',
+                   'privkey1.pem' ]:
+            lines += [ setup.prehook_line(s, cwd, d, c, 1) ]
+    lines += [
+            [ 'a.com', '311', '12725', 'tcp', 'a.com', ptime, '0',
+              s.hash['a.com']['cert1'][311] ],
+            [ 'b.com', '311', '12780', 'udp', 'b.com', ptime, '0',
+              s.hash['b.com']['cert1'][311] ],
+            [ 'c.com', '311', '12722', 'tcp', 'A.c.com', ptime, '0',
+              s.hash['c.com']['cert1'][311] ],
+            [ 'c.com', '311', '12723', 'tcp', 'B.c.com', ptime, '0',
+              s.hash['c.com']['cert1'][311] ],
+            ]
+    assert sorted(df_lines) == sorted(lines)
+
+    with open(str(s.data / 'calls'), 'r') as file:
+        cl = file.read().splitlines()
+
+    calls = [
+        setup.call_line('p', "--is-up=201", 311, s.hash['a.com']['cert1'][311]),
+        setup.call_line('p', "--is-up=201", 201, s.hash['a.com']['cert1'][201]),
+        setup.call_line('p', "--is-up=201", 311, s.hash['b.com']['cert1'][311]),
+        setup.call_line('p', "--is-up=201", 201, s.hash['b.com']['cert1'][201]),
+        setup.call_line('p', "--is-up=201", 311, s.hash['c.com']['cert1'][311]),
+        setup.call_line('p', "--is-up=201", 311, s.hash['c.com']['cert1'][311]),
+        ]
+    assert sorted(cl) == sorted(calls)
+
+
+def write_batch_program(path, data, body):
+    with open(str(path), 'w') as file:
+        file.write('''#!{}
+import sys, json
+with open({!r}, 'a') as file:
+    file.write('start\\n')
+{}
+'''.format(sys.executable, str(data / 'starts'), body))
+    path.chmod(0o755)
+
+def test_exec_batch():
+    s = setup.Init(keep=True)
+    cwd = Path.cwd()
+
+    # records each operation as the test program does, and returns '1' for
+    # the (already up) '201' records
+    batch = s.bin / 'batch'
+    write_batch_program(batch, s.data, '''
+calls = open({!r}, 'a')
+for line in sys.stdin:
+    req = json.loads(line)
+    calls.write(':{{}}:{{}}:{{}}:{{}}:\\n'.format(req['TLSA_OPERATION'],
+            req['TLSA_PARAM'], req['TLSA_HASH'], req.get('TLSA_LIVE_HASH', '')))
+    print("working on {{}}".format(req['TLSA_DOMAIN']))
+    print(json.dumps({{ 'id': req['id'],
+                       'status': 1 if req['TLSA_PARAM'] == '201' else 0 }}))
+'''.format(str(s.data / 'calls')))
+
+    conf = s.parent / 'exec_batch.conf'
+    with open(str(conf), 'w') as file:
+        file.write('''
+            api = exec protocol:batch {}
+            [a.com]
+            tlsa = 311 12725
+            tlsa = 201 12725
+            [b.com]
+            tlsa = 311 12780 udp
+            tlsa = 201 12780 sctp A.b.com
+            [c.com]
+            tlsa = 311 12722 A.c.com
+            tlsa = 311 12723 B.c.com
+            '''.format(batch))
+
+    prog = setup.create_state_obj(s, config=conf, log=True)
+
+    with prog.log:
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.ok
+        assert prog.target_list[0].api.protocol == 'batch'
+
+        retval = dane.init_dane_directory(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = dane.live_to_archive(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = datafile.write_prehook(prog)
+        assert retval == Prog.RetVal.ok
+
+        setup.clear_state(prog)
+        ptime = "{:%s}".format(prog.timenow)
+
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.ok
+
+        prog.renewed_domains = [ 'a.com', 'b.com', 'c.com' ]
+
+        retval = datafile.read(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = datafile.check_data(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = dane.process_data(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = datafile.write_posthook(prog)
+        assert retval == Prog.RetVal.ok
+
+    # the program was run once for all six records
+    with open(str(s.data / 'starts'), 'r') as file:
+        assert file.read().splitlines() == [ 'start' ]
+
+    with open(str(prog.datafile), 'r') as file:
+        df = file.read().splitlines()
+
+    df_lines = []
+    for k in df[2:]:
+        df_lines += [ shlex.split(k) ]
+
+    lines = []
+    for d in [ 'a.com', 'b.com', 'c.com' ]:
+        for c in [ 'cert1.pem', 'chain1.pem', 'fullchain1.pem',
+                   'privkey1.pem' ]:
+            lines += [ setup.prehook_line(s, cwd, d, c, 1) ]
+    lines += [
+            [ 'a.com', '311', '12725', 'tcp', 'a.com', ptime, '0',
+              s.hash['a.com']['cert1'][311] ],
+            [ 'b.com', '311', '12780', 'udp', 'b.com', ptime, '0',
+              s.hash['b.com']['cert1'][311] ],
+            [ 'c.com', '311', '12722', 'tcp', 'A.c.com', ptime, '0',
+              s.hash['c.com']['cert1'][311] ],
+            [ 'c.com', '311', '12723', 'tcp', 'B.c.com', ptime, '0',
+              s.hash['c.com']['cert1'][311] ],
+            ]
+    assert sorted(df_lines) == sorted(lines)
+
+    with open(str(s.data / 'calls'), 'r') as file:
+        cl = file.read().splitlines()
+
+    calls = [
+            setup.call_line('p', "", 311, s.hash['a.com']['cert1'][311]),
+            setup.call_line('p', "", 201, s.hash['a.com']['cert1'][201]),
+            setup.call_line('p', "", 311, s.hash['b.com']['cert1'][311]),
+            setup.call_line('p', "", 201, s.hash['b.com']['cert1'][201]),
+            setup.call_line('p', "", 311, s.hash['c.com']['cert1'][311]),
+            setup.call_line('p', "", 311, s.hash['c.com']['cert1'][311]),
+            ]
+    assert cl == calls
+
+    with open(str(s.varlog / 'log'), 'r') as file:
+        log = file.read()
+    assert "(stdout) working on a.com" in log
+
+def test_exec_batch_results():
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s, log=True)
+
+    # answers the first two operations only, then fails
+    batch = s.bin / 'batch'
+    write_batch_program(batch, s.data, '''
+reqs = [ json.loads(line) for line in sys.stdin ]
+print(json.dumps({ 'id': reqs[1]['id'], 'status': 130 }))
+print(json.dumps({ 'id': reqs[0]['id'], 'status': 1 }))
+sys.exit(2)
+''')
+
+    api = Prog.ApiExec([ str(batch) ])
+    api.protocol = 'batch'
+    api.set_domain('a.com')
+    t311 = setup.create_tlsa_obj('311', '25', 'tcp', 'a.com')
+
+    with prog.log:
+        assert exec_api.api_delete(prog, api, t311, 'aaaa', 'bbbb')
+        assert exec_api.api_publish(prog, api, t311, 'bbbb')
+        assert exec_api.api_delete(prog, api, t311, 'cccc', None)
+        made = exec_api.api_finish(prog, api)
+
+    assert len(made) == 3
+    assert api.queue == []
+
+    # publishes are sent first: the publish has id 0
+    assert isinstance(made[1].error, Except.DNSSkipProcessing)
+    assert isinstance(made[0].error, Except.DNSNoReturnError)
+    assert isinstance(made[2].error, Except.DNSProcessingError)
+    assert "no result" in made[2].error.message
+
+def test_exec_worker():
+    s = setup.Init(keep=True)
+    cwd = Path.cwd()
+
+    worker = s.bin / 'worker'
+    write_batch_program(worker, s.data, '''
+calls = open({!r}, 'a')
+for line in sys.stdin:
+    req = json.loads(line)
+    calls.write(':{{}}:{{}}:{{}}:{{}}:\\n'.format(req['TLSA_OPERATION'],
+            req['TLSA_PARAM'], req['TLSA_HASH'], req.get('TLSA_LIVE_HASH', '')))
+    calls.flush()
+    print("working on {{}}".format(req['TLSA_DOMAIN']), flush=True)
+    print(json.dumps({{ 'id': req['id'],
+                       'status': 1 if req['TLSA_PARAM'] == '201' else 0 }}),
+          flush=True)
+'''.format(str(s.data / 'calls')))
+
+    conf = s.parent / 'exec_worker.conf'
+    with open(str(conf), 'w') as file:
+        file.write('''
+            api = exec protocol:worker {}
+            [a.com]
+            tlsa = 311 12725
+            tlsa = 201 12725
+            [b.com]
+            tlsa = 311 12780 udp
+            tlsa = 201 12780 sctp A.b.com
+            [c.com]
+            tlsa = 311 12722 A.c.com
+            tlsa = 311 12723 B.c.com
+            '''.format(worker))
+
+    prog = setup.create_state_obj(s, config=conf, log=True)
+
+    with prog.log:
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.ok
+        assert prog.target_list[0].api.protocol == 'worker'
+
+        retval = dane.init_dane_directory(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = dane.live_to_archive(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = datafile.write_prehook(prog)
+        assert retval == Prog.RetVal.ok
+
+        setup.clear_state(prog)
+        ptime = "{:%s}".format(prog.timenow)
+        prog.jobs = 3
+
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.ok
+
+        prog.renewed_domains = [ 'a.com', 'b.com', 'c.com' ]
+
+        retval = datafile.read(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = datafile.check_data(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = dane.process_data(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = datafile.write_posthook(prog)
+        assert retval == Prog.RetVal.ok
+
+    # one worker, for all the domains, stopped at the end of the run
+    with open(str(s.data / 'starts'), 'r') as file:
+        assert file.read().splitlines() == [ 'start' ]
+    assert prog.workers == {}
+
+    with open(str(prog.datafile), 'r') as file:
+        df = file.read().splitlines()
+
+    df_lines = []
+    for k in df[2:]:
+        df_lines += [ shlex.split(k) ]
+
+    lines = []
+    for d in [ 'a.com', 'b.com', 'c.com' ]:
+        for c in [ 'cert1.pem', 'chain1.pem', 'fullchain1.pem',
+                   'privkey1.pem' ]:
+            lines += [ setup.prehook_line(s, cwd, d, c, 1) ]
+    lines += [
+            [ 'a.com', '311', '12725', 'tcp', 'a.com', ptime, '0',
+              s.hash['a.com']['cert1'][311] ],
+            [ 'b.com', '311', '12780', 'udp', 'b.com', ptime, '0',
+              s.hash['b.com']['cert1'][311] ],
+            [ 'c.com', '311', '12722', 'tcp', 'A.c.com', ptime, '0',
+              s.hash['c.com']['cert1'][311] ],
+            [ 'c.com', '311', '12723', 'tcp', 'B.c.com', ptime, '0',
+              s.hash['c.com']['cert1'][311] ],
+            ]
+    assert sorted(df_lines) == sorted(lines)
+
+    with open(str(s.data / 'calls'), 'r') as file:
+        cl = file.read().splitlines()
+
+    calls = [
+            setup.call_line('p', "", 311, s.hash['a.com']['cert1'][311]),
+            setup.call_line('p', "", 201, s.hash['a.com']['cert1'][201]),
+            setup.call_line('p', "", 311, s.hash['b.com']['cert1'][311]),
+            setup.call_line('p', "", 201, s.hash['b.com']['cert1'][201]),
+            setup.call_line('p', "", 311, s.hash['c.com']['cert1'][311]),
+            setup.call_line('p', "", 311, s.hash['c.com']['cert1'][311]),
+            ]
+    assert sorted(cl) == sorted(calls)
+
+    with open(str(s.varlog / 'log'), 'r') as file:
+        log = file.read()
+    assert "(stdout) working on a.com" in log
+
+def test_exec_worker_restart():
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s, log=True)
+
+    # exits without answering the first time it is run
+    worker = s.bin / 'worker'
+    write_batch_program(worker, s.data, '''
+import os
+for line in sys.stdin:
+    req = json.loads(line)
+    if not os.path.exists({!r}):
+        open({!r}, 'w').close()
+        sys.exit(3)
+    print(json.dumps({{ 'id': req['id'], 'status': 0 }}), flush=True)
+'''.format(str(s.data / 'crashed'), str(s.data / 'crashed')))
+
+    # never answers
+    broken = s.bin / 'broken'
+    write_batch_program(broken, s.data, 'sys.exit(3)')
+
+    t311 = setup.create_tlsa_obj('311', '25', 'tcp', 'a.com')
+
+    api = Prog.ApiExec([ str(worker) ])
+    api.protocol = 'worker'
+    api.set_domain('a.com')
+    api2 = api.copy()
+    api2.set_domain('b.com')
+
+    bapi = Prog.ApiExec([ str(broken) ])
+    bapi.protocol = 'worker'
+    bapi.set_domain('a.com')
+
+    with prog.log:
+        assert exec_api.api_publish(prog, api, t311, 'aaaa') == None
+        assert exec_api.api_delete(prog, api2, t311, 'bbbb', 'aaaa') == None
+
+        with open(str(s.data / 'starts'), 'r') as file:
+            assert len(file.read().splitlines()) == 2
+        assert len(prog.workers) == 1
+
+        with pytest.raises(Except.DNSProcessingError) as ex:
+            exec_api.api_publish(prog, bapi, t311, 'aaaa')
+        assert "without answering" in ex.value.message
+
+        with open(str(s.data / 'starts'), 'r') as file:
+            assert len(file.read().splitlines()) == 4
+        assert len(prog.workers) == 2
+
+        exec_api.api_close(prog)
+        assert prog.workers == {}
+
+def test_exec_timeout():
+    s = setup.Init(keep=True)
+
+    # a program that hangs (in a child process, that must be killed too)
+    hang = s.bin / 'hang'
+    with open(str(hang), 'w') as file:
+        file.write('#!/bin/sh\nsleep 5\nexec {} "$@"\n'.format(s.binary))
+    hang.chmod(0o755)
+
+    conf = s.parent / 'exec_timeout.conf'
+    with open(str(conf), 'w') as file:
+        file.write('''
+            api = exec timeout:1 {}
+            [a.com]
+            tlsa = 311 12725
+            '''.format(hang))
+
+    prog = setup.create_state_obj(s, config=conf, log=True)
+
+    with prog.log:
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.ok
+        assert prog.target_list[0].api.timeout == 1
+        assert not prog.target_list[0].api.adaptive
+
+        retval = dane.init_dane_directory(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = dane.live_to_archive(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = datafile.write_prehook(prog)
+        assert retval == Prog.RetVal.ok
+
+        setup.clear_state(prog)
+        ptime = "{:%s}".format(prog.timenow)
+
+        retval = config.read(prog)
+        assert retval == Prog.RetVal.ok
+
+        prog.renewed_domains = [ 'a.com' ]
+
+        retval = datafile.read(prog)
+        assert retval == Prog.RetVal.ok
+
+        retval = datafile.check_data(prog)
+        assert retval == Prog.RetVal.ok
+
+        start = datetime.datetime.now()
+        # the timeout is not a failure...
+        retval = dane.process_data(prog)
+        assert retval == Prog.RetVal.ok
+        elapsed = (datetime.datetime.now() - start).total_seconds()
+
+        retval = datafile.write_posthook(prog)
+        assert retval == Prog.RetVal.ok
+
+    assert elapsed < 3
+
+    with open(str(prog.datafile), 'r') as file:
+        df = file.read().splitlines()
+
+    # ...the record is left pending, to be published on the next run
+    assert shlex.split(df[-1]) == [ 'a.com', '311', '12725', 'tcp', 'a.com',
+                                    ptime, '1', s.hash['a.com']['cert1'][311] ]
+
+    assert not (s.data / 'calls').exists()
+
+def test_exec_hook_times():
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s, log=True)
+
+    times = prog.hook_times
+    cmd = [ 'prog', 'arg' ]
+
+    # not enough run times to adapt to yet
+    for i in range(times.samples - 1):
+        times.record(cmd, 1)
+    assert times.timeout(cmd, 300, True) == 300
+
+    times.record(cmd, 1)
+    assert times.timeout(cmd, 300, True) == times.minimum
+    assert times.timeout(cmd, 300, False) == 300
+    assert times.timeout(cmd, 5, True) == 5
+
+    times.record(cmd, 20)
+    assert times.timeout(cmd, 300, True) == 20 * times.factor
+
+    # only the latest run times are kept
+    for i in range(times.keep):
+        times.record(cmd, 2)
+    assert times.history[tuple(cmd)] == [ 2 ] * times.keep
+    assert times.timeout(cmd, 300, True) == times.minimum
+
+    # no deadline until one is given
+    times.start(None)
+    assert times.remaining() == None
+
+    # a program that takes a while to return
+    slow = s.bin / 'slow'
+    with open(str(slow), 'w') as file:
+        file.write('#!/bin/sh\nsleep 0.6\nexec {} "$@"\n'.format(s.binary))
+    slow.chmod(0o755)
+
+    api = Prog.ApiExec([ str(slow) ])
+    api.set_domain('a.com')
+    t311 = setup.create_tlsa_obj('311', '25', 'tcp', 'a.com')
+    prog.hook_deadline = 1
+
+    with prog.log:
+        exec_api.api_publish(prog, api, t311, 'aaaa')
+        assert 0 < times.remaining() < 0.5
+
+        # the deadline passes whilst the program runs...
+        with pytest.raises(Except.DNSNoReturnError) as ex:
+            exec_api.api_publish(prog, api, t311, 'bbbb')
+        assert "timed out" in ex.value.message
+
+        # ...and no more programs are run
+        with pytest.raises(Except.DNSNoReturnError) as ex:
+            exec_api.api_publish(prog, api, t311, 'cccc')
+        assert "deadline" in ex.value.message
+
+    with open(str(s.data / 'calls'), 'r') as file:
+        assert file.read().splitlines() == [
+                                    setup.call_line('p', "", 311, 'aaaa') ]
+    assert len(times.history[tuple(api.command)]) == 2
+
+def test_exec_output():
+    s = setup.Init(keep=True)
+    prog = setup.create_state_obj(s, log=True)
+
+    # chatty on both streams
+    chatty = s.bin / 'chatty'
+    write_batch_program(chatty, s.data, '''
+for i in range(1000):
+    print("trace {:04} ".format(i) + "x" * 80)
+    print("warn {:04}".format(i), file=sys.stderr)
+print("no newline at the end", end='')
+''')
+
+    # writes some output, then hangs
+    hang = s.bin / 'hang'
+    write_batch_program(hang, s.data, '''
+import time
+print("started", flush=True)
+time.sleep(5)
+''')
+
+    api = Prog.ApiExec([ str(chatty) ])
+    api.output_limit = 4096
+    api.set_domain('a.com')
+    t311 = setup.create_tlsa_obj('311', '25', 'tcp', 'a.com')
+
+    hapi = Prog.ApiExec([ str(hang) ])
+    hapi.timeout = 1
+    hapi.set_domain('a.com')
+
+    with prog.log:
+        exec_api.api_publish(prog, api, t311, 'aaaa')
+
+        # the output written before the program was killed is logged
+        with pytest.raises(Except.DNSNoReturnError):
+            exec_api.api_publish(prog, hapi, t311, 'aaaa')
+
+    with open(str(s.varlog / 'log'), 'r') as file:
+        log = file.read().splitlines()
+
+    out = [ l for l in log if l.startswith("(stdout) trace ") ]
+    err = [ l for l in log if l.startswith("(stderr) warn ") ]
+    assert out[0] == "(stdout) trace 0000 " + "x" * 80
+    assert err[0] == "(stderr) warn 0000"
+    assert 0 < sum(len(l) - 8 for l in out + err) <= 4096
+    assert len(out) + len(err) < 2000
+    assert log.count("    - command returned:") == 3
+    assert [ l for l in log if "bytes of output not logged (limit: 4096 bytes)" in l ]
+    assert "(stdout) no newline at the end" not in log
+
+    assert "(stdout) started" in log
+
+
+def test_exec_privs():
+    api = Prog.ApiExec(['/bin/true'])
+    assert exec_api.popen_privs(api) == (['/bin/true'], {})
+
+    user = pwd.getpwnam('nobody')
+    api = Prog.ApiExec(['/bin/true'], uid=user.pw_uid)
+    command, privs = exec_api.popen_privs(api)
+    if sys.version_info >= (3, 9):
+        # the privileges are dropped by Popen, without a preexec_fn
+        assert command == ['/bin/true']
+        assert privs == { "user": user.pw_uid, "group": user.pw_gid,
+                          "extra_groups": os.getgrouplist(user.pw_name,
+                                                          user.pw_gid),
+                          "umask": 0o027 }
+    else:
+        assert command[-1] == '/bin/true'
+        assert privs == {}
+
+    # the wrapper script used before Python 3.9
+    script = str(Path(exec_api.__file__).parent / 'privs.py')
+    proc = subprocess.Popen([ sys.executable, '-I', script,
+                              str(user.pw_uid), str(user.pw_gid), '',
+                              'sh', '-c', 'id -u; id -G; umask' ],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = proc.communicate(timeout=300)
+    if os.getuid() == 0:
+        assert proc.returncode == 0
+        assert stdout.decode().split() == [ str(user.pw_uid),
+                                                 str(user.pw_gid), '0027' ]
+    else:
+        assert proc.returncode == 126
+        assert stderr.decode().startswith(
+                "dropping privileges to user '{}' failed: ".format(user.pw_uid))
+
+    if os.getuid() == 0:
+        proc = subprocess.Popen([ sys.executable, '-I', script,
+                                  str(user.pw_uid), str(user.pw_gid), '',
+                                  '/nonexistent/program' ],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = proc.communicate(timeout=300)
+        assert proc.returncode == 127
+        assert stderr.decode() == "command '/nonexistent/program': no such file or directory\n"
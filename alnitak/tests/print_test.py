@@ -328,3 +328,50 @@ def test_printX2():
 
 
 
+
+
+
+def test_print_jobs():
+    s = setup.Init(keep=True)
+
+    args = [ '-lno', '-Lno', '-c', str(s.config), '-C', str(s.le),
+             '201:archive/c.com',
+             '311:a.com',
+             '300:archive/nonexistent.com',
+             '311:archive/b.com',
+             '302:live/c.com/cert.pem',
+             '211:archive/c.com' ]
+
+    p = Popen(['alnitak', 'print'] + args, stdout=PIPE, stderr=PIPE)
+    stdout1, stderr1 = p.communicate(timeout=300)
+    assert p.returncode == prog.RetVal.exit_failure.value
+
+    p = Popen(['alnitak', 'print', '-j', '4'] + args, stdout=PIPE, stderr=PIPE)
+    stdout4, stderr4 = p.communicate(timeout=300)
+    assert p.returncode == prog.RetVal.exit_failure.value
+
+    # output identical (and in the same order) to serial generation, with
+    # the error only affecting the failed input
+    assert stdout4 == stdout1
+    assert stderr4 == stderr1
+    assert len(stderr4.decode('ascii').splitlines()) == 1
+    assert 'nonexistent.com' in stderr4.decode('ascii')
+
+    cdata = stdout4.decode('ascii').splitlines()
+    assert len(cdata) == 11
+    assert cdata[3] == tos(s, 'a.com', 311, 'cert') or \
+           cdata[3] == tos(s, 'a.com', 311, 'fullchain')
+
+
+def test_printX_jobs():
+    s = setup.Init(keep=True)
+
+    for j in [ '0', '257', 'x' ]:
+        p = Popen(['alnitak', 'print', '-lno', '-Lno', '-j', j,
+                                       '311:a.com'],
+                  stdout=PIPE, stderr=PIPE)
+
+        stdout, stderr = p.communicate(timeout=300)
+        assert p.returncode == 2
+        assert len(stdout) == 0
+        assert len(stderr) > 0
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Measure the time taken to read a datafile.
+
+Writes a synthetic datafile (prehook, posthook and delete lines for many
+domains, and some comments), and reports the time 'datafile.read' takes
+to read it into the program state (the best of a few runs).
+
+Usage:
+    python3 benchmarks/datafile_read.py [NUM_LINES]
+"""
+
+import sys
+import time
+import pathlib
+import tempfile
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from alnitak import prog as Prog
+from alnitak import datafile
+
+
+def write_datafile(path, num, domains):
+    with open(str(path), 'w') as file:
+        file.write("# alnitak benchmark\n# posthook mode 2019-01-01\n")
+        for i in range(num):
+            d = "d{}.example.com".format(i % domains)
+            kind = i % 10
+            if kind == 0:
+                file.write('{0} "/etc/alnitak/dane/{0}/cert{1}.pem" "/etc/letsencrypt/live/{0}/cert{1}.pem" "/etc/letsencrypt/archive/{0}/cert{1}.pem" 1\n'.format(d, i))
+            elif kind < 7:
+                file.write("{0} 311 {1} tcp {0} 1560000000 0 {2:064x}\n".format(d, 25 + kind, i))
+            elif kind < 9:
+                file.write("{0} delete 211 {1} udp {0} 1560000000 2 {2:064x}\n".format(d, 25 + kind, i))
+            else:
+                file.write("\n# comment {}\n".format(i))
+
+def read_datafile(path, domains):
+    prog = Prog.State(lock=False, testing=True)
+    prog.log.set_no_logging()
+    prog.datafile = path
+    prog.target_list = [ Prog.Target("d{}.example.com".format(i))
+                                                    for i in range(domains) ]
+
+    start = time.perf_counter()
+    retval = datafile.read(prog)
+    elapsed = time.perf_counter() - start
+
+    assert retval == Prog.RetVal.ok
+    return elapsed
+
+def main():
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    domains = 1000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = pathlib.Path(tmp) / 'datafile'
+        write_datafile(path, num, domains)
+        with open(str(path)) as file:
+            lines = sum(1 for l in file)
+
+        best = min(read_datafile(path, domains) for run in range(3))
+
+    print("read {} lines in {:.3f}s ({:.0f} lines/s)".format(
+                                                lines, best, lines / best))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Measure the memory used by every datafile record.
+
+Makes a number of datafile lines, and reports the memory (as traced by
+'tracemalloc') held by the objects made from them, per line. The lines
+are split into fields as they are read, as they would be when read from
+a datafile, so every field is a new string: the memory includes the
+fields kept by the objects (e.g. the certificate hash, which is unique to
+every record whatever the representation).
+
+Usage:
+    python3 benchmarks/record_memory.py [NUM]
+"""
+
+import sys
+import pathlib
+import tracemalloc
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from alnitak import prog as Prog
+
+
+def posthook_lines(num):
+    return [ "{}.com 311 {} tcp {}.com 1560000000 0 {:064x}".format(
+                    i % 100, 25 + i % 3, i % 100, i) for i in range(num) ]
+
+def delete_lines(num):
+    return [ "{}.com 211 {} udp {}.com 2 1560000000 {:064x}".format(
+                    i % 100, 25 + i % 3, i % 100, i) for i in range(num) ]
+
+def prehook_lines(num):
+    return [ "{0}.com /etc/alnitak/dane/{0}.com/cert.pem /etc/letsencrypt/live/{0}.com/cert.pem /etc/letsencrypt/archive/{0}.com/cert1.pem 0".format(i) for i in range(num) ]
+
+def make_post(line):
+    f = line.split()
+    return Prog.DataPost(f[0], 1, Prog.Tlsa(f[1], f[2], f[3], f[4]), f[6],
+                         f[5], f[7])
+
+def make_delete(line):
+    f = line.split()
+    return Prog.DataDelete(f[0], 1, Prog.Tlsa(f[1], f[2], f[3], f[4]), f[5],
+                           f[6], f[7])
+
+def make_pre(line):
+    f = line.split()
+    return Prog.DataPre(f[0], 1, f[1], f[2], f[3], f[4])
+
+def measure(lines, make):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    records = [ make(l) for l in lines ]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # the list itself is not part of any record
+    return (after - before - sys.getsizeof(records)) / len(records)
+
+def main():
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    print("bytes per record ({} records):".format(num))
+    for name, lines, make in [
+                ('posthook (DataPost)', posthook_lines(num), make_post),
+                ('delete (DataDelete)', delete_lines(num), make_delete),
+                ('prehook (DataPre)', prehook_lines(num), make_pre) ]:
+        print("  {:<22} {:8.1f}".format(name, measure(lines, make)))
+
+if __name__ == '__main__':
+    main()